@@ -0,0 +1,72 @@
+"""
+Compares the outer join and the union + groupBy modes of
+aggregate.aggregate_daily_pageviews on synthetic hourly pageview files
+and checks that both produce the same daily counts.
+
+    PYTHONPATH=. python benchmarks/bench_daily_aggregation.py --lines 200000
+"""
+
+import argparse
+import datetime
+import random
+import tempfile
+import time
+from pathlib import Path
+from typing import List
+
+from pyspark.sql import SparkSession
+
+import lsde2021.aggregate as agg
+
+
+def synthetic_hourly_pageviews(
+    date: datetime.date, src: Path, lines: int, seed: int = 0
+) -> None:
+    rng = random.Random(seed)
+    wikis = ["de", "en", "fr", "nl"]
+    for _, path in agg.hourly_pageview_files(date, src):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w") as f:
+            for _ in range(lines):
+                f.write(
+                    f"{rng.choice(wikis)} Page_{rng.randrange(lines)} "
+                    f"{rng.randrange(1, 100)} 0\n"
+                )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lines", type=int, default=200_000)
+    parser.add_argument("--driver-memory", type=str, default="4g")
+    args = parser.parse_args()
+
+    spark = (
+        SparkSession.builder.master("local[*]")
+        .config("spark.driver.memory", args.driver_memory)
+        .getOrCreate()
+    )
+    date = datetime.date(2021, 1, 1)
+    with tempfile.TemporaryDirectory() as tmp:
+        src = Path(tmp) / "hourly"
+        synthetic_hourly_pageviews(date, src, args.lines)
+
+        results = {}
+        modes: List[agg.AGGREGATION_MODES] = ["union", "join"]
+        for mode in modes:
+            start = time.time()
+            out = agg.aggregate_daily_pageviews(
+                date, spark, src=src, dest=Path(tmp) / mode, force=True, mode=mode
+            )
+            elapsed = time.time() - start
+            results[mode] = spark.read.parquet(str(out)).select(
+                "domain_code", "page_title", "view_count"
+            )
+            print(f"{mode:>6}: {elapsed:.2f}s")
+
+        diff = results["union"].exceptAll(results["join"]).count()
+        diff += results["join"].exceptAll(results["union"]).count()
+        print(f"rows differing between modes: {diff}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Compares the pages per second of topics.freq_bfs_tree on a networkx graph
+with the batched topics.freq_bfs_trees on the CSR graph, and of
+topics.find_topics with topics.page_topics_table, using a synthetic
+category graph.
+
+    PYTHONPATH=. python benchmarks/bench_freq_bfs.py --categories 50000 --pages 200000
+"""
+
+import argparse
+import random
+import time
+
+import networkx as nx
+import numpy as np
+
+import lsde2021.topics as topics
+
+
+def synthetic_graph(n_categories: int, n_pages: int, seed: int = 0) -> nx.DiGraph:
+    rng = random.Random(seed)
+    g = nx.DiGraph()
+    offset = n_pages + 1
+    for c in range(n_categories):
+        g.add_node(offset + c, title=f"Category_{c}", is_category=True)
+    for c in range(1, n_categories):
+        # link to a few more general categories with a lower id
+        for _ in range(rng.randint(1, 4)):
+            g.add_edge(offset + c, offset + int(c * rng.random()))
+    for page in range(1, n_pages + 1):
+        g.add_node(page, title=f"Page_{page}", is_category=False)
+        for _ in range(rng.randint(1, 6)):
+            g.add_edge(page, offset + rng.randrange(n_categories))
+    return g
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--categories", type=int, default=50_000)
+    parser.add_argument("--pages", type=int, default=200_000)
+    parser.add_argument("--depth-limit", type=int, default=4)
+    parser.add_argument("--serial-pages", type=int, default=1_000)
+    args = parser.parse_args()
+
+    g = synthetic_graph(args.categories, args.pages)
+    csr = topics.CategoryGraph.from_networkx(g)
+    pages = list(range(1, args.pages + 1))
+
+    start = time.time()
+    for page in pages[: args.serial_pages]:
+        topics.freq_bfs_tree(g, page, depth_limit=args.depth_limit)
+    serial = args.serial_pages / (time.time() - start)
+    print(f"freq_bfs_tree:  {serial:.0f} pages/s")
+
+    start = time.time()
+    topics.freq_bfs_trees(csr, pages, depth_limit=args.depth_limit)
+    batched = len(pages) / (time.time() - start)
+    print(f"freq_bfs_trees: {batched:.0f} pages/s ({batched / serial:.1f}x)")
+
+    start = time.time()
+    topics.freq_bfs_arrays(csr, pages, depth_limit=args.depth_limit)
+    arrays = len(pages) / (time.time() - start)
+    print(f"freq_bfs_arrays: {arrays:.0f} pages/s ({arrays / serial:.1f}x)")
+
+    words = topics.TopicWords.build(csr, processes=1)
+    start = time.time()
+    for page in pages[: args.serial_pages]:
+        topics.find_topics(page, g, depth_limit=args.depth_limit)
+    serial = args.serial_pages / (time.time() - start)
+    print(f"find_topics: {serial:.0f} pages/s")
+
+    start = time.time()
+    topics.page_topics_table(csr, np.array(pages), args.depth_limit, words=words)
+    table = len(pages) / (time.time() - start)
+    print(f"page_topics_table: {table:.0f} pages/s ({table / serial:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Compares reading a synthetic multi-block pageview_complete like bz2 file
+with bz2.open against the parallel block decompression of utils.fopen.
+
+    PYTHONPATH=. python benchmarks/bench_parallel_bz2.py --lines 2000000 --processes 8
+"""
+
+import argparse
+import bz2
+import os
+import random
+import tempfile
+import time
+from pathlib import Path
+from typing import Optional
+
+import lsde2021.utils as utils
+
+
+def synthetic_pageviews(path: Path, lines: int, seed: int = 0) -> None:
+    rng = random.Random(seed)
+    wikis = ["de.wikipedia", "en.wikipedia", "fr.wikipedia", "nl.wikipedia"]
+    with bz2.open(path, "wb", compresslevel=9) as f:
+        for i in range(lines):
+            f.write(
+                b"%s Page_%d %d desktop %d A%dB%d\n"
+                % (
+                    wikis[i * len(wikis) // lines].encode(),
+                    rng.randrange(10**7),
+                    rng.randrange(10**7),
+                    rng.randrange(1000),
+                    rng.randrange(500),
+                    rng.randrange(500),
+                )
+            )
+
+
+def read_all(path: Path, processes: Optional[int] = None) -> int:
+    size = 0
+    with utils.fopen(path, mode="rb", processes=processes) as f:
+        for data in iter(lambda: f.read(1024 * 1024), b""):
+            size += len(data)
+    return size
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lines", type=int, default=2_000_000)
+    parser.add_argument("--processes", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "pageviews-synthetic-user.bz2"
+        synthetic_pageviews(path, args.lines)
+        compressed = path.stat().st_size
+        print(f"synthetic file: {compressed / 1024 ** 2:.1f} MiB compressed")
+
+        for name, processes in [("bz2.open", None), ("parallel", args.processes)]:
+            start = time.time()
+            size = read_all(path, processes=processes)
+            elapsed = time.time() - start
+            print(
+                f"{name:>10} ({processes or 1} processes): {elapsed:.2f}s, "
+                f"{size / 1024 ** 2 / elapsed:.1f} MiB/s decompressed"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Compares the decompression throughput of a pageview_complete bz2 file (with
+bz2 and parallel_bz2) with the seekable zstd file it is transcoded into, and
+the time of random access reads by frame. Uses a real file or synthetic
+pageview lines.
+
+    PYTHONPATH=. python benchmarks/bench_seekable_zstd.py --file pageviews-20210101-user.bz2
+"""
+
+import argparse
+import bz2
+import random
+import tempfile
+import time
+from pathlib import Path
+from typing import IO, Any, Callable
+
+import lsde2021.download as dl
+import lsde2021.parallel_bz2 as parallel_bz2
+import lsde2021.seekable_zstd as seekable_zstd
+
+
+def write_synthetic_file(path: Path, lines: int) -> None:
+    rng = random.Random(0)
+    wikis = [b"en.wikipedia", b"de.wikipedia", b"nl.wikipedia", b"fy.wikipedia"]
+    with bz2.open(path, "wb", compresslevel=9) as f:
+        for start in range(0, lines, 100_000):
+            f.write(
+                b"".join(
+                    b"%s Page_%d %d desktop %d A%dB%d\n"
+                    % (
+                        wikis[start * len(wikis) // lines],
+                        rng.randrange(10**7),
+                        rng.randrange(10**7),
+                        rng.randrange(1000),
+                        rng.randrange(50),
+                        rng.randrange(50),
+                    )
+                    for _ in range(min(100_000, lines - start))
+                )
+            )
+
+
+def throughput(name: str, open_func: Callable[[], IO[Any]], size: int) -> float:
+    start = time.time()
+    with open_func() as f:
+        n = sum(len(data) for data in iter(lambda: f.read(1024 * 1024), b""))
+    assert n == size
+    seconds = time.time() - start
+    print(f"{name}: {seconds:.2f}s ({size / 1024 ** 2 / seconds:.1f} MiB/s)")
+    return seconds
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--file", help="pageview_complete bz2 file")
+    parser.add_argument("--lines", type=int, default=2_000_000)
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--level", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(args.file) if args.file else Path(tmp) / "pageviews-user.bz2"
+        if not args.file:
+            write_synthetic_file(path, args.lines)
+        dest = Path(tmp) / "pageviews-user.zst"
+        dl.transcode_to_zstd(path, dest, level=args.level, processes=args.processes)
+        frames = seekable_zstd.read_frames(dest)
+        size = sum(f.decompressed_size for f in frames)
+        print(
+            f"{size / 1024 ** 2:.0f} MiB: bz2 {path.stat().st_size / 1024 ** 2:.1f} "
+            f"MiB, zstd {dest.stat().st_size / 1024 ** 2:.1f} MiB "
+            f"({len(frames)} frames)"
+        )
+
+        bz2_time = throughput("bz2", lambda: bz2.open(path, "rb"), size)
+        throughput(
+            f"parallel bz2 ({args.processes} processes)",
+            lambda: parallel_bz2.open_parallel(path, "rb", processes=args.processes),
+            size,
+        )
+        for threads in [1, args.processes]:
+            seconds = throughput(
+                f"seekable zstd ({threads} threads)",
+                lambda: seekable_zstd.open_seekable(dest, "rb", processes=threads),
+                size,
+            )
+            print(f"  {bz2_time / seconds:.1f}x faster than bz2")
+
+        rng = random.Random(0)
+        with seekable_zstd.open_seekable(dest, "rb", processes=1) as f:
+            start = time.time()
+            for _ in range(100):
+                f.seek(rng.randrange(size))
+                f.read(4096)
+            seconds = (time.time() - start) / 100
+        print(f"random 4 KiB read: {seconds * 1000:.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Compares the titles per second of topics.split_by_pattern with trying each
+of topics.patterns in order, over the cat_title column of a category table
+written by csv.write_sql_dump_parquet or synthetic titles.
+
+    PYTHONPATH=. python benchmarks/bench_split_patterns.py --titles enwiki-category.parquet
+"""
+
+import argparse
+import random
+import re
+import time
+from typing import List, Tuple
+
+import pyarrow.parquet as pq
+
+import lsde2021.topics as topics
+
+WORDS = ["Sports", "Football_clubs", "Music", "History", "Buildings", "Novels"]
+WORDS += ["People", "Rivers", "Films", "Economy", "Politicians", "Albums"]
+PLACES = ["Germany", "the_Netherlands", "Europe", "Amsterdam", "France", "Asia"]
+TEMPLATES = [
+    "{word}_in_{place}",
+    "{word}_of_{place}",
+    "{word}_by_country",
+    "{year}_in_{place}",
+    "{year}s_{word}",
+    "20th-century_{word}_in_{place}",
+    "{word}_and_{word}",
+    "{word}_from_{place}",
+    "{word}_({place})",
+    "{place}_{word}",
+    "{word}",
+]
+
+
+def synthetic_titles(n: int, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    return [
+        rng.choice(TEMPLATES).format(
+            word=rng.choice(WORDS),
+            place=rng.choice(PLACES),
+            year=rng.randint(1800, 2021),
+        )
+        for _ in range(n)
+    ]
+
+
+def sequential_split_by_pattern(s: str) -> Tuple[List[str], bool]:
+    for pattern, _ in topics.patterns:
+        match = re.fullmatch(pattern, s)
+        if match:
+            return list(match.groups()), True
+    return [s], False
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--titles", help="parquet file with a cat_title column")
+    parser.add_argument("--n", type=int, default=200_000)
+    args = parser.parse_args()
+
+    if args.titles:
+        titles = pq.read_table(args.titles, columns=["cat_title"])
+        titles = titles.column("cat_title").to_pylist()[: args.n]
+    else:
+        titles = synthetic_titles(args.n)
+    matched = sum(topics.split_by_pattern(title)[1] for title in titles)
+    print(f"{len(titles)} titles, {matched / len(titles):.0%} match a pattern")
+
+    start = time.time()
+    for title in titles:
+        sequential_split_by_pattern(title)
+    sequential = len(titles) / (time.time() - start)
+    print(f"sequential patterns: {sequential:.0f} titles/s")
+
+    start = time.time()
+    for title in titles:
+        topics.split_by_pattern(title)
+    combined = len(titles) / (time.time() - start)
+    print(
+        f"split_by_pattern:    {combined:.0f} titles/s ({combined / sequential:.1f}x)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Measures the throughput of converting a synthetic categorylinks mysql dump
+into parquet with csv.write_sql_dump_parquet, in MB/s of compressed input.
+
+    PYTHONPATH=. python benchmarks/bench_sql_dump.py --rows 2000000
+"""
+
+import argparse
+import gzip
+import random
+import tempfile
+import time
+from pathlib import Path
+
+import lsde2021.csv as csvutil
+
+
+def synthetic_categorylinks(
+    path: Path, rows: int, rows_per_insert: int = 2000, seed: int = 0
+) -> None:
+    rng = random.Random(seed)
+    with gzip.open(path, "wt") as f:
+        f.write("-- MySQL dump\n")
+        for start in range(0, rows, rows_per_insert):
+            values = []
+            for i in range(start, min(rows, start + rows_per_insert)):
+                title = f"Category_{rng.randrange(10 ** 5)}"
+                if i % 50 == 0:
+                    title += "_(Don\\'t,_stop)"
+                values.append(
+                    f"({i},'{title}','SORTKEY{rng.randrange(10 ** 6)}\\nX',"
+                    f"'2021-10-01 08:30:00','','uca-default-u-kn',"
+                    f"'{rng.choice(['page', 'subcat', 'file'])}')"
+                )
+            f.write(f"INSERT INTO `categorylinks` VALUES {','.join(values)};\n")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "xxwiki-20211001-categorylinks.sql.gz"
+        synthetic_categorylinks(path, args.rows)
+        compressed = path.stat().st_size / 1000**2
+        with gzip.open(path, "rb") as f:
+            uncompressed = sum(len(chunk) for chunk in f) / 1000**2
+
+        columns, dtype = csvutil.SQL_DUMP_TABLES["categorylinks"]
+        start = time.time()
+        rows = csvutil.write_sql_dump_parquet(
+            path, Path(tmp) / "categorylinks.parquet", columns, dtype
+        )
+        elapsed = time.time() - start
+        print(
+            f"{rows} rows in {elapsed:.2f}s: "
+            f"{compressed / elapsed:.1f} MB/s compressed, "
+            f"{uncompressed / elapsed:.1f} MB/s uncompressed"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Compares the file size of a topics table with string labels (TOPICS_SCHEMA)
+with the int32 id arrays and dictionary that map_topics writes, and the time
+of grouping the exploded topics of a level by topic with pyarrow and pandas.
+Uses the output of map_topics or a synthetic table.
+
+    PYTHONPATH=. python benchmarks/bench_topic_ids.py --topics en_topics
+"""
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Tuple
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+import lsde2021.topics as topics
+
+
+def synthetic_topics(n: int, n_topics: int = 20_000, seed: int = 0) -> pa.Table:
+    """page topics with zipf distributed, capitalized labels"""
+    rng = np.random.default_rng(seed)
+    labels = pa.array([f"Topic_label_{i:05d}" for i in range(n_topics)])
+    columns: dict = dict(page_id=np.arange(n, dtype=np.int32))
+    for level in range(1, topics.TOPIC_LEVELS + 1):
+        lengths = rng.integers(0, 6, n)
+        offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int32)
+        idx = np.minimum(rng.zipf(1.3, offsets[-1]) - 1, n_topics - 1)
+        columns[f"topics{level}"] = pa.ListArray.from_arrays(
+            pa.array(offsets), labels.take(pa.array(idx))
+        )
+    return pa.table(columns, schema=topics.TOPICS_SCHEMA)
+
+
+def timed(f: Callable[[], Any], repeat: int = 3) -> Tuple[float, Any]:
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        start = time.time()
+        result = f()
+        best = min(best, time.time() - start)
+    return best, result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--topics", help="output directory of map_topics")
+    parser.add_argument("--n", type=int, default=1_000_000)
+    parser.add_argument("--level", type=int, default=4)
+    args = parser.parse_args()
+
+    if args.topics:
+        table = topics.read_topics(args.topics, decode=True)
+    else:
+        table = synthetic_topics(args.n)
+    dictionary = topics.TopicDictionary.from_tables(iter([table]))
+    encoded = dictionary.encode(table)
+    print(f"{table.num_rows} pages, {len(dictionary)} topic ids")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        labels_file = Path(tmp) / "labels.parquet"
+        ids_file = Path(tmp) / "ids.parquet"
+        dictionary_file = Path(tmp) / "dictionary.parquet"
+        pq.write_table(table, labels_file)
+        pq.write_table(encoded, ids_file)
+        dictionary.save(dictionary_file)
+        labels_size = labels_file.stat().st_size
+        ids_size = ids_file.stat().st_size + dictionary_file.stat().st_size
+        print(f"labels: {labels_size / 1e6:.1f} MB")
+        print(
+            f"ids:    {ids_size / 1e6:.1f} MB "
+            f"(dictionary {dictionary_file.stat().st_size / 1e6:.1f} MB), "
+            f"{labels_size / ids_size:.2f}x smaller"
+        )
+        t, _ = timed(lambda: pq.read_table(labels_file))
+        print(f"read labels {t:.2f}s")
+        t, _ = timed(lambda: pq.read_table(ids_file))
+        print(f"read ids    {t:.2f}s")
+
+    column = f"topics{args.level}"
+    for name, t in [("labels", table), ("ids", encoded)]:
+        flat = pa.table({"topic": pc.list_flatten(t.column(column))})
+        seconds, grouped = timed(lambda: flat.group_by("topic").aggregate([]))
+        print(f"pyarrow group by {name}: {seconds:.3f}s ({grouped.num_rows} topics)")
+        df = flat.to_pandas()
+        seconds, _ = timed(lambda: df.groupby("topic").size())
+        print(f"pandas group by {name}:  {seconds:.3f}s")
+    seconds, _ = timed(
+        lambda: dictionary.label(
+            encoded.column(column).combine_chunks().flatten()[:1000]
+        )
+    )
+    print(f"labels of 1000 ids for display: {seconds * 1000:.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Compares reading a few wikis of a pageview_complete file through its wiki
+index (wiki_index.read_wiki_lines) with decompressing and parsing the whole
+file with csv.read_pageview_csv, on a real file or a synthetic file sorted
+by wiki_code with zipf distributed wiki sizes.
+
+    PYTHONPATH=. python benchmarks/bench_wiki_index.py --file pageviews-20210101-user.bz2 --wikis fy.wikipedia
+"""
+
+import argparse
+import bz2
+import io
+import random
+import tempfile
+import time
+from pathlib import Path
+
+import lsde2021.csv as csvutil
+import lsde2021.wiki_index as wiki_index
+
+
+def write_synthetic_file(path: Path, lines: int, n_wikis: int = 300) -> None:
+    rng = random.Random(0)
+    weights = [1 / (rank + 1) ** 1.2 for rank in range(n_wikis)]
+    sizes = [max(1, int(lines * w / sum(weights))) for w in weights]
+    rng.shuffle(sizes)
+    with bz2.open(path, "wb", compresslevel=9) as f:
+        for i, size in enumerate(sizes):
+            wiki = b"w%03d.wikipedia" % i
+            f.write(
+                b"".join(
+                    b"%s Page_%d %d desktop %d A%dB%d\n"
+                    % (
+                        wiki,
+                        rng.randrange(10**7),
+                        rng.randrange(10**7),
+                        rng.randrange(1000),
+                        rng.randrange(50),
+                        rng.randrange(50),
+                    )
+                    for _ in range(size)
+                )
+            )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--file", help="pageview_complete bz2 file")
+    parser.add_argument("--wikis", nargs="*", help="wiki codes to read")
+    parser.add_argument("--lines", type=int, default=2_000_000)
+    parser.add_argument("--processes", type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(args.file) if args.file else Path(tmp) / "pageviews-user.bz2"
+        if not args.file:
+            write_synthetic_file(path, args.lines)
+
+        start = time.time()
+        index = wiki_index.WikiIndex.build(path, processes=args.processes)
+        print(f"indexed {len(index.blocks)} blocks in {time.time() - start:.2f}s")
+
+        start = time.time()
+        full = csvutil.read_pageview_csv(path)
+        full_time = time.time() - start
+        print(f"read_pageview_csv: {len(full)} rows in {full_time:.2f}s")
+
+        by_lines = sorted(
+            index.wikis, key=lambda w: sum(r.lines for r in index.wikis[w])
+        )
+        wikis = args.wikis or [by_lines[len(by_lines) // 2], by_lines[-1]]
+        for wiki in wikis:
+            ranges = index.ranges([wiki])
+            blocks = sum(r.end_block - r.start_block + 1 for r in ranges)
+            start = time.time()
+            lines = wiki_index.read_wiki_lines(
+                path, [wiki], index=index, processes=args.processes
+            )
+            df = csvutil.read_pageview_csv(io.BytesIO(lines))
+            seconds = time.time() - start
+            print(
+                f"{wiki}: {len(df)} rows from {blocks} of {len(index.blocks)} "
+                f"blocks in {seconds:.3f}s ({full_time / seconds:.0f}x faster)"
+            )
+
+
+if __name__ == "__main__":
+    main()
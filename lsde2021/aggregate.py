@@ -1,47 +1,43 @@
+import csv
+import json
+import shutil
 import datetime
+import tempfile
+import itertools
 import traceback
 from pathlib import Path
+from typing import Dict, Iterator, List, Literal, Optional, Sequence, Tuple
+from dateutil.relativedelta import relativedelta
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 
 import pyspark
 import pyspark.sql.functions as F
 from pyspark.sql.types import IntegerType, LongType, StringType, StructField, StructType
 
+import lsde2021.csv as csvutil
 import lsde2021.download as dl
+import lsde2021.utils as utils
 from lsde2021.types import PathLike
 
+PAGEVIEW_SCHEMA = StructType(
+    [
+        StructField("domain_code", StringType(), True),
+        StructField("page_title", StringType(), True),
+        StructField("view_count", LongType(), True),
+        StructField("total_response_size", IntegerType(), True),
+    ]
+)
 
-def aggregate_daily_pageviews(
-    date: datetime.date,
-    spark: pyspark.sql.session.SparkSession,
-    src: PathLike,
-    dest: PathLike,
-    force: bool = False,
-) -> PathLike:
-    """
-    see https://stackoverflow.com/questions/51217168/wikipedia-pageviews-analysis
-        domain_code
-        page_title
-        count_views
-        total_response_size (no longer maintained)
-    """
-
-    schema = StructType(
-        [
-            StructField("domain_code", StringType(), True),
-            StructField("page_title", StringType(), True),
-            StructField("view_count", LongType(), True),
-            StructField("total_response_size", IntegerType(), True),
-        ]
-    )
+AGGREGATION_MODES = Literal["union", "join"]
+ROLLUP_PERIODS = Literal["monthly", "yearly"]
 
-    csv_loader = spark.read.format("csv").option("sep", " ")
-
-    daily = None
-    daily_out = dest / Path("/".join(dl.wikimedia_pageview_complete_local_file(date)))
-    if not force and daily_out.exists():
-        print(f"using existing {daily_out} ...")
-        return daily_out
 
+def hourly_pageview_files(date: datetime.date, src: PathLike) -> List[Tuple[int, Path]]:
+    files = []
     for hour in range(24):
         current = datetime.datetime.combine(
             date, datetime.time.min
@@ -49,9 +45,18 @@ def aggregate_daily_pageviews(
         hourly_file = src / Path(
             "/".join(dl.wikimedia_pageview_complete_local_file(current))
         )
+        files.append((hour, hourly_file))
+    return files
+
 
+def _join_hourly_pageviews(
+    spark: pyspark.sql.session.SparkSession, hourly_files: List[Tuple[int, Path]]
+) -> Optional[pyspark.sql.DataFrame]:
+    csv_loader = spark.read.format("csv").option("sep", " ")
+    daily = None
+    for _, hourly_file in hourly_files:
         try:
-            df = csv_loader.load(str(hourly_file), schema=schema)
+            df = csv_loader.load(str(hourly_file), schema=PAGEVIEW_SCHEMA)
             if daily is None:
                 daily = df
             else:
@@ -74,6 +79,85 @@ def aggregate_daily_pageviews(
         except Exception as e:
             print(f"failed to load {hourly_file}: {e}")
             print(traceback.format_exc())
+    return daily
+
+
+def _union_hourly_pageviews(
+    spark: pyspark.sql.session.SparkSession,
+    hourly_files: List[Tuple[int, Path]],
+    hourly_counts: bool = False,
+) -> Optional[pyspark.sql.DataFrame]:
+    csv_loader = spark.read.format("csv").option("sep", " ")
+    hourly = None
+    for hour, hourly_file in hourly_files:
+        try:
+            df = csv_loader.load(str(hourly_file), schema=PAGEVIEW_SCHEMA).select(
+                "domain_code",
+                "page_title",
+                # missing counts are treated as zero like the outer join does
+                F.coalesce(F.col("view_count"), F.lit(0)).alias("view_count"),
+                F.lit(hour).alias("hour"),
+            )
+            hourly = df if hourly is None else hourly.unionByName(df)
+        except Exception as e:
+            print(f"failed to load {hourly_file}: {e}")
+            print(traceback.format_exc())
+    if hourly is None:
+        return None
+
+    # a single shuffle instead of one per hour
+    aggregations = [F.sum("view_count").alias("view_count")]
+    if hourly_counts:
+        aggregations.append(
+            F.array(
+                *[
+                    F.sum(
+                        F.when(F.col("hour") == hour, F.col("view_count")).otherwise(0)
+                    )
+                    for hour, _ in hourly_files
+                ]
+            ).alias("hourly_counts")
+        )
+    return hourly.groupBy("domain_code", "page_title").agg(*aggregations)
+
+
+def aggregate_daily_pageviews(
+    date: datetime.date,
+    spark: pyspark.sql.session.SparkSession,
+    src: PathLike,
+    dest: PathLike,
+    force: bool = False,
+    mode: AGGREGATION_MODES = "union",
+    hourly_counts: bool = False,
+) -> PathLike:
+    """
+    see https://stackoverflow.com/questions/51217168/wikipedia-pageviews-analysis
+        domain_code
+        page_title
+        count_views
+        total_response_size (no longer maintained)
+
+    mode "union" reads all hourly files as one DataFrame and sums the views
+    with a single groupBy, optionally keeping the per hour counts as an
+    array column. mode "join" folds the hours with successive outer joins.
+    """
+
+    daily_out = dest / Path("/".join(dl.wikimedia_pageview_complete_local_file(date)))
+    if not force and daily_out.exists():
+        print(f"using existing {daily_out} ...")
+        return daily_out
+
+    hourly_files = hourly_pageview_files(date, src)
+    if mode == "union":
+        daily = _union_hourly_pageviews(
+            spark, hourly_files, hourly_counts=hourly_counts
+        )
+    elif mode == "join":
+        if hourly_counts:
+            raise ValueError("hourly counts are only supported in union mode")
+        daily = _join_hourly_pageviews(spark, hourly_files)
+    else:
+        raise ValueError(f"unknown aggregation mode {mode}")
 
     if daily:
         try:
@@ -89,3 +173,425 @@ def aggregate_daily_pageviews(
             print(f"failed to save daily data {daily_out}: {e}")
             print(traceback.format_exc())
     return daily_out
+
+
+def daily_parquet_file(date: datetime.date, src: PathLike) -> Path:
+    return src / Path(
+        "/".join(dl.wikimedia_pageview_complete_local_file(date, monthly=False))
+    ).with_suffix(".parquet")
+
+
+def rollup_file(
+    date: datetime.date, dest: PathLike, period: ROLLUP_PERIODS = "monthly"
+) -> Path:
+    if period == "yearly":
+        return Path(dest) / "yearly" / f"{date.year}.parquet"
+    return Path(dest) / "monthly" / f"{date.year}-{str(date.month).zfill(2)}.parquet"
+
+
+def fingerprint(path: PathLike) -> int:
+    """latest modification time of a (spark parquet) file or directory"""
+    path = Path(path)
+    mtimes = [path.stat().st_mtime_ns]
+    if path.is_dir():
+        mtimes += [p.stat().st_mtime_ns for p in path.rglob("*")]
+    return max(mtimes)
+
+
+def month_days(month: datetime.date) -> List[datetime.date]:
+    first = month.replace(day=1)
+    last = first + relativedelta(months=+1, days=-1)
+    return list(dl.date_range(first, last))
+
+
+def rollup_inputs(
+    date: datetime.date,
+    src: PathLike,
+    dest: PathLike,
+    period: ROLLUP_PERIODS = "monthly",
+) -> Dict[str, int]:
+    """
+    Returns the existing inputs of a rollup and their fingerprints.
+    Monthly rollups are built from the daily parquet outputs in src,
+    yearly rollups from the monthly rollups in dest.
+    """
+    if period == "yearly":
+        candidates = [
+            rollup_file(datetime.date(date.year, month, 1), dest, "monthly")
+            for month in range(1, 13)
+        ]
+    else:
+        candidates = [daily_parquet_file(day, src) for day in month_days(date)]
+    return {str(path): fingerprint(path) for path in candidates if path.exists()}
+
+
+def rollup_is_current(out: PathLike, inputs: Dict[str, int]) -> bool:
+    manifest = Path(str(out) + ".json")
+    if not Path(out).exists() or not manifest.exists():
+        return False
+    with open(manifest, "r") as f:
+        return bool(json.load(f) == inputs)
+
+
+def _write_rollup_manifest(out: PathLike, inputs: Dict[str, int]) -> None:
+    manifest = Path(str(out) + ".json")
+    tmp = manifest.with_suffix(".json.tmp")
+    with open(tmp, "w") as f:
+        json.dump(inputs, f, indent=2, sort_keys=True)
+    tmp.replace(manifest)
+
+
+def update_rollup(
+    date: datetime.date,
+    spark: pyspark.sql.session.SparkSession,
+    src: PathLike,
+    dest: PathLike,
+    period: ROLLUP_PERIODS = "monthly",
+    partition_by: str = "group",
+    force: bool = False,
+) -> Optional[Path]:
+    """
+    Materializes the monthly or yearly rollup that contains date as a single
+    parquet table with a date column, partitioned by partition_by.
+    The rollup is only rebuilt when its inputs changed since the last build.
+    """
+    out = rollup_file(date, dest, period)
+    inputs = rollup_inputs(date, src, dest, period)
+    if not inputs:
+        return None
+    if not force and rollup_is_current(out, inputs):
+        print(f"using existing {out} ...")
+        return out
+
+    rollup = None
+    for path in sorted(inputs):
+        try:
+            df = spark.read.format("parquet").load(path)
+            if period == "monthly":
+                # pageviews-YYYYMMDD-user.parquet
+                day = datetime.datetime.strptime(
+                    Path(path).name.split("-")[1], "%Y%m%d"
+                ).date()
+                df = df.withColumn("date", F.lit(day))
+            rollup = df if rollup is None else rollup.unionByName(df)
+        except Exception as e:
+            print(f"failed to load {path}: {e}")
+            print(traceback.format_exc())
+
+    if rollup is None:
+        return None
+    out.parent.mkdir(parents=True, exist_ok=True)
+    rollup.write.format("parquet").partitionBy(partition_by).mode("overwrite").save(
+        str(out)
+    )
+    _write_rollup_manifest(out, inputs)
+    print(f"wrote {out}")
+    return out
+
+
+def update_rollups(
+    start: datetime.date,
+    end: datetime.date,
+    spark: pyspark.sql.session.SparkSession,
+    src: PathLike,
+    dest: PathLike,
+    partition_by: str = "group",
+    force: bool = False,
+) -> List[Path]:
+    """updates all monthly and yearly rollups between start and end"""
+    updated = []
+    months = dl.date_range(
+        start.replace(day=1), end.replace(day=1), interval=relativedelta(months=+1)
+    )
+    for month in months:
+        out = update_rollup(
+            month, spark, src, dest, "monthly", partition_by=partition_by, force=force
+        )
+        if out is not None:
+            updated.append(out)
+    for year in range(start.year, end.year + 1):
+        out = update_rollup(
+            datetime.date(year, 1, 1),
+            spark,
+            src,
+            dest,
+            "yearly",
+            partition_by=partition_by,
+            force=force,
+        )
+        if out is not None:
+            updated.append(out)
+    return updated
+
+
+def rollup_files_for_range(
+    start: datetime.date, end: datetime.date, dest: PathLike
+) -> List[Path]:
+    """
+    Returns the fewest rollup tables that cover all days between start and
+    end, using yearly rollups for fully covered years and monthly otherwise.
+    """
+    files = []
+    for year in range(start.year, end.year + 1):
+        yearly = rollup_file(datetime.date(year, 1, 1), dest, "yearly")
+        full_year = (
+            start <= datetime.date(year, 1, 1) and datetime.date(year, 12, 31) <= end
+        )
+        if full_year and yearly.exists():
+            files.append(yearly)
+            continue
+        first_month = start.month if year == start.year else 1
+        last_month = end.month if year == end.year else 12
+        for month in range(first_month, last_month + 1):
+            monthly = rollup_file(datetime.date(year, month, 1), dest, "monthly")
+            if monthly.exists():
+                files.append(monthly)
+    return files
+
+
+def read_rollups(
+    start: datetime.date,
+    end: datetime.date,
+    spark: pyspark.sql.session.SparkSession,
+    dest: PathLike,
+    partition_by: str = "group",
+    partition: Optional[str] = None,
+) -> Optional[pyspark.sql.DataFrame]:
+    """loads the days between start and end from the materialized rollups"""
+    files = rollup_files_for_range(start, end, dest)
+    if not files:
+        return None
+    df = spark.read.format("parquet").load([str(f) for f in files])
+    if partition is not None:
+        df = df.filter(F.col(partition_by) == partition)
+    return df.filter((F.lit(start) <= F.col("date")) & (F.col("date") <= F.lit(end)))
+
+
+class PageviewAggregator:
+    """
+    Sums views per (wiki_code, page_id) without spark.
+
+    Keys are packed into a single int64 as (wiki index << 32) | page_id and
+    aggregated in sorted numpy arrays. Once the buffered entries exceed the
+    memory budget they are spilled to disk as sorted runs, which are merged
+    wiki by wiki when iterating the partitions, in key ranges that hold at
+    most half the budget of entries across all runs. Only the entries of a
+    single key range are in memory at once, regardless of the wiki sizes.
+    """
+
+    # bytes per buffered entry (int64 key and int64 count)
+    ENTRY_SIZE = 16
+
+    def __init__(
+        self, memory_budget: int = 512 * 1024**2, tmp_dir: Optional[PathLike] = None
+    ):
+        self.memory_budget = memory_budget
+        self.wikis: Dict[str, int] = dict()
+        self._keys: List[np.ndarray] = []
+        self._counts: List[np.ndarray] = []
+        self._buffered = 0
+        self._tmp = tempfile.TemporaryDirectory(dir=tmp_dir)
+        self.runs: List[Tuple[Path, Path]] = []
+
+    def add(
+        self, wiki_codes: np.ndarray, page_ids: np.ndarray, counts: np.ndarray
+    ) -> None:
+        wikis, inverse = np.unique(wiki_codes, return_inverse=True)
+        wiki_idx = np.array(
+            [self.wikis.setdefault(str(w), len(self.wikis)) for w in wikis],
+            dtype=np.int64,
+        )
+        keys = (wiki_idx[inverse] << 32) | page_ids.astype(np.int64)
+        keys, counts = _reduce_by_key(keys, counts.astype(np.int64))
+        self._keys.append(keys)
+        self._counts.append(counts)
+        self._buffered += len(keys)
+        if self._buffered * self.ENTRY_SIZE > self.memory_budget:
+            self._compact()
+            if self._buffered * self.ENTRY_SIZE > self.memory_budget // 2:
+                self._spill()
+
+    def _compact(self) -> None:
+        if len(self._keys) > 1:
+            keys, counts = _reduce_by_key(
+                np.concatenate(self._keys), np.concatenate(self._counts)
+            )
+            self._keys, self._counts = [keys], [counts]
+            self._buffered = len(keys)
+
+    def _spill(self) -> None:
+        self._compact()
+        if not self._keys:
+            return
+        run = len(self.runs)
+        keys_file = Path(self._tmp.name) / f"run-{run}-keys.npy"
+        counts_file = Path(self._tmp.name) / f"run-{run}-counts.npy"
+        np.save(keys_file, self._keys[0])
+        np.save(counts_file, self._counts[0])
+        self.runs.append((keys_file, counts_file))
+        self._keys, self._counts = [], []
+        self._buffered = 0
+
+    def partitions(self) -> Iterator[Tuple[str, np.ndarray, np.ndarray]]:
+        """
+        yields (wiki_code, page_ids, counts) chunks of every wiki in the input,
+        ordered by wiki and page id, with at most half the budget of entries
+        """
+        if self.runs:
+            self._spill()
+        else:
+            self._compact()
+        runs = [
+            (np.load(k, mmap_mode="r"), np.load(c, mmap_mode="r")) for k, c in self.runs
+        ]
+        if not runs and self._keys:
+            runs = [(self._keys[0], self._counts[0])]
+        max_entries = max(1, self.memory_budget // self.ENTRY_SIZE // 2)
+        for wiki, idx in sorted(self.wikis.items()):
+            lo, hi = idx << 32, (idx + 1) << 32
+            for keys, counts in _merge_runs(runs, lo, hi, max_entries):
+                yield wiki, keys & 0xFFFFFFFF, counts
+
+    def close(self) -> None:
+        self._keys, self._counts = [], []
+        self.runs = []
+        self._tmp.cleanup()
+
+
+def _merge_runs(
+    runs: List[Tuple[np.ndarray, np.ndarray]], lo: int, hi: int, max_entries: int
+) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Merges the keys in [lo, hi) of sorted runs (with unique keys each) in
+    consecutive key ranges, so that at most max_entries entries of all runs
+    are loaded at once. Yields the reduced (keys, counts) of every range.
+    """
+    if not runs:
+        return
+    share = max(1, max_entries // len(runs))
+    starts = [int(np.searchsorted(keys, lo)) for keys, _ in runs]
+    ends = [int(np.searchsorted(keys, hi)) for keys, _ in runs]
+    while any(start < end for start, end in zip(starts, ends)):
+        # the keys of a run are unique, so no run has more than share
+        # entries below the smallest key share entries ahead in any run
+        cut = hi
+        for (keys, _), start, end in zip(runs, starts, ends):
+            if start + share < end:
+                cut = min(cut, int(keys[start + share]))
+        cuts = [
+            int(np.searchsorted(keys[start:end], cut)) + start
+            for (keys, _), start, end in zip(runs, starts, ends)
+        ]
+        keys, counts = _reduce_by_key(
+            np.concatenate([k[s:c] for (k, _), s, c in zip(runs, starts, cuts)]),
+            np.concatenate([n[s:c] for (_, n), s, c in zip(runs, starts, cuts)]),
+        )
+        starts = cuts
+        if len(keys) > 0:
+            yield keys, counts
+
+
+def _reduce_by_key(
+    keys: np.ndarray, counts: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """sorts keys and sums the counts of equal keys"""
+    order = np.argsort(keys, kind="stable")
+    keys, counts = keys[order], counts[order]
+    if len(keys) == 0:
+        return keys, counts
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    return keys[starts], np.add.reduceat(counts, starts)
+
+
+def iter_pageview_chunks(
+    path: PathLike, chunk_size: int = 1_000_000
+) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    Streams (wiki_codes, page_ids, daily_totals) arrays from a pageview_complete
+    file, skipping lines without a numeric page id or count.
+    """
+    with utils.fopen(path, mode="rt", encoding="utf-8", errors="replace") as f:
+        chunks = pd.read_csv(
+            f,
+            names=csvutil.PAGEVIEW_COLUMNS,
+            sep=" ",
+            quoting=csv.QUOTE_NONE,
+            dtype=str,
+            on_bad_lines="skip",
+            chunksize=chunk_size,
+        )
+        for chunk in chunks:
+            page_ids = pd.to_numeric(chunk["page_id"], errors="coerce")
+            counts = pd.to_numeric(chunk["daily_total"], errors="coerce")
+            valid = (
+                page_ids.notna() & counts.notna() & chunk["wiki_code"].notna()
+            ).to_numpy()
+            yield (
+                chunk["wiki_code"].to_numpy()[valid],
+                page_ids.to_numpy()[valid].astype(np.int64),
+                counts.to_numpy()[valid].astype(np.int64),
+            )
+
+
+def aggregate_pageviews_local(
+    paths: Sequence[PathLike],
+    dest: PathLike,
+    partition_by: str = "wiki_code",
+    memory_budget: int = 512 * 1024**2,
+    chunk_size: int = 1_000_000,
+    tmp_dir: Optional[PathLike] = None,
+) -> PathLike:
+    """
+    Aggregates the views per (wiki_code, page_id) of pageview_complete files
+    with bounded memory and writes them as parquet partitioned by wiki. The
+    rows are ordered by page id, every merged chunk is its own row group.
+    """
+    aggregator = PageviewAggregator(memory_budget=memory_budget, tmp_dir=tmp_dir)
+    try:
+        for path in paths:
+            try:
+                for wiki_codes, page_ids, counts in iter_pageview_chunks(
+                    path, chunk_size=chunk_size
+                ):
+                    aggregator.add(wiki_codes, page_ids, counts)
+            except Exception as e:
+                print(f"failed to load {path}: {e}")
+                print(traceback.format_exc())
+
+        out = Path(dest)
+        if out.exists():
+            shutil.rmtree(out)
+        out.mkdir(parents=True)
+        schema = pa.schema([("page_id", pa.int64()), ("view_count", pa.int64())])
+        for wiki, chunks in itertools.groupby(aggregator.partitions(), lambda c: c[0]):
+            partition = out / f"{partition_by}={wiki}"
+            partition.mkdir()
+            with pq.ParquetWriter(partition / "part-00000.parquet", schema) as writer:
+                for _, page_ids, counts in chunks:
+                    writer.write_table(
+                        pa.table([page_ids, counts], schema=schema),
+                        row_group_size=len(page_ids),
+                    )
+        (out / "_SUCCESS").touch()
+        print(f"wrote {out}")
+    finally:
+        aggregator.close()
+    return out
+
+
+def aggregate_daily_pageviews_local(
+    date: datetime.date,
+    src: PathLike,
+    dest: PathLike,
+    force: bool = False,
+    memory_budget: int = 512 * 1024**2,
+) -> PathLike:
+    """spark free variant of aggregate_daily_pageviews for pageview_complete files"""
+    local_file = "/".join(dl.wikimedia_pageview_complete_local_file(date))
+    daily_out = dest / Path(local_file)
+    if not force and daily_out.exists():
+        print(f"using existing {daily_out} ...")
+        return daily_out
+    return aggregate_pageviews_local(
+        [src / Path(local_file)], daily_out, memory_budget=memory_budget
+    )
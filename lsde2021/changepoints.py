@@ -1,11 +1,18 @@
+import re
+import json
+import hashlib
+import concurrent.futures
 import pyspark
 import pyspark.sql.types as T
 import pyspark.sql.functions as F
 import datetime
+import numpy as np
+import pandas as pd
 import ruptures as rpt
 import matplotlib.pyplot as plt
 from pathlib import Path
-from typing import Tuple, List, Dict, Optional
+from typing import Any, Tuple, List, Dict, Literal, Optional
+from lsde2021.types import PathLike
 
 COUNTRIES: Dict[str, List[str]] = {
     "ar": ["United Arab Emirates", "Saudi Arabia"],
@@ -51,10 +58,12 @@ COUNTRIES: Dict[str, List[str]] = {
     "zh": ["China"],
 }
 
+CHANGE_POINT_ALGORITHMS = Literal["dynp", "pelt", "binseg"]
+
 
 def get_change_points(
     s: pyspark.sql.DataFrame, country: str, min_size: int = 7, n: int = 10
-) -> Tuple[pyspark.sql.DataFrame, List[datetime.datetime]]:
+) -> Tuple[pyspark.sql.DataFrame, List[datetime.date]]:
     country_stringency = s.filter(F.lower(F.col("CountryName")) == country.lower())
     country_stringency = country_stringency.withColumn(
         "Notes", F.explode_outer("Notes")
@@ -71,14 +80,187 @@ def get_change_points(
         .toPandas()
         .set_index("Date")
     )
-    # algo = rpt.Pelt(model="rbf").fit(country_stringency_pd)
-    algo = rpt.Dynp(min_size=min_size).fit(country_stringency_pd)
-    change_index = algo.predict(n)
+    change_dates = detect_change_points(
+        country_stringency_pd["StringencyIndex"], min_size=min_size, n=n
+    )
+    return country_stringency, change_dates
+
+
+def detect_change_points(
+    series: pd.Series,
+    min_size: int = 7,
+    n: int = 10,
+    algorithm: CHANGE_POINT_ALGORITHMS = "dynp",
+    penalty: Optional[float] = None,
+) -> List[datetime.date]:
+    """
+    Finds the dates where the mean of a date indexed series changes. Dynp
+    (exact, quadratic in the series length) and Binseg find n change points,
+    Pelt finds as many as the penalty allows, which defaults to
+    log(length) * variance of the series.
+    """
+    values = series.to_numpy(dtype=np.float64).reshape(-1, 1)
+    if algorithm == "dynp":
+        change_index = rpt.Dynp(min_size=min_size).fit(values).predict(n)
+    elif algorithm == "binseg":
+        change_index = rpt.Binseg(min_size=min_size).fit(values).predict(n_bkps=n)
+    elif algorithm == "pelt":
+        if penalty is None:
+            penalty = float(np.log(len(values)) * np.var(values))
+        change_index = rpt.Pelt(min_size=min_size).fit(values).predict(pen=penalty)
+    else:
+        raise ValueError(f"unknown change point algorithm {algorithm}")
     change_dates = [
-        country_stringency_pd.iloc[index - 1].name.to_pydatetime().date()
-        for index in change_index
+        pd.Timestamp(series.index[index - 1]).date() for index in change_index
     ]
-    return country_stringency, change_dates[:-1]
+    return change_dates[:-1]
+
+
+def stringency_series(
+    s: pyspark.sql.DataFrame, countries: List[str]
+) -> Dict[str, pd.Series]:
+    """
+    Collects the daily stringency index of all countries in one pass,
+    averaged like in get_change_points.
+    """
+    stringency = s.filter(
+        F.lower(F.col("CountryName")).isin([country.lower() for country in countries])
+    )
+    stringency = stringency.withColumn("Notes", F.explode_outer("Notes"))
+    stringency = stringency.groupBy("Date", "CountryName", "CountryCode").agg(
+        F.mean("StringencyIndex").alias("StringencyIndex")
+    )
+    stringency_pd: pd.DataFrame = stringency.select(
+        F.lower(F.col("CountryName")).alias("country"), "Date", "StringencyIndex"
+    ).toPandas()
+    grouped = {
+        country: group.sort_values("Date", kind="stable").set_index("Date")
+        for country, group in stringency_pd.groupby("country")
+    }
+    return {
+        country: grouped[country.lower()]["StringencyIndex"]
+        for country in countries
+        if country.lower() in grouped
+    }
+
+
+def fingerprint(series: pd.Series) -> str:
+    return hashlib.sha1(
+        pd.util.hash_pandas_object(series, index=True).to_numpy().tobytes()
+    ).hexdigest()
+
+
+def change_points_cache_file(
+    cache_dir: PathLike,
+    country: str,
+    min_size: int,
+    n: int,
+    data_fingerprint: str,
+    algorithm: CHANGE_POINT_ALGORITHMS = "dynp",
+    penalty: Optional[float] = None,
+) -> Path:
+    name = re.sub(r"\W+", "_", country.lower())
+    params = f"{algorithm}-{min_size}-{n}"
+    if penalty is not None:
+        params += f"-{penalty:g}"
+    return Path(cache_dir) / f"{name}-{params}-{data_fingerprint[:16]}.json"
+
+
+def _detect_change_points_or_none(
+    series: pd.Series, **options: Any
+) -> Optional[List[datetime.date]]:
+    try:
+        return detect_change_points(series, **options)
+    except rpt.exceptions.BadSegmentationParameters:
+        return None
+
+
+def change_points(
+    series: Dict[str, pd.Series],
+    min_size: int = 7,
+    n: int = 10,
+    algorithm: CHANGE_POINT_ALGORITHMS = "dynp",
+    penalty: Optional[float] = None,
+    processes: Optional[int] = None,
+    cache_dir: Optional[PathLike] = None,
+) -> Dict[str, List[datetime.date]]:
+    """
+    Detects the change points of many series in a process pool. Results are
+    cached in cache_dir by country, parameters and a fingerprint of the data.
+    Series that are too short for n change points have none.
+    """
+    options = dict(min_size=min_size, n=n, algorithm=algorithm, penalty=penalty)
+    results: Dict[str, List[datetime.date]] = dict()
+    cache_files: Dict[str, Path] = dict()
+    if cache_dir is not None:
+        Path(cache_dir).mkdir(parents=True, exist_ok=True)
+        for country, values in series.items():
+            cache_files[country] = change_points_cache_file(
+                cache_dir,
+                country,
+                min_size=min_size,
+                n=n,
+                data_fingerprint=fingerprint(values),
+                algorithm=algorithm,
+                penalty=penalty,
+            )
+            if cache_files[country].exists():
+                with open(cache_files[country], "r") as f:
+                    results[country] = [
+                        datetime.date.fromisoformat(d) for d in json.load(f)
+                    ]
+
+    todo = [country for country in series if country not in results]
+    if len(todo) > 0:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+            futures = {
+                country: executor.submit(
+                    _detect_change_points_or_none, series[country], **options
+                )
+                for country in todo
+            }
+            for country, future in futures.items():
+                found = future.result()
+                if found is None:
+                    print(f"{country} is too short for {n} change points")
+                results[country] = found or []
+                if country in cache_files:
+                    tmp = cache_files[country].with_suffix(".json.tmp")
+                    with open(tmp, "w") as f:
+                        json.dump([d.isoformat() for d in results[country]], f)
+                    tmp.replace(cache_files[country])
+    return {country: results[country] for country in series}
+
+
+def get_all_change_points(
+    s: pyspark.sql.DataFrame,
+    countries: Optional[List[str]] = None,
+    min_size: int = 7,
+    n: int = 10,
+    algorithm: CHANGE_POINT_ALGORITHMS = "dynp",
+    penalty: Optional[float] = None,
+    processes: Optional[int] = None,
+    cache_dir: Optional[PathLike] = None,
+) -> Dict[str, List[datetime.date]]:
+    """
+    Batched get_change_points for all countries (by default the countries
+    in COUNTRIES) that reads the stringency data once.
+    """
+    if countries is None:
+        countries = list(dict.fromkeys(c for cs in COUNTRIES.values() for c in cs))
+    series = stringency_series(s, countries)
+    for country in countries:
+        if country not in series:
+            print(f"no stringency data for {country}")
+    return change_points(
+        series,
+        min_size=min_size,
+        n=n,
+        algorithm=algorithm,
+        penalty=penalty,
+        processes=processes,
+        cache_dir=cache_dir,
+    )
 
 
 def plot_changepoints(
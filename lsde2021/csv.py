@@ -1,10 +1,33 @@
+import os
+import re
 import csv
+import time
+import concurrent.futures
+from concurrent.futures.process import BrokenProcessPool
 import pandas as pd
-from typing import Type, Dict, Union, Optional, Any
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+from pathlib import Path
+from typing import (
+    Type,
+    Dict,
+    Union,
+    Optional,
+    Any,
+    Callable,
+    Iterable,
+    Iterator,
+    List,
+    Set,
+    Tuple,
+    IO,
+)
 from lsde2021.types import PathLike
 import lsde2021.utils as utils
 
-
 PAGEVIEW_COLUMNS = [
     "wiki_code",
     "page_title",
@@ -110,7 +133,7 @@ RAW_CATEGORYLINKS_DTYPE = {
 PAGEVIEW_DTYPE = {
     "wiki_code": "category",
     "page_title": "string",
-    "page_id": "int",  # will be parsed to int
+    "page_id": "Int64",  # null for pages without an id
     "user_client": "category",
     "daily_total": "int",  # will be parsed to int
     # todo: add more columns for the hourly data
@@ -145,18 +168,18 @@ RAW_PAGE_DTYPE = {
 
 
 PAGE_DTYPE = {
-    "page_id": "Int",
-    "page_namespace": "Int",
+    "page_id": "Int64",
+    "page_namespace": "Int64",
     "page_title": "string",
     "page_restrictions": "string",
     # "page_counter", # deprecated and no longer in the files!
     "page_is_redirect": "bool",
     "page_is_new": "bool",
-    "page_random": "Int",
+    "page_random": "float",
     "page_touched": "datetime64",
     "page_links_updated": "datetime64",
     "page_latest": "category",
-    "page_len": "Int",
+    "page_len": "Int64",
     "page_content_model": "category",
     "page_lang": "category",
 }
@@ -172,11 +195,26 @@ class PageviewDialect(csv.Dialect):
     skipinitialspace = False
 
 
+def _parse_dtype(dtype: Dict[str, str]) -> Dict[str, str]:
+    """pandas can not parse datetime64 columns, they are read as strings"""
+    return {c: "string" if t == "datetime64" else t for c, t in dtype.items()}
+
+
+def _parse_timestamps(df: pd.DataFrame, dtype: Dict[str, str]) -> pd.DataFrame:
+    for column, t in dtype.items():
+        if t == "datetime64" and column in df:
+            # mediawiki timestamps are written as YYYYMMDDHHMMSS
+            df[column] = pd.to_datetime(
+                df[column], format="%Y%m%d%H%M%S", errors="coerce"
+            )
+    return df
+
+
 def read_page_csv(path: PathLike, **options: Dict[str, Any]) -> pd.DataFrame:
     default_options = dict(
         names=PAGE_COLUMNS,
         # dialect=PageviewDialect,
-        dtype=PAGE_DTYPE,
+        dtype=_parse_dtype(PAGE_DTYPE),
         index_col=False,
         # skiprows=1,  # skip the header
         on_bad_lines="warn",
@@ -184,7 +222,7 @@ def read_page_csv(path: PathLike, **options: Dict[str, Any]) -> pd.DataFrame:
     )
     if options is not None:
         default_options.update(options)
-    return pd.read_csv(path, **default_options)
+    return _parse_timestamps(pd.read_csv(path, **default_options), PAGE_DTYPE)
 
 
 def read_langlinks_csv(path: PathLike, **options: Dict[str, Any]) -> pd.DataFrame:
@@ -234,7 +272,9 @@ def read_categorylinks_csv(path: PathLike, **options: Dict[str, Any]) -> pd.Data
     return pd.read_csv(path, **default_options)
 
 
-def read_pageview_csv(path: PathLike, **options: Dict[str, Any]) -> pd.DataFrame:
+def read_pageview_csv(
+    path: Union[PathLike, IO[bytes]], **options: Dict[str, Any]
+) -> pd.DataFrame:
     default_options = dict(
         names=PAGEVIEW_COLUMNS,
         dialect=PageviewDialect,
@@ -253,6 +293,580 @@ def read_pageview_csv(path: PathLike, **options: Dict[str, Any]) -> pd.DataFrame
         return pd.read_csv(path, **default_options)
 
 
+def _read_options(
+    columns: List[str], dtype: Dict[str, str], **options: Any
+) -> Dict[str, Any]:
+    default_options = dict(
+        names=columns,
+        dtype=dtype,
+        index_col=False,
+        on_bad_lines="warn",
+        engine="c",
+    )
+    default_options.update(options)
+    return default_options
+
+
+def iter_csv(
+    path: PathLike,
+    chunk_rows: Optional[int] = None,
+    chunk_bytes: Optional[int] = None,
+    probe_rows: int = 10_000,
+    **options: Any,
+) -> Iterator[pd.DataFrame]:
+    """
+    Reads a csv file in typed DataFrame chunks of chunk_rows rows or of
+    roughly chunk_bytes in memory. For a byte budget, the number of rows
+    per chunk is derived from the memory usage of the chunks read so far.
+    """
+    if chunk_rows is None and chunk_bytes is None:
+        chunk_rows = 1_000_000
+    rows = chunk_rows or probe_rows
+    total_rows, total_bytes = 0, 0
+    with pd.read_csv(path, iterator=True, **options) as reader:
+        while True:
+            try:
+                chunk = reader.get_chunk(rows)
+            except StopIteration:
+                return
+            if len(chunk) == 0:
+                return
+            if chunk_bytes is not None:
+                total_rows += len(chunk)
+                total_bytes += int(chunk.memory_usage(deep=True).sum())
+                rows = max(1, int(chunk_bytes * total_rows / max(1, total_bytes)))
+            yield chunk
+
+
+def iter_page_csv(
+    path: PathLike,
+    chunk_rows: Optional[int] = None,
+    chunk_bytes: Optional[int] = None,
+    **options: Any,
+) -> Iterator[pd.DataFrame]:
+    chunks = iter_csv(
+        path,
+        chunk_rows=chunk_rows,
+        chunk_bytes=chunk_bytes,
+        **_read_options(PAGE_COLUMNS, _parse_dtype(PAGE_DTYPE), **options),
+    )
+    return (_parse_timestamps(chunk, PAGE_DTYPE) for chunk in chunks)
+
+
+def iter_langlinks_csv(
+    path: PathLike,
+    chunk_rows: Optional[int] = None,
+    chunk_bytes: Optional[int] = None,
+    **options: Any,
+) -> Iterator[pd.DataFrame]:
+    return iter_csv(
+        path,
+        chunk_rows=chunk_rows,
+        chunk_bytes=chunk_bytes,
+        **_read_options(LANGLINKS_COLUMNS, LANGLINKS_DTYPE, **options),
+    )
+
+
+def iter_category_csv(
+    path: PathLike,
+    chunk_rows: Optional[int] = None,
+    chunk_bytes: Optional[int] = None,
+    **options: Any,
+) -> Iterator[pd.DataFrame]:
+    return iter_csv(
+        path,
+        chunk_rows=chunk_rows,
+        chunk_bytes=chunk_bytes,
+        **_read_options(CATEGORY_COLUMNS, CATEGORY_DTYPE, **options),
+    )
+
+
+def iter_categorylinks_csv(
+    path: PathLike,
+    chunk_rows: Optional[int] = None,
+    chunk_bytes: Optional[int] = None,
+    **options: Any,
+) -> Iterator[pd.DataFrame]:
+    return iter_csv(
+        path,
+        chunk_rows=chunk_rows,
+        chunk_bytes=chunk_bytes,
+        **_read_options(CATEGORYLINKS_COLUMNS, CATEGORYLINKS_DTYPE, **options),
+    )
+
+
+def iter_pageview_csv(
+    path: PathLike,
+    chunk_rows: Optional[int] = None,
+    chunk_bytes: Optional[int] = None,
+    **options: Any,
+) -> Iterator[pd.DataFrame]:
+    options = dict(dict(dialect=PageviewDialect, index_col=None), **options)
+    return iter_csv(
+        path,
+        chunk_rows=chunk_rows,
+        chunk_bytes=chunk_bytes,
+        **_read_options(PAGEVIEW_COLUMNS, PAGEVIEW_DTYPE, **options),
+    )
+
+
+HOURS = 24
+
+
+def decode_hourly_counts(hourly_count: Union[pa.Array, pa.ChunkedArray]) -> np.ndarray:
+    """
+    Decodes hourly_count strings like A12B3X5 (hour 0 = A ... 23 = X followed
+    by the views in that hour) into a dense (n_rows, 24) uint32 matrix.
+    Expects every non empty string to be well formed.
+    """
+    chunks = (
+        hourly_count.chunks
+        if isinstance(hourly_count, pa.ChunkedArray)
+        else [hourly_count]
+    )
+    hourly = np.zeros((len(hourly_count), HOURS), dtype=np.uint32)
+    row_offset = 0
+    for chunk in chunks:
+        n = len(chunk)
+        chunk = chunk.cast(pa.string()).fill_null("")
+        _, offsets_buffer, data_buffer = chunk.buffers()
+        offsets = np.frombuffer(offsets_buffer, dtype=np.int32)[
+            chunk.offset : chunk.offset + n + 1
+        ]
+        data = np.frombuffer(data_buffer, dtype=np.uint8)[offsets[0] : offsets[-1]]
+        offsets = offsets - offsets[0]
+
+        is_hour = (data >= ord("A")) & (data <= ord("X"))
+        hour_pos = np.flatnonzero(is_hour)
+        if len(hour_pos) > 0:
+            # every token is an hour letter followed by its digits up to the
+            # next letter, rows always start with a letter
+            digits_start = hour_pos + 1
+            digits_len = np.append(hour_pos[1:], len(data)) - digits_start
+            values = np.zeros(len(hour_pos), dtype=np.uint32)
+            for k in range(int(digits_len.max())):
+                active = np.flatnonzero(digits_len > k)
+                values[active] = values[active] * 10 + (
+                    data[digits_start[active] + k] - ord("0")
+                )
+            tokens_per_row = np.diff(np.searchsorted(hour_pos, offsets))
+            rows = np.repeat(np.arange(n), tokens_per_row)
+            hourly[row_offset + rows, data[hour_pos] - ord("A")] = values
+        row_offset += n
+    return hourly
+
+
+def read_pageview_arrow(
+    path: PathLike,
+    quarantine: Optional[PathLike] = None,
+    processes: Optional[int] = None,
+    block_size: int = 16 * 1024 * 1024,
+    use_threads: bool = True,
+) -> Tuple[pa.Table, np.ndarray]:
+    """
+    Reads a pageview_complete file with the multithreaded pyarrow csv parser.
+    wiki_code and user_client are dictionary encoded and hourly_count is
+    decoded into a (n_rows, 24) uint32 matrix, which is returned alongside
+    the table. Malformed lines are skipped and written to the quarantine
+    file (<path>.bad by default) instead.
+    """
+    bad_lines: List[str] = []
+
+    def skip_invalid_row(row: Any) -> str:
+        bad_lines.append(row.text)
+        return "skip"
+
+    dictionary = pa.dictionary(pa.int32(), pa.string())
+    with utils.fopen(path, mode="rb", processes=processes) as f:
+        table = pa_csv.read_csv(
+            f,
+            read_options=pa_csv.ReadOptions(
+                column_names=PAGEVIEW_COLUMNS,
+                block_size=block_size,
+                use_threads=use_threads,
+            ),
+            parse_options=pa_csv.ParseOptions(
+                delimiter=" ",
+                quote_char=False,
+                invalid_row_handler=skip_invalid_row,
+            ),
+            convert_options=pa_csv.ConvertOptions(
+                # validated and converted below, so that a single bad value
+                # does not fail the whole file
+                column_types={
+                    "wiki_code": dictionary,
+                    "page_title": pa.string(),
+                    "page_id": pa.string(),
+                    "user_client": dictionary,
+                    "daily_total": pa.string(),
+                    "hourly_count": pa.string(),
+                },
+            ),
+        )
+
+    valid = pc.and_(
+        pc.and_(
+            pc.match_substring_regex(table["page_id"], r"^([0-9]+|null)$"),
+            pc.match_substring_regex(table["daily_total"], r"^[0-9]+$"),
+        ),
+        pc.match_substring_regex(table["hourly_count"], r"^([A-X][0-9]+)*$"),
+    )
+    valid = pc.fill_null(valid, False)
+    invalid = table.filter(pc.invert(valid))
+    if invalid.num_rows > 0:
+        columns = [
+            pc.fill_null(pc.cast(invalid[c], pa.string()), "") for c in PAGEVIEW_COLUMNS
+        ]
+        bad_lines += pc.binary_join_element_wise(*columns, " ").to_pylist()
+        table = table.filter(valid)
+
+    if bad_lines:
+        quarantine = quarantine or Path(str(path) + ".bad")
+        with open(quarantine, "w") as bad:
+            bad.writelines(line + "\n" for line in bad_lines)
+        print(f"quarantined {len(bad_lines)} bad lines of {path} in {quarantine}")
+
+    page_id = table["page_id"]
+    page_id = pc.if_else(
+        pc.equal(page_id, "null"), pa.scalar(None, pa.string()), page_id
+    )
+    table = table.set_column(
+        PAGEVIEW_COLUMNS.index("page_id"), "page_id", pc.cast(page_id, pa.int64())
+    )
+    table = table.set_column(
+        PAGEVIEW_COLUMNS.index("daily_total"),
+        "daily_total",
+        pc.cast(table["daily_total"], pa.int64()),
+    )
+    return table, decode_hourly_counts(table["hourly_count"])
+
+
+def _writer_schema(table: pa.Table) -> pa.Schema:
+    """
+    Widens dictionary indices to int32, because pandas picks the smallest
+    index type per chunk, which would make the chunk schemas incompatible.
+    """
+    fields = []
+    for field in table.schema:
+        if pa.types.is_dictionary(field.type):
+            field = field.with_type(
+                pa.dictionary(pa.int32(), field.type.value_type, field.type.ordered)
+            )
+        fields.append(field)
+    return pa.schema(fields)
+
+
+def write_parquet_chunks(
+    chunks: Iterable[pd.DataFrame], path: PathLike, **options: Any
+) -> int:
+    """writes DataFrame chunks into a single parquet file and returns the row count"""
+    writer = None
+    rows = 0
+    try:
+        for chunk in chunks:
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                schema = _writer_schema(table)
+                writer = pq.ParquetWriter(str(path), schema, **options)
+            writer.write_table(table.cast(schema))
+            rows += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
+
+
+SQL_DUMP_TABLES = dict(
+    page=(PAGE_COLUMNS, PAGE_DTYPE),
+    category=(CATEGORY_COLUMNS, CATEGORY_DTYPE),
+    categorylinks=(CATEGORYLINKS_COLUMNS, CATEGORYLINKS_DTYPE),
+    langlinks=(LANGLINKS_COLUMNS, LANGLINKS_DTYPE),
+)
+
+# a field of an INSERT statement is either a quoted string, where quotes are
+# escaped with backslashes, or a bare NULL or number
+SQL_FIELD = r"(?:'([^'\\]*(?:\\.[^'\\]*)*)'|([^,()']*))"
+
+SQL_ESCAPES = {
+    "0": "\0",
+    "b": "\b",
+    "n": "\n",
+    "r": "\r",
+    "t": "\t",
+    "Z": "\x1a",
+}
+
+_SQL_ESCAPE = re.compile(r"\\(.)", re.DOTALL)
+
+
+def _sql_unescape(value: str) -> str:
+    return _SQL_ESCAPE.sub(lambda m: SQL_ESCAPES.get(m.group(1), m.group(1)), value)
+
+
+def _sql_unescape_array(values: pa.Array) -> pa.Array:
+    """unescapes only the values that contain a backslash"""
+    escaped = pc.fill_null(pc.match_substring(values, "\\"), False)
+    if not pc.any(escaped).as_py():
+        return values
+    unescaped = [_sql_unescape(v) for v in values.filter(escaped).to_pylist()]
+    return pc.replace_with_mask(values, escaped, pa.array(unescaped, pa.string()))
+
+
+def _arrow_type(dtype: str) -> pa.DataType:
+    if dtype in ["int", "Int", "Int64"]:
+        return pa.int64()
+    if dtype == "float":
+        return pa.float64()
+    if dtype == "bool":
+        return pa.bool_()
+    if dtype == "datetime64":
+        return pa.timestamp("s")
+    if dtype == "category":
+        return pa.dictionary(pa.int32(), pa.string())
+    return pa.string()
+
+
+def sql_dump_schema(columns: List[str], dtype: Dict[str, str]) -> pa.Schema:
+    return pa.schema([(c, _arrow_type(dtype.get(c, "string"))) for c in columns])
+
+
+def _sql_column(values: pa.Array, typ: pa.DataType) -> pa.Array:
+    if pa.types.is_integer(typ) or pa.types.is_floating(typ):
+        # like pd.to_numeric(errors="coerce"), invalid numbers become null
+        number = r"^-?[0-9]+$" if pa.types.is_integer(typ) else r"^-?[0-9.eE+-]+$"
+        valid = pc.match_substring_regex(values, number)
+        return pc.cast(pc.if_else(valid, values, pa.scalar(None, pa.string())), typ)
+    if pa.types.is_boolean(typ):
+        return pc.not_equal(pc.cast(values, pa.int64()), 0)
+    if pa.types.is_timestamp(typ):
+        # mediawiki timestamps are written as YYYYMMDDHHMMSS
+        return pc.strptime(values, format="%Y%m%d%H%M%S", unit="s", error_is_null=True)
+    if pa.types.is_dictionary(typ):
+        return pc.dictionary_encode(values).cast(typ)
+    return values
+
+
+def iter_sql_dump_rows(
+    path: PathLike,
+    n_columns: int,
+    encoding: str = "utf-8",
+    errors: str = "replace",
+) -> Iterator[List[Tuple[Optional[str], ...]]]:
+    """
+    Streams the rows of the INSERT INTO ... VALUES (...),(...); statements of
+    a mysql dump, one list per statement. Every row is a tuple with the
+    quoted value and the bare value of each column, one of which is None.
+    """
+    row = re.compile(r"\(" + ",".join([SQL_FIELD] * n_columns) + r"\)", re.DOTALL)
+    with utils.fopen(path, mode="rt", encoding=encoding, errors=errors) as f:
+        for line in f:
+            if not line.startswith("INSERT INTO "):
+                continue
+            start = line.index(" VALUES ") + len(" VALUES ")
+            rows = []
+            end = start
+            for match in row.finditer(line, start):
+                if match.start() != end:
+                    raise ValueError(
+                        f"failed to parse {path}: expected {n_columns} columns "
+                        f"at {line[end : end + 100]!r}"
+                    )
+                rows.append(match.groups())
+                end = match.end() + 1
+            if line[end - 1 :].strip() != ";":
+                raise ValueError(
+                    f"failed to parse {path}: unexpected {line[end - 1 : end + 99]!r}"
+                )
+            yield rows
+
+
+def iter_sql_dump_batches(
+    path: PathLike,
+    columns: List[str],
+    dtype: Dict[str, str],
+    encoding: str = "utf-8",
+    errors: str = "replace",
+) -> Iterator[pa.RecordBatch]:
+    """
+    Parses a mysql dump into record batches, one per INSERT statement,
+    typed like the *_DTYPE definitions.
+    """
+    schema = sql_dump_schema(columns, dtype)
+    for rows in iter_sql_dump_rows(
+        path, len(columns), encoding=encoding, errors=errors
+    ):
+        arrays = []
+        fields = list(zip(*rows)) if rows else [()] * (2 * len(columns))
+        for i, field in enumerate(schema):
+            quoted = _sql_unescape_array(pa.array(fields[2 * i], pa.string()))
+            bare = pa.array(fields[2 * i + 1], pa.string())
+            bare = pc.if_else(
+                pc.equal(bare, "NULL"), pa.scalar(None, pa.string()), bare
+            )
+            values = pc.coalesce(quoted, bare)
+            arrays.append(_sql_column(values, field.type))
+        yield pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def write_sql_dump_parquet(
+    path: PathLike,
+    dest: PathLike,
+    columns: List[str],
+    dtype: Dict[str, str],
+    encoding: str = "utf-8",
+    errors: str = "replace",
+    **options: Any,
+) -> int:
+    """converts a mysql dump into a parquet file in one pass and returns the row count"""
+    rows = 0
+    tmp = Path(str(dest) + ".tmp")
+    try:
+        with pq.ParquetWriter(
+            str(tmp), sql_dump_schema(columns, dtype), **options
+        ) as writer:
+            for batch in iter_sql_dump_batches(
+                path, columns, dtype, encoding=encoding, errors=errors
+            ):
+                writer.write_batch(batch)
+                rows += batch.num_rows
+    except Exception:
+        tmp.unlink(missing_ok=True)
+        raise
+    tmp.replace(dest)
+    return rows
+
+
+# rough peak memory of a single conversion: decompression buffers, the
+# largest INSERT statement and its record batch
+SQL_DUMP_JOB_MEMORY = 512 * 1024 * 1024
+
+
+def sql_dump_parquet_file(path: PathLike) -> Path:
+    # dewiki-20211001-page.sql.gz -> dewiki-20211001-page.parquet
+    return Path(utils.strip_extension(path)).with_suffix(".parquet")
+
+
+def _convert_sql_dump(table: str, path: PathLike, dest: PathLike) -> Tuple[int, float]:
+    start = time.time()
+    columns, dtype = SQL_DUMP_TABLES[table]
+    rows = write_sql_dump_parquet(path, dest, columns, dtype)
+    return rows, time.time() - start
+
+
+def convert_sql_dumps(
+    items: Iterable[Tuple[str, PathLike]],
+    destination_func: Callable[[PathLike], PathLike] = sql_dump_parquet_file,
+    force: bool = False,
+    max_workers: Optional[int] = None,
+    max_memory: Optional[int] = None,
+    memory_func: Callable[[PathLike], int] = lambda _: SQL_DUMP_JOB_MEMORY,
+) -> List[Tuple[Tuple[str, PathLike], Optional[PathLike]]]:
+    """
+    Converts a batch of (table, sql dump) items into parquet in a process pool.
+
+    Jobs are started largest first, so the biggest dumps do not end up
+    running alone at the end. A job is only started while the estimated
+    memory of all running jobs (memory_func per dump) stays below
+    max_memory, smaller jobs fill the remaining room. Outputs that are newer
+    than their dump are skipped. Returns (item, destination) in input
+    order, where destination is None if the conversion failed.
+
+    A worker that dies (e.g. killed for its memory use) breaks the pool and
+    all running jobs, these are retried one at a time in a new pool. A job
+    that breaks the pool while it runs alone fails.
+    """
+    items = list(items)
+    destinations: List[Optional[PathLike]] = [None] * len(items)
+    pending = []
+    for i, (_, path) in enumerate(items):
+        dest = destination_func(path)
+        if (
+            not force
+            and Path(dest).exists()
+            and Path(dest).stat().st_mtime >= Path(path).stat().st_mtime
+        ):
+            print(f"using existing {dest} ...")
+            destinations[i] = dest
+            continue
+        pending.append((Path(path).stat().st_size, i, dest))
+    pending.sort(key=lambda job: job[0], reverse=True)
+
+    jobs = {job[1]: job for job in pending}
+    # jobs that were running when the pool broke
+    suspects: Set[int] = set()
+    running: Dict[concurrent.futures.Future[Tuple[int, float]], Tuple[int, int]] = {}
+    in_flight = 0
+    workers = max_workers or os.cpu_count() or 1
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+    try:
+        while pending or running:
+            broken = False
+            for job in list(pending):
+                if len(running) >= workers:
+                    break
+                _, i, dest = job
+                memory = memory_func(items[i][1])
+                if running and (
+                    i in suspects
+                    or any(j in suspects for j, _ in running.values())
+                    or (max_memory is not None and in_flight + memory > max_memory)
+                ):
+                    continue
+                table, path = items[i]
+                try:
+                    future = executor.submit(_convert_sql_dump, table, path, dest)
+                except BrokenProcessPool as e:
+                    if not running:
+                        # not broken by one of the jobs, a new pool would not help
+                        raise RuntimeError(f"failed to start converting {path}") from e
+                    broken = True
+                    break
+                pending.remove(job)
+                running[future] = (i, memory)
+                in_flight += memory
+
+            if not broken:
+                done, _ = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    if isinstance(future.exception(), BrokenProcessPool):
+                        broken = True
+                        continue
+                    i, memory = running.pop(future)
+                    in_flight -= memory
+                    table, path = items[i]
+                    size = Path(path).stat().st_size
+                    try:
+                        rows, elapsed = future.result()
+                    except Exception as e:
+                        print(f"failed to convert {path}: {e}")
+                        continue
+                    destinations[i] = destination_func(path)
+                    print(
+                        f"converted {path} ({size / 1024 ** 2:.1f} MiB, {rows} rows) "
+                        f"in {elapsed:.2f}s: {size / 1024 ** 2 / max(elapsed, 1e-9):.2f} MiB/s"
+                    )
+
+            if broken:
+                executor.shutdown(wait=True)
+                for i, _ in running.values():
+                    path = items[i][1]
+                    if i in suspects:
+                        print(f"failed to convert {path}: its worker died")
+                        continue
+                    print(f"retrying {path} after a worker died ...")
+                    suspects.add(i)
+                    pending.append(jobs[i])
+                pending.sort(key=lambda job: job[0], reverse=True)
+                running.clear()
+                in_flight = 0
+                executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+    finally:
+        executor.shutdown(wait=True)
+    return list(zip(items, destinations))
+
+
 def sniff_csv_dialect(
     path: PathLike,
     encoding: str = "utf-8",
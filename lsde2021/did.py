@@ -0,0 +1,176 @@
+import re
+import datetime
+import numpy as np
+import pandas as pd
+from typing import List, Optional, Sequence, Tuple
+
+
+class TopicDayMatrix:
+    """
+    Daily page views of the topics of one language as dense (topic x day)
+    sums and row counts, with cumulative sums over the days so that the
+    mean over any window of days takes constant time per topic.
+    """
+
+    def __init__(
+        self,
+        topics: List[str],
+        start: datetime.date,
+        sums: np.ndarray,
+        counts: Optional[np.ndarray] = None,
+    ):
+        self.topics = topics
+        self.start = start
+        self.sums = np.asarray(sums, dtype=np.float64)
+        if counts is None:
+            counts = np.ones(self.sums.shape, dtype=np.int64)
+        self.counts = np.asarray(counts, dtype=np.int64)
+        n_topics, n_days = self.sums.shape
+        self.cumsums = np.zeros((n_topics, n_days + 1), dtype=np.float64)
+        np.cumsum(self.sums, axis=1, out=self.cumsums[:, 1:])
+        self.cumcounts = np.zeros((n_topics, n_days + 1), dtype=np.int64)
+        np.cumsum(self.counts, axis=1, out=self.cumcounts[:, 1:])
+
+    @classmethod
+    def from_frame(
+        cls,
+        df: pd.DataFrame,
+        value: str,
+        topic: str = "topic",
+        date: str = "date",
+        exclude: Sequence[str] = (),
+    ) -> "TopicDayMatrix":
+        """
+        Builds the matrix from rows of (topic, date, value), like the
+        pageviews per topic of a language. Missing values count as 0 views,
+        like the fillna(0) of the notebooks, and topics matching one of the
+        exclude patterns (ignoring case) are left out.
+        """
+        df = df.assign(**{value: df[value].fillna(0)})
+        if len(exclude) > 0:
+            pattern = re.compile("|".join(f"({pat})" for pat in exclude))
+            keep = [pattern.search(t.lower()) is None for t in df[topic]]
+            df = df[np.array(keep, dtype=bool)]
+        days = pd.to_datetime(df[date]).dt.normalize()
+        start = days.min()
+        day_idx = ((days - start) // pd.Timedelta(days=1)).to_numpy(dtype=np.int64)
+        topic_idx, topics = pd.factorize(df[topic], sort=True)
+        n_days = int(day_idx.max()) + 1 if len(day_idx) > 0 else 0
+        sums = np.zeros((len(topics), n_days), dtype=np.float64)
+        counts = np.zeros((len(topics), n_days), dtype=np.int64)
+        np.add.at(sums, (topic_idx, day_idx), df[value].to_numpy(dtype=np.float64))
+        np.add.at(counts, (topic_idx, day_idx), 1)
+        start = start.date() if len(day_idx) > 0 else datetime.date.min
+        return cls(list(topics), start, sums, counts)
+
+    @property
+    def n_days(self) -> int:
+        return int(self.sums.shape[1])
+
+    def day_index(self, dates: Sequence[datetime.date]) -> np.ndarray:
+        return np.array([(d - self.start).days for d in dates], dtype=np.int64)
+
+    def window_means(
+        self, starts: Sequence[datetime.date], ends: Sequence[datetime.date]
+    ) -> np.ndarray:
+        """
+        Returns the (topic x window) means over the days of the windows
+        [start, end], including both ends. Days without a row are not
+        counted, windows without any row are NaN.
+        """
+        first = np.clip(self.day_index(starts), 0, self.n_days)
+        last = np.clip(self.day_index(ends) + 1, 0, self.n_days)
+        last = np.maximum(first, last)
+        sums = self.cumsums[:, last] - self.cumsums[:, first]
+        counts = self.cumcounts[:, last] - self.cumcounts[:, first]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(counts > 0, sums / counts, np.nan)
+
+
+def _divide(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """divides like spark, which is null when dividing by zero"""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(b != 0, a / b, np.nan)
+
+
+def _long_frame(
+    m: TopicDayMatrix,
+    keys: List[Tuple[str, Sequence[datetime.date]]],
+    **columns: np.ndarray,
+) -> pd.DataFrame:
+    """flattens (topic x changepoint) columns, dropping incomplete rows"""
+    n_topics, n_changepoints = m.sums.shape[0], len(keys[0][1])
+    df = pd.DataFrame(
+        {
+            **{
+                name: np.tile(np.array(dates, dtype=object), n_topics)
+                for name, dates in keys
+            },
+            "topic": np.repeat(np.array(m.topics, dtype=object), n_changepoints),
+            **{name: values.ravel() for name, values in columns.items()},
+        }
+    )
+    means = [name for name in columns if name.endswith("mean")]
+    return df.dropna(subset=means).reset_index(drop=True)
+
+
+def did(
+    m: TopicDayMatrix,
+    changepoints: Sequence[datetime.date],
+    control_changepoints: Sequence[datetime.date],
+    window_size: int = 10,
+) -> pd.DataFrame:
+    """
+    Difference in differences of the mean daily views of all topics in the
+    windows of window_size days before and after each changepoint and the
+    matching control changepoint (one year earlier in the notebooks). Topics
+    without views in one of the windows are left out, like the inner joins
+    of the spark implementation. Values are not rounded.
+    """
+    window = datetime.timedelta(days=window_size)
+    pre_target = m.window_means([c - window for c in changepoints], changepoints)
+    post_target = m.window_means(changepoints, [c + window for c in changepoints])
+    pre_control = m.window_means(
+        [c - window for c in control_changepoints], control_changepoints
+    )
+    post_control = m.window_means(
+        control_changepoints, [c + window for c in control_changepoints]
+    )
+    control_diff = pre_control - post_control
+    return _long_frame(
+        m,
+        [
+            ("changepoint", changepoints),
+            ("control_changepoint", control_changepoints),
+        ],
+        pre_target_mean=pre_target,
+        pre_control_mean=pre_control,
+        post_target_mean=post_target,
+        post_control_mean=post_control,
+        control_diff=control_diff,
+        target_diff=post_target - (pre_target + control_diff),
+        rel_diff=_divide(post_target, pre_target + control_diff),
+    )
+
+
+def diff(
+    m: TopicDayMatrix,
+    changepoints: Sequence[datetime.date],
+    window_size: int = 10,
+) -> pd.DataFrame:
+    """
+    Absolute and relative change of the mean daily views of all topics
+    between the windows of window_size days before and after each
+    changepoint. Values are not rounded.
+    """
+    window = datetime.timedelta(days=window_size)
+    pre = m.window_means([c - window for c in changepoints], changepoints)
+    post = m.window_means(changepoints, [c + window for c in changepoints])
+    return _long_frame(
+        m,
+        [("changepoint", changepoints)],
+        pre_mean=pre,
+        post_mean=post,
+        rel_diff=_divide(post, pre),
+        abs_diff=post - pre,
+    )
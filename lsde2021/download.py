@@ -2,18 +2,40 @@ import datetime
 import random
 import sys
 import bz2
+import zlib
+import json
+import re
+import hashlib
 import time
+import threading
 import traceback
 import itertools
+import concurrent.futures
+import contextlib
+from collections import defaultdict
 from functools import partial
 from pathlib import Path, PurePosixPath
-from typing import Iterable, Union, Optional, Tuple, Callable, Literal, List
+from typing import (
+    Iterable,
+    Union,
+    Optional,
+    Tuple,
+    Callable,
+    Literal,
+    List,
+    Dict,
+    TypeVar,
+)
 from urllib.parse import unquote, urlparse
 from dateutil.relativedelta import relativedelta
 
 import requests
 
 from lsde2021.types import PathLike
+import lsde2021.parallel_bz2 as parallel_bz2
+import lsde2021.seekable_zstd as seekable_zstd
+
+T = TypeVar("T")
 
 USER_AGENTS = [
     "Mozilla/5.0 (Macintosh; Intel Mac OS X 11.6; rv:92.0) Gecko/20100101 Firefox/92.0"
@@ -42,6 +64,12 @@ class CorruptFile(ValidationException):
         super().__init__(self.message)
 
 
+class IncompleteDownload(ValidationException):
+    def __init__(self, path: PathLike, size: int, expected: int):
+        self.message = f"file {path} is incomplete ({size} of {expected} bytes)"
+        super().__init__(self.message)
+
+
 def wikimedia_pageview_complete_url(
     date: datetime.date,
     monthly: bool = False,
@@ -73,6 +101,18 @@ def wikimedia_sql_dump_url(
     )
 
 
+def wikimedia_sql_dump_checksums_url(
+    date: datetime.date,
+    wiki: str,
+    hash_name: Literal["md5", "sha1"] = "md5",
+) -> str:
+    year = str(date.year)
+    month = str(date.month).zfill(2)
+    day = str(date.day).zfill(2)
+    datestr = f"{year}{month}{day}"
+    return f"https://dumps.wikimedia.org/{wiki}/{datestr}/{wiki}-{datestr}-{hash_name}sums.txt"
+
+
 def wikimedia_sql_dump_local_file(
     date: datetime.date,
     wiki: str,
@@ -156,18 +196,345 @@ def can_decompress_bz2(path: PathLike) -> bool:
     return False
 
 
-def download_file(
+def zstd_file(path: PathLike) -> Path:
+    return Path(path).with_suffix(".zst")
+
+
+def transcode_to_zstd(
+    path: PathLike,
+    dest: Optional[PathLike] = None,
+    frame_size: int = seekable_zstd.FRAME_SIZE,
+    level: int = 3,
+    processes: Optional[int] = None,
+) -> Path:
+    """
+    Converts a (validated) bz2 file into a seekable zstd file, which is
+    much faster to decompress and can be read by frame in parallel. The
+    bz2 file is decompressed with processes and kept.
+    """
+    dest = Path(dest or zstd_file(path))
+    part_file = Path(f"{dest}.part")
+    start = time.time()
+    with open(part_file, "wb") as out:
+        if processes is None:
+            src = bz2.open(path, "rb")
+        else:
+            src = parallel_bz2.open_parallel(path, "rb", processes=processes)
+        with src:
+            frames = seekable_zstd.write_seekable(
+                iter(lambda: src.read(frame_size), b""),
+                out,
+                frame_size=frame_size,
+                level=level,
+                threads=processes,
+            )
+    part_file.replace(dest)
+    size = sum(f.decompressed_size for f in frames)
+    print(
+        f"transcoded {path} to {dest} ({len(frames)} frames, "
+        f"{size / 1024 ** 2 / max(time.time() - start, 1e-6):.2f} MiB/s)"
+    )
+    return dest
+
+
+class StreamValidator:
+    """
+    Validates a file incrementally while it is being downloaded,
+    optionally computing a checksum of the raw bytes on the way.
+    """
+
+    def __init__(self, hash_name: Optional[str] = None):
+        self.hash_name = hash_name
+        self.hash = hashlib.new(hash_name) if hash_name else None
+
+    def update(self, data: bytes) -> None:
+        if self.hash:
+            self.hash.update(data)
+
+    def finalize(self) -> bool:
+        return True
+
+    def hexdigest(self) -> Optional[str]:
+        return self.hash.hexdigest() if self.hash else None
+
+    def complete(self, path: PathLike) -> None:
+        """called once the validated file was moved to its destination"""
+        hexdigest = self.hexdigest()
+        if self.hash_name and hexdigest:
+            write_checksum_file(path, hexdigest, self.hash_name)
+
+
+class Bz2StreamValidator(StreamValidator):
+    """Decompresses (possibly multi-stream) bz2 data as it streams in"""
+
+    def __init__(self, hash_name: Optional[str] = None, max_length: int = 1 << 20):
+        super().__init__(hash_name=hash_name)
+        self.max_length = max_length
+        self.decompressor = bz2.BZ2Decompressor()
+
+    def update(self, data: bytes) -> None:
+        super().update(data)
+        while True:
+            if self.decompressor.eof:
+                # a new stream follows the end of the previous one
+                data = self.decompressor.unused_data + data
+                if not data:
+                    return
+                self.decompressor = bz2.BZ2Decompressor()
+            # bound the memory used by the (discarded) decompressed output
+            self.decompressor.decompress(data, max_length=self.max_length)
+            data = b""
+            if not self.decompressor.eof and self.decompressor.needs_input:
+                return
+
+    def finalize(self) -> bool:
+        return self.decompressor.eof
+
+
+class GzipStreamValidator(StreamValidator):
+    """Decompresses (possibly multi-member) gzip data as it streams in"""
+
+    def __init__(self, hash_name: Optional[str] = None, max_length: int = 1 << 20):
+        super().__init__(hash_name=hash_name)
+        self.max_length = max_length
+        self.decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+
+    def update(self, data: bytes) -> None:
+        super().update(data)
+        while True:
+            if self.decompressor.eof:
+                # a new member follows the end of the previous one
+                self.decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+            out = self.decompressor.decompress(data, self.max_length)
+            if self.decompressor.eof:
+                data = self.decompressor.unused_data
+                if not data:
+                    return
+                continue
+            data = self.decompressor.unconsumed_tail
+            if not data and len(out) < self.max_length:
+                return
+
+    def finalize(self) -> bool:
+        return self.decompressor.eof
+
+
+def stream_validator_for(
+    path: PathLike, hash_name: Optional[str] = None
+) -> StreamValidator:
+    """picks a stream validator based on the file extension of path"""
+    extension = Path(path).suffix
+    if extension == ".bz2":
+        return Bz2StreamValidator(hash_name=hash_name)
+    if extension == ".gz":
+        return GzipStreamValidator(hash_name=hash_name)
+    return StreamValidator(hash_name=hash_name)
+
+
+def write_checksum_file(path: PathLike, hexdigest: str, hash_name: str) -> PathLike:
+    """writes the checksum of path in md5sum format into path.<hash_name>"""
+    checksum_file = Path(f"{path}.{hash_name}")
+    checksum_file.write_text(f"{hexdigest}  {Path(path).name}\n")
+    return checksum_file
+
+
+class RetryBudget:
+    """Thread safe number of retries shared by all downloads of a batch"""
+
+    def __init__(self, retries: Optional[int] = None):
+        self.retries = retries
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> bool:
+        with self._lock:
+            if self.retries is not None and self.used >= self.retries:
+                return False
+            self.used += 1
+            return True
+
+
+class DownloadProgress:
+    """Aggregate progress of a batch of downloads"""
+
+    def __init__(self, total: int):
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.bytes = 0
+        self.start = time.time()
+        self._lock = threading.Lock()
+
+    def update(self, nbytes: int) -> None:
+        with self._lock:
+            self.bytes += nbytes
+
+    def finish(self, ok: bool) -> None:
+        with self._lock:
+            self.done += 1
+            if not ok:
+                self.failed += 1
+            elapsed = max(time.time() - self.start, 1e-6)
+            print(
+                f"[{self.done}/{self.total}] {self.failed} failed, "
+                f"{self.bytes / 1024 ** 3:.2f} GiB at "
+                f"{self.bytes / 1024 ** 2 / elapsed:.2f} MiB/s"
+            )
+            sys.stdout.flush()
+
+
+def _content_range(r: requests.Response) -> Tuple[Optional[int], Optional[int]]:
+    """returns the (start, total) of a Content-Range: bytes start-end/total header"""
+    match = re.match(
+        r"bytes\s+(\d+|\*)-?\d*/(\d+|\*)", r.headers.get("Content-Range", "")
+    )
+    if match is None:
+        return None, None
+    start, total = match.groups()
+    return (
+        int(start) if start != "*" else None,
+        int(total) if total != "*" else None,
+    )
+
+
+def _transfer(
+    url: str,
+    headers: Dict[str, str],
+    part_file: Path,
+    progress: Optional[Callable[[int], None]] = None,
+    validator: Optional[StreamValidator] = None,
+) -> None:
+    """
+    Downloads url into part_file, resuming from the bytes already in
+    part_file with a Range request. The ETag and length of the first
+    response are kept next to the part file so that a resumed transfer is
+    only appended if the remote file did not change in the meantime.
+
+    If a validator is given, it is fed every byte of the file, including
+    the bytes of a resumed part file, and a corrupt stream aborts the
+    transfer as early as possible.
+    """
+    meta_file = Path(f"{part_file}.json")
+    offset = part_file.stat().st_size if part_file.exists() else 0
+    meta = dict()
+    if offset > 0 and meta_file.exists():
+        meta = json.loads(meta_file.read_text())
+
+    request_headers = dict(headers)
+    if offset > 0:
+        request_headers["Range"] = f"bytes={offset}-"
+        if meta.get("etag"):
+            request_headers["If-Range"] = meta["etag"]
+
+    with requests.get(
+        url, headers=request_headers, stream=True, allow_redirects=True
+    ) as r:
+        if r.status_code == 416 and offset > 0:
+            # requested range not satisfiable: done if we already have everything
+            _, total = _content_range(r)
+            if total is not None and total == offset == meta.get("length", total):
+                # nothing left to transfer, but the part file is validated
+                # like any other before it is moved into place
+                if validator:
+                    _catch_up(validator, part_file)
+                _check_part_file(url, part_file, total, validator)
+                return
+            part_file.unlink()
+            raise IncompleteDownload(part_file, offset, total or 0)
+        r.raise_for_status()
+
+        expected = None
+        if r.status_code == 206:
+            start, expected = _content_range(r)
+            etag = r.headers.get("ETag")
+            changed = (
+                start != offset
+                or (meta.get("etag") and etag and etag != meta["etag"])
+                or (meta.get("length") and expected != meta["length"])
+            )
+            if changed:
+                # the remote file changed or the range is off, start over
+                part_file.unlink()
+                raise IncompleteDownload(part_file, offset, expected or 0)
+            if not meta:
+                meta = dict(etag=etag, length=expected)
+                meta_file.write_text(json.dumps(meta))
+        else:
+            # the server sent the full file
+            offset = 0
+            if "Content-Length" in r.headers and "Content-Encoding" not in r.headers:
+                expected = int(r.headers["Content-Length"])
+            meta = dict(etag=r.headers.get("ETag"), length=expected)
+            meta_file.write_text(json.dumps(meta))
+
+        if validator and offset > 0:
+            _catch_up(validator, part_file)
+
+        with open(part_file, "ab" if offset > 0 else "wb") as f:
+            for chunk in r.iter_content(chunk_size=8192):
+                if chunk:
+                    if validator:
+                        _validate_chunk(validator, chunk, part_file)
+                    f.write(chunk)
+                    if progress:
+                        progress(len(chunk))
+
+    _check_part_file(url, part_file, expected, validator)
+
+
+def _check_part_file(
+    url: str,
+    part_file: Path,
+    expected: Optional[int],
+    validator: Optional[StreamValidator],
+) -> None:
+    size = part_file.stat().st_size
+    if expected is not None and size != expected:
+        raise IncompleteDownload(part_file, size, expected)
+    if validator and not validator.finalize():
+        part_file.unlink()
+        raise CorruptFile(url)
+
+
+def _catch_up(validator: StreamValidator, part_file: Path) -> None:
+    """feeds the bytes already in part_file to the validator"""
+    with open(part_file, "rb") as f:
+        for data in iter(lambda: f.read(1024 * 1024), b""):
+            _validate_chunk(validator, data, part_file)
+
+
+def _validate_chunk(validator: StreamValidator, data: bytes, part_file: Path) -> None:
+    try:
+        validator.update(data)
+    except (OSError, EOFError, zlib.error):
+        # corrupt bytes can not be resumed from
+        part_file.unlink()
+        raise CorruptFile(part_file)
+
+
+def _download_file(
     url: str,
     destination: PathLike,
     force: bool = False,
     max_retries: int = 20,
     validate_file_func: Optional[Callable[[PathLike], bool]] = None,
+    retry_budget: Optional[RetryBudget] = None,
+    progress: Optional[Callable[[int], None]] = None,
+    retry_wait: float = 20,
+    stream_validator_func: Optional[Callable[[PathLike], StreamValidator]] = None,
+    zstd: bool = False,
+    host_slot: Optional[threading.Semaphore] = None,
 ) -> PathLike:
+    # bz2 files are stored as seekable zstd files in addition
+    zstd = zstd and Path(destination).suffix == ".bz2"
+    if not force and zstd and zstd_file(destination).exists():
+        print(f"using existing file {zstd_file(destination)} ...")
+        return zstd_file(destination)
     if not force and Path(destination).exists():
         if not validate_file_func or validate_file_func(destination):
             print(f"using existing file {destination} ...")
             # skip download
-            return destination
+            return transcode_to_zstd(destination) if zstd else destination
 
     # make sure the directory exists
     Path(destination).parent.mkdir(parents=True, exist_ok=True)
@@ -175,47 +542,157 @@ def download_file(
     # use unsuspiscious user agent header
     headers = {"User-Agent": random.choice(USER_AGENTS)}
 
+    # partial downloads are kept in a .part file and resumed on failure
+    part_file = Path(f"{destination}.part")
+
     print(f"downloading file {destination} ...")
 
     # download the file
-    try:
-        last_error = None
-        retries = 1
-        while True:
-            try:
-                with requests.get(
-                    url, headers=headers, stream=True, allow_redirects=True
-                ) as r:
-                    r.raise_for_status()
-                    with open(destination, "wb") as f:
-                        for chunk in r.iter_content(chunk_size=8192):
-                            if chunk:
-                                f.write(chunk)
+    last_error = None
+    retries = 1
+    # the slot of the host is only held during an attempt, not while waiting
+    slot = host_slot if host_slot is not None else contextlib.nullcontext()
+    while True:
+        try:
+            with slot:
+                validator = (
+                    stream_validator_func(destination)
+                    if stream_validator_func
+                    else None
+                )
+                _transfer(
+                    url, headers, part_file, progress=progress, validator=validator
+                )
+                part_file.replace(destination)
+                Path(f"{part_file}.json").unlink(missing_ok=True)
+                if validator:
+                    validator.complete(destination)
                 # check if the file is fine
                 if validate_file_func and not validate_file_func(destination):
+                    # a corrupt file cannot be resumed
+                    Path(destination).unlink()
                     raise ValidationException(
                         f"failed to validate downloaded file from {url}"
                     )
-                break
-            except (requests.exceptions.RequestException, ValidationException) as e:
-                if isinstance(e, requests.exceptions.HTTPError):
-                    if not (500 <= e.response.status_code < 600):
-                        raise e
-                elif isinstance(e, ValidationException):
-                    pass
-                else:
+            break
+        except (requests.exceptions.RequestException, ValidationException) as e:
+            if isinstance(e, requests.exceptions.HTTPError):
+                if not (500 <= e.response.status_code < 600):
                     raise e
-                last_error = e
-                wait_time = retries * 20
-                print(f"waiting {wait_time} seconds ...")
-                sys.stdout.flush()
-                time.sleep(wait_time)
-                retries += 1
-            if retries >= max_retries:
-                raise ValueError(
-                    f"failed to download after {retries} attempts: {last_error}"
-                )
+            elif isinstance(
+                e,
+                (
+                    ValidationException,
+                    requests.exceptions.ConnectionError,
+                    requests.exceptions.ChunkedEncodingError,
+                    requests.exceptions.Timeout,
+                ),
+            ):
+                pass
+            else:
+                raise e
+            last_error = e
+            if retry_budget and not retry_budget.acquire():
+                raise ValueError(f"retry budget exhausted: {last_error}")
+            wait_time = retries * retry_wait
+            print(f"waiting {wait_time} seconds ...")
+            sys.stdout.flush()
+            time.sleep(wait_time)
+            retries += 1
+        if retries >= max_retries:
+            raise ValueError(
+                f"failed to download after {retries} attempts: {last_error}"
+            )
+    if zstd:
+        return transcode_to_zstd(destination)
+    return destination
+
+
+def download_file(
+    url: str,
+    destination: PathLike,
+    force: bool = False,
+    max_retries: int = 20,
+    validate_file_func: Optional[Callable[[PathLike], bool]] = None,
+    retry_wait: float = 20,
+    stream_validator_func: Optional[Callable[[PathLike], StreamValidator]] = None,
+    zstd: bool = False,
+) -> PathLike:
+    try:
+        return _download_file(
+            url,
+            destination,
+            force=force,
+            max_retries=max_retries,
+            validate_file_func=validate_file_func,
+            retry_wait=retry_wait,
+            stream_validator_func=stream_validator_func,
+            zstd=zstd,
+        )
     except Exception as e:
         print(f"failed to download {url}: {e}")
         print(traceback.format_exc())
     return destination
+
+
+def download_files(
+    items: Iterable[Tuple[T, str]],
+    destination_func: Callable[[T], PathLike],
+    force: bool = False,
+    max_workers: int = 8,
+    max_per_host: int = 2,
+    max_retries: int = 20,
+    max_total_retries: Optional[int] = None,
+    validate_file_func: Optional[Callable[[PathLike], bool]] = None,
+    retry_wait: float = 20,
+    stream_validator_func: Optional[Callable[[PathLike], StreamValidator]] = None,
+    zstd: bool = False,
+) -> List[Tuple[T, Optional[PathLike]]]:
+    """
+    Downloads a batch of (params, url) items, e.g. from
+    wikimedia_pageview_complete_urls or wikimedia_sql_dump_urls, in parallel.
+
+    At most max_per_host transfers run against the same host at any time
+    and all downloads draw their retries from a shared budget of
+    max_total_retries (unlimited by default) in addition to the max_retries
+    per file. Returns (params, destination) in input order, where
+    destination is None if the download failed. With zstd, bz2 files are
+    also converted into seekable zstd files once, whose path is returned.
+    """
+    items = list(items)
+    host_slots: Dict[str, threading.Semaphore] = defaultdict(
+        lambda: threading.Semaphore(max_per_host)
+    )
+    for _, url in items:
+        _ = host_slots[urlparse(url).netloc]
+
+    retry_budget = RetryBudget(max_total_retries)
+    progress = DownloadProgress(total=len(items))
+
+    def handler(item: Tuple[T, str]) -> Optional[PathLike]:
+        params, url = item
+        destination = destination_func(params)
+        try:
+            destination = _download_file(
+                url,
+                destination,
+                force=force,
+                max_retries=max_retries,
+                validate_file_func=validate_file_func,
+                retry_budget=retry_budget,
+                progress=progress.update,
+                retry_wait=retry_wait,
+                stream_validator_func=stream_validator_func,
+                zstd=zstd,
+                host_slot=host_slots[urlparse(url).netloc],
+            )
+        except Exception as e:
+            print(f"failed to download {url}: {e}")
+            progress.finish(ok=False)
+            return None
+        progress.finish(ok=True)
+        return destination
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        destinations = list(executor.map(handler, items))
+    return list(zip([params for params, _ in items], destinations))
@@ -22,11 +22,12 @@ from __future__ import division
 from builtins import str, bytes, dict, int
 from builtins import map, zip, filter
 from builtins import object, range
-from typing import Dict, List, Tuple, Pattern, Optional
+from typing import Dict, Iterable, List, Tuple, Pattern, Optional, Set
 
 import os
 import sys
 import re
+import functools
 
 VERB, NOUN, ADJECTIVE, ADVERB = "VB", "NN", "JJ", "RB"
 
@@ -540,6 +541,84 @@ plural_categories = {
 }
 
 
+# For performance, look up category membership in sets:
+plural_category_sets: Dict[str, Set[str]] = {
+    category: set(words) for category, words in plural_categories.items()
+}
+
+# Results of inflecting words without custom replacements are cached.
+INFLECTION_CACHE_SIZE = 1 << 18
+
+
+def _top_level_alternatives(pattern: str) -> List[str]:
+    """Splits a regular expression on the | that are not inside a group."""
+    alternatives, depth, start = [], 0, 0
+    for i, c in enumerate(pattern):
+        if c in "([" and (i == 0 or pattern[i - 1] != "\\"):
+            depth += 1
+        elif c in ")]" and (i == 0 or pattern[i - 1] != "\\"):
+            depth -= 1
+        elif c == "|" and depth == 0:
+            alternatives.append(pattern[start:i])
+            start = i + 1
+    return alternatives + [pattern[start:]]
+
+
+def _rule_endings(suffix: Pattern[str]) -> Optional[Set[str]]:
+    """
+    Returns the last characters of the ascii words a rule can match, or None
+    if the rule is not anchored to a literal character before the end.
+    """
+    endings = set()
+    pattern = suffix.pattern.replace("(?i)", "")
+    for alternative in _top_level_alternatives(pattern):
+        if len(alternative) < 2 or not alternative.endswith("$"):
+            return None
+        last = alternative[-2]
+        if not (last.isalnum() or last in " -'") or alternative[-3:-2] == "\\":
+            return None
+        endings.add(last)
+    if suffix.flags & re.IGNORECASE:
+        endings |= {c.lower() for c in endings} | {c.upper() for c in endings}
+    return endings
+
+
+def _index_rules(suffixes: List[Pattern[str]]) -> Dict[Optional[str], List[int]]:
+    """
+    Indexes rules by the last character of the words they can match. Rules
+    that are not anchored to a character are listed under every character
+    and under the empty string, which is used for all other words. None
+    lists all rules.
+    """
+    endings = [_rule_endings(suffix) for suffix in suffixes]
+    chars: Set[str] = set().union(*[e for e in endings if e is not None])
+    index: Dict[Optional[str], List[int]] = {
+        c: [i for i, e in enumerate(endings) if e is None or c in e]
+        for c in chars | {""}
+    }
+    index[None] = list(range(len(suffixes)))
+    return index
+
+
+def _candidate_rules(index: Dict[Optional[str], List[int]], word: str) -> List[int]:
+    last = word[-1:]
+    # $ also matches before a trailing newline and non ascii characters can
+    # match ascii ones when ignoring case, so these try all rules
+    if last == "\n" or not last.isascii():
+        return index[None]
+    return index.get(last, index[""])
+
+
+# Flattened pluralization rules, of which only the first groups apply to
+# adjectives, indexed by the last character of the words they match.
+plural_rules_flat = [rule for grp in plural_rules for rule in grp]
+plural_rules_adjective = len(plural_rules[0]) + len(plural_rules[1])
+plural_rules_index = _index_rules([rule[0] for rule in plural_rules_flat])
+plural_rules_index_adjective = _index_rules(
+    [rule[0] for rule in plural_rules_flat[:plural_rules_adjective]]
+)
+
+
 def pluralize(
     word: str, pos: str = NOUN, custom: Dict[str, str] = {}, classical: bool = True
 ) -> str:
@@ -548,6 +627,26 @@ def pluralize(
     (i.e., where "matrix" pluralizes to "matrices" and not "matrixes").
     The custom dictionary is for user-defined replacements.
     """
+    if custom:
+        return _pluralize(word, pos, custom, classical)
+    return _cached_pluralize(word, pos, classical)
+
+
+def pluralize_many(
+    words: Iterable[str], pos: str = NOUN, classical: bool = True
+) -> List[str]:
+    """Returns the plurals of the given words, inflecting each distinct word once."""
+    words = list(words)
+    plurals = {word: pluralize(word, pos, classical=classical) for word in set(words)}
+    return [plurals[word] for word in words]
+
+
+@functools.lru_cache(maxsize=INFLECTION_CACHE_SIZE)
+def _cached_pluralize(word: str, pos: str, classical: bool) -> str:
+    return _pluralize(word, pos, {}, classical)
+
+
+def _pluralize(word: str, pos: str, custom: Dict[str, str], classical: bool) -> str:
     if word in custom:
         return custom[word]
     # Recurse genitives.
@@ -567,7 +666,7 @@ def pluralize(
         if (
             wl[1] == "general"
             or wl[1] == "General"
-            and wl[0] not in plural_categories["general-generals"]
+            and wl[0] not in plural_category_sets["general-generals"]
         ):
             return word.replace(wl[0], pluralize(wl[0], pos, custom, classical))
         elif wl[1] in plural_prepositions:
@@ -575,24 +674,24 @@ def pluralize(
         else:
             return word.replace(wl[-1], pluralize(wl[-1], pos, custom, classical))
     # Only a very few number of adjectives inflect.
-    n = list(range(len(plural_rules)))
+    index = plural_rules_index
     if pos.startswith(ADJECTIVE):
-        n = [0, 1]
-    # Apply pluralization rules.
-    for i in n:
-        for suffix, inflection, category, classic in plural_rules[i]:
-            # A general rule, or a classic rule in classical mode.
-            if category is None:
-                if not classic or (classic and classical):
-                    if suffix.search(word) is not None:
-                        return suffix.sub(inflection, word)
-            # A rule pertaining to a specific category of words.
-            if category is not None:
-                if word in plural_categories[category] and (
-                    not classic or (classic and classical)
-                ):
-                    if suffix.search(word) is not None:
-                        return suffix.sub(inflection, word)
+        index = plural_rules_index_adjective
+    # Apply pluralization rules that can match the ending of the word.
+    for i in _candidate_rules(index, word):
+        suffix, inflection, category, classic = plural_rules_flat[i]
+        # A general rule, or a classic rule in classical mode.
+        if category is None:
+            if not classic or (classic and classical):
+                if suffix.search(word) is not None:
+                    return suffix.sub(inflection, word)
+        # A rule pertaining to a specific category of words.
+        if category is not None:
+            if word in plural_category_sets[category] and (
+                not classic or (classic and classical)
+            ):
+                if suffix.search(word) is not None:
+                    return suffix.sub(inflection, word)
     return word
 
 
@@ -843,8 +942,41 @@ singular_irregular = {
 }
 
 
+# For performance, replace the scans over the word lists by lookups:
+# words that are the ending of an uninflected or uncountable word,
+singular_uninflected_endings = set(
+    x[i:]
+    for x in singular_uninflected | singular_uncountable
+    for i in range(len(x) + 1)
+)
+# -ie plurals and the position of the irregular plurals in the dictionary.
+singular_ie_plurals = tuple(x + "s" for x in singular_ie)
+singular_irregular_plurals = tuple(singular_irregular)
+singular_irregular_order = {x: i for i, x in enumerate(singular_irregular)}
+singular_irregular_lengths = sorted(set(len(x) for x in singular_irregular))
+singular_rules_index = _index_rules([rule[0] for rule in singular_rules])
+
+
 def singularize(word: str, pos: str = NOUN, custom: Dict[str, str] = {}) -> str:
     """Returns the singular of a given word."""
+    if custom:
+        return _singularize(word, pos, custom)
+    return _cached_singularize(word, pos)
+
+
+def singularize_many(words: Iterable[str], pos: str = NOUN) -> List[str]:
+    """Returns the singulars of the given words, inflecting each distinct word once."""
+    words = list(words)
+    singulars = {word: singularize(word, pos) for word in set(words)}
+    return [singulars[word] for word in words]
+
+
+@functools.lru_cache(maxsize=INFLECTION_CACHE_SIZE)
+def _cached_singularize(word: str, pos: str) -> str:
+    return _singularize(word, pos, {})
+
+
+def _singularize(word: str, pos: str, custom: Dict[str, str]) -> str:
     if word in custom:
         return custom[word]
     # Recurse compound words (e.g. mothers-in-law).
@@ -856,24 +988,24 @@ def singularize(word: str, pos: str = NOUN, custom: Dict[str, str] = {}) -> str:
     if word.endswith("'"):
         return singularize(word[:-1]) + "'s"
     w = word.lower()
-    for x in singular_uninflected:
-        if x.endswith(w):
-            return word
-    for x in singular_uncountable:
-        if x.endswith(w):
-            return word
-    for x in singular_ie:
-        if w.endswith(x + "s"):
-            return w
-    for x in singular_irregular:
-        if w.endswith(x):
-            return re.sub("(?i)" + x + "$", singular_irregular[x], word)
-    for suffix, inflection in singular_rules:
-        m = re.search(suffix, word)
+    if w in singular_uninflected_endings:
+        return word
+    if w.endswith(singular_ie_plurals):
+        return w
+    if w.endswith(singular_irregular_plurals):
+        # the first irregular plural in the dictionary that ends the word
+        irregular = [
+            w[-n:] for n in singular_irregular_lengths if w[-n:] in singular_irregular
+        ]
+        x = min(irregular, key=singular_irregular_order.__getitem__)
+        return re.sub("(?i)" + x + "$", singular_irregular[x], word)
+    for i in _candidate_rules(singular_rules_index, word):
+        suffix, inflection = singular_rules[i]
+        m = suffix.search(word)
         g = m and m.groups() or []
         if m:
             for k in range(len(g)):
                 if g[k] is None:
                     inflection = inflection.replace("\\" + str(k + 1), "")
-            return re.sub(suffix, inflection, word)
+            return suffix.sub(inflection, word)
     return word
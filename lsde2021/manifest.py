@@ -0,0 +1,164 @@
+import os
+import json
+import hashlib
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Optional, Union
+
+import lsde2021.download as dl
+from lsde2021.types import PathLike
+
+HASH_LENGTHS = {32: "md5", 40: "sha1", 64: "sha256"}
+
+
+def load_checksums(path: PathLike) -> Dict[str, str]:
+    """
+    Loads a checksum file in md5sum format, as published next to the
+    wikimedia dumps (e.g. enwiki-20211001-md5sums.txt), into a dict
+    from file name to hex digest.
+    """
+    checksums = dict()
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            hexdigest, filename = line.split(maxsplit=1)
+            # binary mode entries are prefixed with a star
+            checksums[Path(filename.lstrip("*")).name] = hexdigest.lower()
+    return checksums
+
+
+def hash_file(path: PathLike, hash_name: str, chunk_size: int = 1024 * 1024) -> str:
+    h = hashlib.new(hash_name)
+    with open(path, "rb") as f:
+        for data in iter(lambda: f.read(chunk_size), b""):
+            h.update(data)
+    return h.hexdigest()
+
+
+class VerifiedState:
+    """
+    Small json file that remembers the size, modification time and checksum
+    of files that have been verified, so they do not need to be read again.
+    """
+
+    def __init__(self, path: PathLike):
+        self.path = Path(path)
+        self.entries: Dict[str, Dict[str, Union[str, int]]] = dict()
+        if self.path.exists():
+            self.entries = json.loads(self.path.read_text())
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(path: PathLike) -> str:
+        return str(Path(path).resolve())
+
+    def is_verified(self, path: PathLike) -> bool:
+        entry = self.entries.get(self._key(path))
+        if entry is None:
+            return False
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return False
+        return bool(
+            entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns
+        )
+
+    def mark_verified(self, path: PathLike, hash_name: str, hexdigest: str) -> None:
+        stat = os.stat(path)
+        with self._lock:
+            self.entries[self._key(path)] = dict(
+                size=stat.st_size,
+                mtime_ns=stat.st_mtime_ns,
+                hash_name=hash_name,
+                hexdigest=hexdigest,
+            )
+            self.save()
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(json.dumps(self.entries, indent=2, sort_keys=True))
+        tmp.replace(self.path)
+
+
+class ManifestStreamValidator(dl.StreamValidator):
+    """
+    Hashes a download while it streams in, compares the digest with the
+    manifest and records the file as verified once it is in place.
+    """
+
+    def __init__(self, manifest: "ChecksumManifest", path: PathLike):
+        super().__init__(hash_name=manifest.hash_name)
+        self.manifest = manifest
+        self.expected = manifest.expected(path)
+        # also check the compressed stream, but hash only once
+        self.inner = dl.stream_validator_for(path)
+
+    def update(self, data: bytes) -> None:
+        super().update(data)
+        self.inner.update(data)
+
+    def finalize(self) -> bool:
+        if not self.inner.finalize():
+            return False
+        return self.expected is None or self.hexdigest() == self.expected
+
+    def complete(self, path: PathLike) -> None:
+        hexdigest = self.hexdigest()
+        assert hexdigest is not None
+        self.manifest.state.mark_verified(path, self.manifest.hash_name, hexdigest)
+
+
+class ChecksumManifest:
+    """
+    Expected checksums of downloaded files, loaded from local md5sums or
+    sha1sums files, together with the state of already verified files.
+
+    Use validate_file as the validate_file_func and stream_validator as the
+    stream_validator_func of download_file or download_files.
+    """
+
+    def __init__(
+        self,
+        checksum_files: Iterable[PathLike],
+        state_file: PathLike,
+        hash_name: Optional[str] = None,
+        fallback_func: Optional[Callable[[PathLike], bool]] = None,
+    ):
+        self.checksums: Dict[str, str] = dict()
+        for checksum_file in checksum_files:
+            self.checksums.update(load_checksums(checksum_file))
+        if hash_name is None:
+            lengths = {len(h) for h in self.checksums.values()}
+            if len(lengths) > 1:
+                raise ValueError(f"checksums have mixed lengths {lengths}")
+            hash_name = HASH_LENGTHS.get(lengths.pop(), "md5") if lengths else "md5"
+        self.hash_name = hash_name
+        self.state = VerifiedState(state_file)
+        self.fallback_func = fallback_func
+
+    def expected(self, path: PathLike) -> Optional[str]:
+        return self.checksums.get(Path(path).name)
+
+    def validate_file(self, path: PathLike) -> bool:
+        """
+        Checks an existing file. Files that are recorded as verified and
+        did not change since are accepted without reading them.
+        """
+        if self.state.is_verified(path):
+            return True
+        expected = self.expected(path)
+        if expected is None:
+            if not self.fallback_func or not self.fallback_func(path):
+                return False
+        hexdigest = hash_file(path, self.hash_name)
+        if expected is not None and hexdigest != expected:
+            return False
+        self.state.mark_verified(path, self.hash_name, hexdigest)
+        return True
+
+    def stream_validator(self, path: PathLike) -> dl.StreamValidator:
+        return ManifestStreamValidator(self, path)
@@ -0,0 +1,316 @@
+import io
+import bz2
+import mmap
+import collections
+import concurrent.futures
+from pathlib import Path
+from typing import (
+    IO,
+    Any,
+    Callable,
+    Deque,
+    Generator,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+)
+from lsde2021.types import PathLike
+
+# a bz2 stream is a "BZh<level>" header followed by blocks that each start with
+# the 48 bit block magic (BCD pi) and an end of stream marker (BCD sqrt pi),
+# none of which are byte aligned.
+BLOCK_MAGIC = 0x314159265359
+EOS_MAGIC = 0x177245385090
+MAGIC_BITS = 48
+CRC_BITS = 32
+
+# number of following markers a block may be extended to when a marker
+# turns out to be a false positive inside the compressed data
+MAX_FALSE_MARKERS = 4
+
+
+class Segment(NamedTuple):
+    # bit offset of the block magic
+    start: int
+    # bit offsets of the following markers, the first is the likely end
+    ends: Tuple[int, ...]
+    # block size level from the header of the stream the block belongs to
+    level: bytes
+
+
+def _magic_patterns(magic: int) -> List[Tuple[int, bytes, int]]:
+    """
+    Returns (shift, pattern, offset) for all 8 bit shifts of magic, where
+    pattern are the bytes that are fully covered by the shifted magic and
+    offset is the position of the pattern relative to the first byte.
+    """
+    patterns = []
+    for shift in range(8):
+        nbytes = (shift + MAGIC_BITS + 7) // 8
+        shifted = magic << (nbytes * 8 - shift - MAGIC_BITS)
+        window = shifted.to_bytes(nbytes, "big")
+        first = 0 if shift == 0 else 1
+        last = (shift + MAGIC_BITS) // 8
+        patterns.append((shift, window[first:last], first))
+    return patterns
+
+
+def _find_magic(
+    data: Union[bytes, mmap.mmap], magic: int, start: int, end: int
+) -> List[int]:
+    """finds the bit offsets of magic that begin in the bytes [start, end)"""
+    found = []
+    for shift, pattern, offset in _magic_patterns(magic):
+        pos = data.find(pattern, start + offset, end + offset + len(pattern))
+        while pos >= 0:
+            first = pos - offset
+            nbytes = (shift + MAGIC_BITS + 7) // 8
+            if start <= first < end and first + nbytes <= len(data):
+                window = int.from_bytes(data[first : first + nbytes], "big")
+                value = window >> (nbytes * 8 - shift - MAGIC_BITS)
+                if value & ((1 << MAGIC_BITS) - 1) == magic:
+                    found.append(first * 8 + shift)
+            pos = data.find(pattern, pos + 1, end + offset + len(pattern))
+    return found
+
+
+def _read_bits(data: bytes, byte_offset: int, start: int, end: int) -> int:
+    """reads bits [start, end) of data that starts at byte_offset as an int"""
+    value = int.from_bytes(data, "big")
+    value >>= (byte_offset + len(data)) * 8 - end
+    return value & ((1 << (end - start)) - 1)
+
+
+def iter_segments(
+    path: PathLike, chunk_size: int = 64 * 1024 * 1024
+) -> Iterator[Segment]:
+    """
+    Scans a (possibly multi-stream) bz2 file for block boundaries without
+    decompressing it and yields them in order.
+    """
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        size = len(m)
+        if m[:3] != b"BZh":
+            raise OSError(f"{path} is not a bz2 file")
+        level = m[3:4]
+        markers: List[Tuple[int, bool, bytes]] = []
+        for chunk_start in range(0, size, chunk_size):
+            chunk_end = min(chunk_start + chunk_size, size)
+            found = [
+                (bit, True)
+                for bit in _find_magic(m, BLOCK_MAGIC, chunk_start, chunk_end)
+            ]
+            found += [
+                (bit, False)
+                for bit in _find_magic(m, EOS_MAGIC, chunk_start, chunk_end)
+            ]
+            for bit, is_block in sorted(found):
+                if not is_block:
+                    # the next stream starts on the byte after marker and crc
+                    next_stream = (bit + MAGIC_BITS + CRC_BITS + 7) // 8
+                    if next_stream >= size:
+                        pass
+                    elif m[next_stream : next_stream + 3] == b"BZh":
+                        level = m[next_stream + 3 : next_stream + 4]
+                    else:
+                        # false positive inside the compressed data
+                        continue
+                markers.append((bit, is_block, level))
+            # emit all blocks whose possible ends are known
+            while len(markers) > MAX_FALSE_MARKERS:
+                segment = _segment(markers)
+                markers.pop(0)
+                if segment is not None:
+                    yield segment
+        while markers:
+            segment = _segment(markers)
+            markers.pop(0)
+            if segment is not None:
+                yield segment
+
+
+def _segment(markers: List[Tuple[int, bool, bytes]]) -> Optional[Segment]:
+    start, is_block, level = markers[0]
+    if not is_block:
+        return None
+    ends = []
+    for bit, is_block, _ in markers[1 : 1 + MAX_FALSE_MARKERS]:
+        ends.append(bit)
+        if not is_block:
+            # a block never extends beyond the end of its stream
+            break
+    if not ends:
+        raise OSError("bz2 block is missing its end of stream marker")
+    return Segment(start=start, ends=tuple(ends), level=level)
+
+
+def decompress_segment(path: PathLike, segment: Segment) -> Tuple[bytes, int]:
+    """
+    Decompresses a single block by wrapping it into its own bz2 stream.
+    Returns the decompressed data and the number of markers that were
+    consumed, which is more than one if a marker was a false positive.
+    """
+    byte_start = segment.start // 8
+    with open(path, "rb") as f:
+        f.seek(byte_start)
+        data = f.read((segment.ends[-1] + 7) // 8 - byte_start)
+
+    last_error = None
+    for consumed, end in enumerate(segment.ends, start=1):
+        block = _read_bits(
+            data[: (end + 7) // 8 - byte_start], byte_start, segment.start, end
+        )
+        nbits = end - segment.start
+        # the combined crc of a single block stream is the crc of the block
+        crc = (block >> (nbits - MAGIC_BITS - CRC_BITS)) & 0xFFFFFFFF
+        stream = (block << (MAGIC_BITS + CRC_BITS)) | (EOS_MAGIC << CRC_BITS) | crc
+        nbits += MAGIC_BITS + CRC_BITS
+        padding = -nbits % 8
+        stream <<= padding
+        try:
+            return (
+                bz2.decompress(
+                    b"BZh"
+                    + segment.level
+                    + stream.to_bytes((nbits + padding) // 8, "big")
+                ),
+                consumed,
+            )
+        except (OSError, ValueError) as e:
+            last_error = e
+    raise OSError(
+        f"failed to decompress bz2 block at bit {segment.start}: {last_error}"
+    )
+
+
+def _decompress_segment_or_none(
+    path: PathLike, segment: Segment, func: Optional[Callable[[bytes], Any]] = None
+) -> Tuple[Optional[Any], int]:
+    try:
+        data, consumed = decompress_segment(path, segment)
+    except OSError:
+        # segments that start at a false positive marker can not be decoded
+        return None, 0
+    return (data if func is None else func(data)), consumed
+
+
+def iter_blocks(
+    path: PathLike,
+    executor: concurrent.futures.Executor,
+    prefetch: int,
+    func: Optional[Callable[[bytes], Any]] = None,
+) -> Generator[Tuple[Segment, Any], None, None]:
+    """
+    Decompresses the blocks of a bz2 file in executor and yields them in
+    order with their segment, whose ends start at the end that was used.
+    Segments that were split at a false positive marker are merged. With
+    func (picklable for a process pool, never returning None), the data is
+    mapped in the executor and the result is yielded instead.
+    """
+    segments = iter_segments(path)
+    pending: Deque[
+        Tuple[Segment, "concurrent.futures.Future[Tuple[Optional[Any], int]]"]
+    ] = collections.deque()
+    skip = 0
+    try:
+        while True:
+            while len(pending) < prefetch:
+                segment = next(segments, None)
+                if segment is None:
+                    break
+                pending.append(
+                    (
+                        segment,
+                        executor.submit(
+                            _decompress_segment_or_none, path, segment, func
+                        ),
+                    )
+                )
+            if not pending:
+                return
+            segment, future = pending.popleft()
+            result, consumed = future.result()
+            if skip > 0:
+                # the block was merged into the previous one
+                skip -= 1
+                continue
+            if result is None:
+                # raises the original decompression error
+                data, consumed = decompress_segment(path, segment)
+                result = data if func is None else func(data)
+            skip = consumed - 1
+            yield segment._replace(ends=segment.ends[consumed - 1 :]), result
+    finally:
+        for _, future in pending:
+            future.cancel()
+
+
+class ParallelBZ2Reader(io.RawIOBase):
+    """
+    Raw, read-only stream over the decompressed content of a bz2 file whose
+    blocks are decompressed in a process pool and returned in order.
+    """
+
+    def __init__(
+        self,
+        path: PathLike,
+        processes: Optional[int] = None,
+        prefetch: Optional[int] = None,
+        executor: Optional[concurrent.futures.Executor] = None,
+    ):
+        super().__init__()
+        self.path = Path(path)
+        self._own_executor = executor is None
+        self.executor = executor or concurrent.futures.ProcessPoolExecutor(
+            max_workers=processes
+        )
+        self.prefetch = prefetch or 2 * (processes or 4)
+        self._blocks = iter_blocks(self.path, self.executor, self.prefetch)
+        self._buffer = memoryview(b"")
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b: Any) -> int:
+        while len(self._buffer) == 0:
+            block = next(self._blocks, None)
+            if block is None:
+                return 0
+            self._buffer = memoryview(block[1])
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+    def close(self) -> None:
+        if not self.closed:
+            # cancels the blocks that are still pending
+            self._blocks.close()
+            if self._own_executor:
+                self.executor.shutdown(wait=True)
+        super().close()
+
+
+def open_parallel(
+    path: PathLike,
+    mode: str = "rb",
+    processes: Optional[int] = None,
+    encoding: Optional[str] = None,
+    errors: Optional[str] = None,
+    newline: Optional[str] = None,
+    buffer_size: int = 1024 * 1024,
+) -> IO[Any]:
+    """opens a bz2 file like bz2.open, but decompresses with a process pool"""
+    if "w" in mode or "a" in mode or "x" in mode:
+        raise ValueError(f"invalid mode {mode}: parallel bz2 files are read only")
+    buffered = io.BufferedReader(
+        ParallelBZ2Reader(path, processes=processes), buffer_size=buffer_size
+    )
+    if "t" in mode:
+        return io.TextIOWrapper(
+            buffered, encoding=encoding, errors=errors, newline=newline
+        )
+    return buffered
@@ -0,0 +1,266 @@
+import io
+import bisect
+import struct
+import collections
+import concurrent.futures
+import zstandard
+from pathlib import Path
+from typing import Any, BinaryIO, Deque, Iterable, List, NamedTuple, Optional, Tuple, IO
+from lsde2021.types import PathLike
+
+# the zstd seekable format: independent zstd frames followed by a skippable
+# frame that holds the seek table, which is ignored by regular zstd readers.
+# https://github.com/facebook/zstd/blob/dev/contrib/seekable_format/zstd_seekable_compression_format.md
+SKIPPABLE_MAGIC = 0x184D2A5E
+SEEKABLE_MAGIC = 0x8F92EAB1
+# number of frames, descriptor and seekable magic
+FOOTER = struct.Struct("<IBI")
+ENTRY = struct.Struct("<II")
+CHECKSUM_FLAG = 0x80
+
+FRAME_SIZE = 4 * 1024 * 1024
+
+
+class Frame(NamedTuple):
+    # byte offset of the frame in the file and in the decompressed content
+    offset: int
+    decompressed_offset: int
+    size: int
+    decompressed_size: int
+
+
+def compress_frame(data: bytes, level: int = 3) -> bytes:
+    compressor = zstandard.ZstdCompressor(
+        level=level, write_checksum=True, write_content_size=True
+    )
+    return compressor.compress(data)
+
+
+def seek_table(frames: List[Frame]) -> bytes:
+    entries = b"".join(ENTRY.pack(f.size, f.decompressed_size) for f in frames)
+    footer = FOOTER.pack(len(frames), 0, SEEKABLE_MAGIC)
+    return (
+        struct.pack("<II", SKIPPABLE_MAGIC, len(entries) + len(footer))
+        + entries
+        + footer
+    )
+
+
+def write_seekable(
+    chunks: Iterable[bytes],
+    dest: BinaryIO,
+    frame_size: int = FRAME_SIZE,
+    level: int = 3,
+    threads: Optional[int] = None,
+) -> List[Frame]:
+    """
+    Compresses a stream of chunks into frames of frame_size decompressed
+    bytes, which are compressed in a thread pool (zstandard releases the
+    GIL), and writes them with their seek table to dest.
+    """
+    frames: List[Frame] = []
+    pending: Deque["concurrent.futures.Future[bytes]"] = collections.deque()
+    sizes: Deque[int] = collections.deque()
+    offset, decompressed_offset = 0, 0
+
+    def write_next() -> None:
+        nonlocal offset, decompressed_offset
+        data = pending.popleft().result()
+        size = sizes.popleft()
+        dest.write(data)
+        frames.append(Frame(offset, decompressed_offset, len(data), size))
+        offset += len(data)
+        decompressed_offset += size
+
+    prefetch = 2 * (threads or 4)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+
+        def submit(data: bytes) -> None:
+            pending.append(executor.submit(compress_frame, data, level))
+            sizes.append(len(data))
+            while len(pending) > prefetch:
+                write_next()
+
+        buffer = bytearray()
+        for chunk in chunks:
+            buffer += chunk
+            while len(buffer) >= frame_size:
+                submit(bytes(buffer[:frame_size]))
+                del buffer[:frame_size]
+        if buffer:
+            submit(bytes(buffer))
+        while pending:
+            write_next()
+    dest.write(seek_table(frames))
+    return frames
+
+
+def read_frames(path: PathLike) -> List[Frame]:
+    """reads the seek table of a seekable zstd file"""
+    with open(path, "rb") as f:
+        f.seek(0, io.SEEK_END)
+        file_size = f.tell()
+        if file_size < FOOTER.size:
+            raise OSError(f"{path} is not a seekable zstd file")
+        f.seek(file_size - FOOTER.size)
+        n_frames, descriptor, magic = FOOTER.unpack(f.read(FOOTER.size))
+        if magic != SEEKABLE_MAGIC:
+            raise OSError(f"{path} is not a seekable zstd file")
+        entry_size = ENTRY.size + (4 if descriptor & CHECKSUM_FLAG else 0)
+        table_size = 8 + n_frames * entry_size + FOOTER.size
+        f.seek(file_size - table_size)
+        table = f.read(table_size - FOOTER.size)
+    skippable_magic, frame_size = struct.unpack_from("<II", table)
+    if skippable_magic != SKIPPABLE_MAGIC or frame_size != table_size - 8:
+        raise OSError(f"{path} has a corrupt seek table")
+    frames = []
+    offset, decompressed_offset = 0, 0
+    for i in range(n_frames):
+        size, decompressed_size = ENTRY.unpack_from(table, 8 + i * entry_size)
+        frames.append(Frame(offset, decompressed_offset, size, decompressed_size))
+        offset += size
+        decompressed_offset += decompressed_size
+    if offset != file_size - table_size:
+        raise OSError(f"{path} has a corrupt seek table")
+    return frames
+
+
+def is_seekable(path: PathLike) -> bool:
+    try:
+        read_frames(path)
+        return True
+    except OSError:
+        return False
+
+
+def decompress_frame(path: PathLike, frame: Frame) -> bytes:
+    with open(path, "rb") as f:
+        f.seek(frame.offset)
+        data = f.read(frame.size)
+    return zstandard.ZstdDecompressor().decompress(
+        data, max_output_size=frame.decompressed_size
+    )
+
+
+class SeekableZstdReader(io.RawIOBase):
+    """
+    Raw, read-only and seekable stream over the decompressed content of a
+    seekable zstd file. The frames ahead of the position are decompressed
+    in a thread pool and seeking only decompresses the frame it lands in.
+    """
+
+    def __init__(
+        self,
+        path: PathLike,
+        threads: Optional[int] = None,
+        prefetch: Optional[int] = None,
+    ):
+        super().__init__()
+        self.path = Path(path)
+        self.frames = read_frames(self.path)
+        self.size = sum(f.decompressed_size for f in self.frames)
+        self._starts = [f.decompressed_offset for f in self.frames]
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=threads)
+        self.prefetch = prefetch or 2 * (threads or 4)
+        self._pending: Deque[Tuple[int, "concurrent.futures.Future[bytes]"]] = (
+            collections.deque()
+        )
+        self._next_frame = 0
+        self._buffer = memoryview(b"")
+        self._pos = 0
+
+    def read_frame(self, index: int) -> bytes:
+        """decompresses a single frame, e.g. to hand frames to workers"""
+        return decompress_frame(self.path, self.frames[index])
+
+    def _fill(self) -> None:
+        while len(self._pending) < self.prefetch and self._next_frame < len(
+            self.frames
+        ):
+            self._pending.append(
+                (
+                    self._next_frame,
+                    self.executor.submit(self.read_frame, self._next_frame),
+                )
+            )
+            self._next_frame += 1
+
+    def _reset(self, frame: int) -> None:
+        for _, future in self._pending:
+            future.cancel()
+        self._pending.clear()
+        self._next_frame = frame
+        self._buffer = memoryview(b"")
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError(f"negative seek position {offset}")
+        if self._pos <= offset < self._pos + len(self._buffer):
+            # within the frame that is already decompressed
+            self._buffer = self._buffer[offset - self._pos :]
+        elif offset >= self.size:
+            self._reset(len(self.frames))
+        else:
+            frame = bisect.bisect_right(self._starts, offset) - 1
+            self._reset(frame + 1)
+            skip = offset - self.frames[frame].decompressed_offset
+            self._buffer = memoryview(self.read_frame(frame))[skip:]
+        self._pos = offset
+        return offset
+
+    def readinto(self, b: Any) -> int:
+        while len(self._buffer) == 0:
+            self._fill()
+            if not self._pending:
+                return 0
+            _, future = self._pending.popleft()
+            self._buffer = memoryview(future.result())
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        self._pos += n
+        return n
+
+    def close(self) -> None:
+        if not self.closed:
+            self._reset(len(self.frames))
+            self.executor.shutdown(wait=True)
+        super().close()
+
+
+def open_seekable(
+    path: PathLike,
+    mode: str = "rb",
+    processes: Optional[int] = None,
+    encoding: Optional[str] = None,
+    errors: Optional[str] = None,
+    newline: Optional[str] = None,
+    buffer_size: int = 1024 * 1024,
+) -> IO[Any]:
+    """
+    opens a seekable zstd file like open, but decompresses the frames ahead
+    with processes threads
+    """
+    if "w" in mode or "a" in mode or "x" in mode:
+        raise ValueError(f"invalid mode {mode}: seekable zstd files are read only")
+    buffered = io.BufferedReader(
+        SeekableZstdReader(path, threads=processes), buffer_size=buffer_size
+    )
+    if "t" in mode:
+        return io.TextIOWrapper(
+            buffered, encoding=encoding, errors=errors, newline=newline
+        )
+    return buffered
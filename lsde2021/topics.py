@@ -1,7 +1,32 @@
 import re
+import json
+import time
+import hashlib
+import functools
+import concurrent.futures
+import numpy as np
+import pandas as pd
 import networkx as nx
-from typing import Set, List, Dict, Tuple, Pattern, Any, Optional
+import scipy.sparse as sparse
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from pathlib import Path
+from typing import (
+    Set,
+    List,
+    Dict,
+    Tuple,
+    Pattern,
+    Any,
+    Optional,
+    Iterator,
+    Union,
+    Callable,
+    Sequence,
+)
 from pprint import pprint
+from lsde2021.types import PathLike
 import lsde2021.lang as lang
 
 numeric = re.compile(r"^([\s\d]+)$")
@@ -53,6 +78,29 @@ patterns: List[Tuple[Pattern[str], List[str]]] = [
     (re.compile(r"^\d+_(\w+)$"), []),
 ]
 
+
+def combine_patterns(
+    patterns: List[Tuple[Pattern[str], List[str]]],
+) -> Tuple[Pattern[str], Dict[int, Tuple[int, int]]]:
+    """
+    Combines the patterns into a single alternation that is tried in order,
+    so the first pattern that matches wins. Returns the combined pattern and
+    a lookup from the group index of each alternative to its own groups.
+    """
+    alternatives = []
+    rule_groups = dict()
+    group = 0
+    for pattern, _ in patterns:
+        group += 1
+        alternatives.append(f"({pattern.pattern})")
+        rule_groups[group] = (group + 1, group + 1 + pattern.groups)
+        group += pattern.groups
+    return re.compile("|".join(alternatives)), rule_groups
+
+
+combined_pattern, rule_groups = combine_patterns(patterns)
+
+
 stopwords = ["a", "about", "above", "across", "after", "afterwards"]
 stopwords += ["again", "against", "all", "almost", "alone", "along"]
 stopwords += ["already", "also", "although", "always", "am", "among"]
@@ -125,20 +173,20 @@ def is_uppercase(s: str) -> bool:
 
 
 def split_by_pattern(s: str) -> Tuple[List[str], bool]:
-    for pattern, extra_words in patterns:
-        match = re.fullmatch(pattern, s)
-        if match:
-            return list(match.groups()), True
-    return [s], False
+    # every pattern contains an underscore
+    if "_" not in s:
+        return [s], False
+    match = combined_pattern.fullmatch(s)
+    if match is None:
+        return [s], False
+    start, end = rule_groups[match.lastindex or 0]
+    return [match.group(i) for i in range(start, end)], True
 
 
-def split(
-    s: str,
-    split_unmatched: bool = False,
-    singularize: bool = False,
-    pluralize: bool = False,
-    recursive: bool = False,
-) -> Set[str]:
+def split_words(
+    s: str, split_unmatched: bool = False, recursive: bool = False
+) -> List[str]:
+    """the words of split in the order they are found, with duplicates"""
     # first, test for common patterns
     splitted, matched = split_by_pattern(s)
 
@@ -155,9 +203,17 @@ def split(
         else:
             splitted = [s]
 
-    splitted_set = set(
-        [sp.replace("_", " ") for sp in splitted if numeric.match(sp) is None]
-    )
+    return [sp.replace("_", " ") for sp in splitted if numeric.match(sp) is None]
+
+
+def split(
+    s: str,
+    split_unmatched: bool = False,
+    singularize: bool = False,
+    pluralize: bool = False,
+    recursive: bool = False,
+) -> Set[str]:
+    splitted_set = set(split_words(s, split_unmatched, recursive))
 
     if singularize and pluralize:
         splitted_set = set([lang.singularize(sp) for sp in splitted_set]).union(
@@ -171,8 +227,228 @@ def split(
     return splitted_set
 
 
+class CategoryNodes:
+    """read only view of the node attributes of a CategoryGraph"""
+
+    def __init__(self, graph: "CategoryGraph"):
+        self.graph = graph
+
+    def __getitem__(self, node: int) -> Dict[str, Any]:
+        idx = self.graph.index(node)
+        return dict(
+            title=self.graph.title(idx), is_category=bool(self.graph.is_category[idx])
+        )
+
+    def __contains__(self, node: Any) -> bool:
+        try:
+            self.graph.index(node)
+            return True
+        except KeyError:
+            return False
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.graph.ids.tolist())
+
+    def __len__(self) -> int:
+        return len(self.graph.ids)
+
+
+class CategoryGraph:
+    """
+    Page to category graph in compressed sparse row form.
+
+    Nodes are the sorted page ids, the neighbors of the node at index i are
+    the node indices neighbors[offsets[i]:offsets[i + 1]] and titles are
+    interned as one utf-8 blob. All arrays are saved as .npy files, which
+    are memory mapped on load, so worker processes share a single copy.
+    Supports the parts of the nx.DiGraph interface used by freq_bfs_tree
+    and find_topics (g.neighbors(n) and g.nodes[n]["title"]).
+    """
+
+    ARRAYS = [
+        "ids",
+        "offsets",
+        "neighbor_idx",
+        "title_offsets",
+        "titles",
+        "is_category",
+    ]
+
+    def __init__(
+        self,
+        ids: np.ndarray,
+        offsets: np.ndarray,
+        neighbor_idx: np.ndarray,
+        title_offsets: np.ndarray,
+        titles: np.ndarray,
+        is_category: np.ndarray,
+        path: Optional[PathLike] = None,
+    ):
+        self.ids = ids
+        self.offsets = offsets
+        self.neighbor_idx = neighbor_idx
+        self.title_offsets = title_offsets
+        self.titles = titles
+        self.is_category = is_category
+        self.path = path
+        self.nodes = CategoryNodes(self)
+
+    @classmethod
+    def from_edges(
+        cls,
+        ids: np.ndarray,
+        titles: List[str],
+        is_category: np.ndarray,
+        src: np.ndarray,
+        dst: np.ndarray,
+    ) -> "CategoryGraph":
+        """builds the graph from node ids with their titles and an edge list of ids"""
+        ids = np.asarray(ids, dtype=np.int64)
+        order = np.argsort(ids, kind="stable")
+        sorted_ids = ids[order]
+        if len(sorted_ids) > 1 and np.any(sorted_ids[1:] == sorted_ids[:-1]):
+            raise ValueError("node ids must be unique")
+
+        src_idx = np.searchsorted(sorted_ids, np.asarray(src, dtype=np.int64))
+        dst_idx = np.searchsorted(sorted_ids, np.asarray(dst, dtype=np.int64))
+        for idx, edge_ids in [(src_idx, src), (dst_idx, dst)]:
+            found = sorted_ids[np.minimum(idx, max(len(sorted_ids) - 1, 0))]
+            if len(idx) > 0 and np.any(found != edge_ids):
+                raise KeyError("edges must only reference known node ids")
+
+        # drop duplicate edges like nx.DiGraph, keeping the first occurrence
+        edges = src_idx.astype(np.int64) * len(sorted_ids) + dst_idx
+        _, first = np.unique(edges, return_index=True)
+        first = np.sort(first)
+        src_idx, dst_idx = src_idx[first], dst_idx[first]
+
+        # stable, so that the neighbors keep the order in which edges were added
+        edge_order = np.argsort(src_idx, kind="stable")
+        neighbor_idx = dst_idx[edge_order].astype(np.int32)
+        offsets = np.zeros(len(sorted_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src_idx, minlength=len(sorted_ids)), out=offsets[1:])
+
+        encoded = [titles[i].encode("utf-8") for i in order]
+        title_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(t) for t in encoded], out=title_offsets[1:])
+        return cls(
+            ids=sorted_ids.astype(np.int32),
+            offsets=offsets,
+            neighbor_idx=neighbor_idx,
+            title_offsets=title_offsets,
+            titles=np.frombuffer(b"".join(encoded), dtype=np.uint8),
+            is_category=np.asarray(is_category, dtype=bool)[order],
+        )
+
+    @classmethod
+    def from_networkx(cls, g: nx.DiGraph) -> "CategoryGraph":
+        nodes = list(g.nodes(data=True))
+        edges = np.array(list(g.edges()), dtype=np.int64).reshape(-1, 2)
+        return cls.from_edges(
+            ids=np.array([n for n, _ in nodes], dtype=np.int64),
+            titles=[str(data.get("title", "")) for _, data in nodes],
+            is_category=np.array([bool(data.get("is_category")) for _, data in nodes]),
+            src=edges[:, 0],
+            dst=edges[:, 1],
+        )
+
+    @classmethod
+    def from_parquet(
+        cls, pages_path: PathLike, categorylinks_path: PathLike
+    ) -> "CategoryGraph":
+        """
+        Builds the graph from the page and categorylinks tables of a wiki,
+        linking every non redirect article or category page to its categories.
+        """
+        pages = pq.read_table(
+            pages_path,
+            columns=["page_id", "page_namespace", "page_title", "page_is_redirect"],
+        ).to_pandas()
+        pages = pages[
+            (pages["page_is_redirect"] == 0) & pages["page_namespace"].isin([0, 14])
+        ]
+        pages = pages.dropna(subset=["page_id"])
+        categorylinks = pq.read_table(
+            categorylinks_path, columns=["page_id", "category_name"]
+        ).to_pandas()
+
+        page_cats = pages.merge(categorylinks, on="page_id", how="inner")
+        category_pages = pages[pages["page_namespace"] == 14][
+            ["page_id", "page_title"]
+        ].rename(columns=dict(page_id="category_page_id", page_title="category_name"))
+        page_cats = page_cats.merge(category_pages, on="category_name", how="left")
+
+        node_ids = pd.unique(
+            pd.concat(
+                [page_cats["page_id"], page_cats["category_page_id"].dropna()]
+            ).astype(np.int64)
+        )
+        nodes = pages.set_index("page_id").loc[node_ids]
+        edges = page_cats.dropna(subset=["category_page_id"])
+        return cls.from_edges(
+            ids=node_ids,
+            titles=nodes["page_title"].astype(str).tolist(),
+            is_category=(nodes["page_namespace"] == 14).to_numpy(),
+            src=edges["page_id"].to_numpy(dtype=np.int64),
+            dst=edges["category_page_id"].to_numpy(dtype=np.int64),
+        )
+
+    def save(self, path: PathLike) -> None:
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        for name in self.ARRAYS:
+            np.save(path / f"{name}.npy", getattr(self, name))
+
+    @classmethod
+    def load(cls, path: PathLike, mmap: bool = True) -> "CategoryGraph":
+        arrays = {
+            name: np.load(Path(path) / f"{name}.npy", mmap_mode="r" if mmap else None)
+            for name in cls.ARRAYS
+        }
+        return cls(**arrays, path=path if mmap else None)
+
+    def __reduce__(self) -> Any:
+        if self.path is not None:
+            # memory mapped graphs are reopened instead of copied
+            return (CategoryGraph.load, (self.path,))
+        return (CategoryGraph, tuple(getattr(self, name) for name in self.ARRAYS))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def number_of_edges(self) -> int:
+        return len(self.neighbor_idx)
+
+    def index(self, node: int) -> int:
+        idx = int(np.searchsorted(self.ids, node))
+        if idx >= len(self.ids) or self.ids[idx] != node:
+            raise KeyError(node)
+        return idx
+
+    def indices(self, nodes: List[int]) -> np.ndarray:
+        nodes_arr = np.asarray(nodes, dtype=np.int64)
+        idx = np.searchsorted(self.ids, nodes_arr)
+        found = np.minimum(idx, max(len(self.ids) - 1, 0))
+        missing = (idx >= len(self.ids)) | (self.ids[found] != nodes_arr)
+        if np.any(missing):
+            raise KeyError(nodes_arr[missing][0])
+        return idx
+
+    def title(self, idx: int) -> str:
+        start, end = self.title_offsets[idx], self.title_offsets[idx + 1]
+        return bytes(self.titles[start:end]).decode("utf-8")
+
+    def neighbors(self, node: int) -> List[int]:
+        idx = self.index(node)
+        start, end = self.offsets[idx], self.offsets[idx + 1]
+        return self.ids[self.neighbor_idx[start:end]].tolist()  # type: ignore
+
+
+Graph = Union[nx.DiGraph, CategoryGraph]
+
+
 def freq_bfs_tree(
-    g: nx.DiGraph, node: int, depth_limit: Optional[int] = None
+    g: Graph, node: int, depth_limit: Optional[int] = None
 ) -> Dict[int, List[Tuple[int, int]]]:
     ans = []
     counts = dict()
@@ -198,18 +474,291 @@ def freq_bfs_tree(
             levels[depth] = []
         levels[depth].append((n, counts[n]))
 
+    # nodes with equal counts are ordered by id, like freq_bfs_trees
     levels = {
-        depth: sorted(nodes, key=lambda x: x[1], reverse=True)
+        depth: sorted(nodes, key=lambda x: (-x[1], x[0]))
         for depth, nodes in levels.items()
     }
     return levels
     # return [(n, depth, counts[n]) for n, depth in ans]
 
 
+def _expand(
+    offsets: np.ndarray, neighbor_idx: np.ndarray, nodes: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns for every edge leaving nodes the position of its source in nodes
+    and the index of its target.
+    """
+    starts = offsets[nodes]
+    degrees = offsets[nodes + 1] - starts
+    pos = np.repeat(np.arange(len(nodes)), degrees)
+    first_edge = np.cumsum(degrees) - degrees
+    edges = np.arange(len(pos)) - first_edge[pos] + starts[pos]
+    return pos, neighbor_idx[edges]
+
+
+def _freq_bfs_batch(
+    g: CategoryGraph, nodes: List[int], depth_limit: Optional[int] = None
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    n = len(g)
+    # every (source, node index) pair is packed into one key, source major
+    # so that lookups for the same source hit nearby keys
+    frontier = np.arange(len(nodes), dtype=np.int64) * n + g.indices(nodes)
+    visited = np.sort(frontier)
+    reached, reached_depth = [frontier], [np.zeros(len(frontier), dtype=np.int64)]
+    depth = 0
+    while depth_limit is None or depth < depth_limit:
+        pos, targets = _expand(g.offsets, g.neighbor_idx, frontier % n)
+        keys = _unique_sorted(frontier[pos] // n * n + targets)
+        keys = keys[~_contains(visited, keys)]
+        if len(keys) == 0:
+            break
+        depth += 1
+        visited = np.sort(np.concatenate([visited, keys]))
+        reached.append(keys)
+        reached_depth.append(np.full(len(keys), depth, dtype=np.int64))
+        frontier = keys
+
+    keys, depths = np.concatenate(reached), np.concatenate(reached_depth)
+    order = np.argsort(keys)
+    keys, depths = keys[order], depths[order]
+    sources, node_idx = keys // n, keys % n
+
+    # a node is counted once plus once for every neighbor that was already
+    # visited when its level was expanded, i.e. that is at most as deep
+    pos, targets = _expand(g.offsets, g.neighbor_idx, node_idx)
+    target_keys = sources[pos] * n + targets
+    found = np.minimum(np.searchsorted(keys, target_keys), len(keys) - 1)
+    earlier = (keys[found] == target_keys) & (depths[found] <= depths[pos])
+    counts = 1 + np.bincount(pos[earlier], minlength=len(keys))
+
+    # rank by source, depth, descending count and node (index order is id
+    # order), in a single sort if the combined key fits into an int64
+    max_count = int(counts.max())
+    if len(nodes) * (depth + 1) * (max_count + 1) * n < 2**62:
+        rank = (sources * (depth + 1) + depths) * (max_count + 1) + max_count - counts
+        order = np.argsort(rank * n + node_idx)
+    else:
+        order = np.lexsort((node_idx, -counts, depths, sources))
+    ids = g.ids[node_idx[order]].astype(np.int64)
+    return sources[order], depths[order], ids, counts[order]
+
+
+def freq_bfs_arrays(
+    g: CategoryGraph,
+    nodes: List[int],
+    depth_limit: Optional[int] = None,
+    batch_size: int = 10_000,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Walks the graph from many start nodes at once, using arrays of
+    (node, start node) pairs as frontiers. Returns flat (source, depth,
+    node, count) arrays, where source is the position of the start node in
+    nodes, ordered by source, depth and rank within the depth.
+    """
+    batches = []
+    for start in range(0, len(nodes), batch_size):
+        sources, depths, ids, counts = _freq_bfs_batch(
+            g, nodes[start : start + batch_size], depth_limit=depth_limit
+        )
+        batches.append((sources + start, depths, ids, counts))
+    if not batches:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty, empty
+    sources, depths, ids, counts = (np.concatenate(a) for a in zip(*batches))
+    return sources, depths, ids, counts
+
+
+def _unique_sorted(keys: np.ndarray) -> np.ndarray:
+    keys = np.sort(keys)
+    return keys[np.r_[True, keys[1:] != keys[:-1]]] if len(keys) > 0 else keys
+
+
+def _contains(sorted_keys: np.ndarray, keys: np.ndarray) -> np.ndarray:
+    if len(sorted_keys) == 0:
+        return np.zeros(len(keys), dtype=bool)
+    found = np.minimum(np.searchsorted(sorted_keys, keys), len(sorted_keys) - 1)
+    return sorted_keys[found] == keys  # type: ignore
+
+
+def freq_bfs_trees(
+    g: Graph,
+    nodes: List[int],
+    depth_limit: Optional[int] = None,
+    batch_size: int = 10_000,
+) -> List[Dict[int, List[Tuple[int, int]]]]:
+    """
+    Batched freq_bfs_tree for many start nodes, see freq_bfs_arrays.
+    Returns the same per depth rankings, where nodes with equal counts
+    are ordered by id.
+    """
+    if not isinstance(g, CategoryGraph):
+        g = CategoryGraph.from_networkx(g)
+    if len(nodes) == 0:
+        return []
+    sources, depths, ids, counts = freq_bfs_arrays(
+        g, nodes, depth_limit=depth_limit, batch_size=batch_size
+    )
+    bounds = np.flatnonzero(
+        np.r_[True, (sources[1:] != sources[:-1]) | (depths[1:] != depths[:-1]), True]
+    )
+    ranked = list(zip(ids.tolist(), counts.tolist()))
+    results: List[Dict[int, List[Tuple[int, int]]]] = [dict() for _ in nodes]
+    for source, depth, start, end in zip(
+        sources[bounds[:-1]].tolist(),
+        depths[bounds[:-1]].tolist(),
+        bounds[:-1].tolist(),
+        bounds[1:].tolist(),
+    ):
+        results[source][depth] = ranked[start:end]
+    return results
+
+
+def _capitalized_topic_words(words: List[str]) -> List[str]:
+    # the same set operations as split, so the words come out in the order
+    # of the set in this process
+    return [w.capitalize() for w in set(words) - EXCLUDE]
+
+
+def topic_words(title: str) -> List[str]:
+    return _capitalized_topic_words(split_words(title, recursive=True))
+
+
+@functools.lru_cache(maxsize=1 << 20)
+def cached_topic_words(title: str) -> Tuple[str, ...]:
+    return tuple(topic_words(title))
+
+
+def _topic_words_chunk(titles: List[str]) -> List[List[str]]:
+    # the ordered words before deduplication, as sets iterate in an order
+    # that depends on the hash seed of the worker process
+    return [split_words(title, recursive=True) for title in titles]
+
+
+class TopicWords:
+    """
+    Precomputed topic words of category nodes, stored like CategoryGraph as
+    sorted node ids with CSR offsets into word ids of an interned vocabulary.
+    """
+
+    ARRAYS = ["ids", "offsets", "word_idx", "vocab_offsets", "vocab"]
+
+    def __init__(
+        self,
+        ids: np.ndarray,
+        offsets: np.ndarray,
+        word_idx: np.ndarray,
+        vocab_offsets: np.ndarray,
+        vocab: np.ndarray,
+    ):
+        self.ids = ids
+        self.offsets = offsets
+        self.word_idx = word_idx
+        self.vocab_offsets = vocab_offsets
+        self.vocab = vocab
+        blob = bytes(vocab)
+        self.words = [
+            blob[start:end].decode("utf-8")
+            for start, end in zip(vocab_offsets[:-1], vocab_offsets[1:])
+        ]
+        self._first_letters: Optional[np.ndarray] = None
+
+    @classmethod
+    def from_words(cls, nodes: List[int], words: List[List[str]]) -> "TopicWords":
+        order = np.argsort(np.asarray(nodes, dtype=np.int64), kind="stable")
+        vocab: Dict[str, int] = dict()
+        word_idx = []
+        offsets = np.zeros(len(nodes) + 1, dtype=np.int64)
+        for i, node in enumerate(order):
+            word_idx += [vocab.setdefault(w, len(vocab)) for w in words[node]]
+            offsets[i + 1] = len(word_idx)
+        encoded = [w.encode("utf-8") for w in vocab]
+        vocab_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(w) for w in encoded], out=vocab_offsets[1:])
+        return cls(
+            ids=np.asarray(nodes, dtype=np.int64)[order],
+            offsets=offsets,
+            word_idx=np.array(word_idx, dtype=np.int32),
+            vocab_offsets=vocab_offsets,
+            vocab=np.frombuffer(b"".join(encoded), dtype=np.uint8),
+        )
+
+    @classmethod
+    def build(
+        cls, g: Graph, processes: Optional[int] = None, chunk_size: int = 10_000
+    ) -> "TopicWords":
+        """splits the titles of all category nodes of g in a process pool"""
+        if isinstance(g, CategoryGraph):
+            category_idx = np.flatnonzero(g.is_category)
+            nodes = g.ids[category_idx].tolist()
+            titles = [g.title(int(idx)) for idx in category_idx]
+        else:
+            categories = [
+                (n, data["title"])
+                for n, data in g.nodes(data=True)
+                if data.get("is_category")
+            ]
+            nodes = [n for n, _ in categories]
+            titles = [title for _, title in categories]
+
+        chunks = [
+            titles[start : start + chunk_size]
+            for start in range(0, len(titles), chunk_size)
+        ]
+        if processes == 1:
+            words = flatten([_topic_words_chunk(chunk) for chunk in chunks])
+        else:
+            with concurrent.futures.ProcessPoolExecutor(
+                max_workers=processes
+            ) as executor:
+                words = flatten(list(executor.map(_topic_words_chunk, chunks)))
+        return cls.from_words(nodes, [_capitalized_topic_words(w) for w in words])
+
+    def save(self, path: PathLike) -> None:
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        for name in self.ARRAYS:
+            np.save(path / f"topic_words_{name}.npy", getattr(self, name))
+
+    @classmethod
+    def load(cls, path: PathLike, mmap: bool = True) -> "TopicWords":
+        arrays = {
+            name: np.load(
+                Path(path) / f"topic_words_{name}.npy", mmap_mode="r" if mmap else None
+            )
+            for name in cls.ARRAYS
+        }
+        return cls(**arrays)
+
+    def first_letters(self) -> np.ndarray:
+        """code points of the first letters of the vocabulary words"""
+        if self._first_letters is None:
+            self._first_letters = np.array(
+                [ord(w[0]) for w in self.words], dtype=np.int64
+            )
+        return self._first_letters
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def get(self, node: int) -> Optional[List[str]]:
+        idx = int(np.searchsorted(self.ids, node))
+        if idx >= len(self.ids) or self.ids[idx] != node:
+            return None
+        start, end = self.offsets[idx], self.offsets[idx + 1]
+        return [self.words[w] for w in self.word_idx[start:end].tolist()]
+
+
 def find_topics(
-    node: int, g: nx.DiGraph, depth_limit: int = 4, max_categories: int = 5
-) -> Dict[int, List[int]]:
+    node: int,
+    g: Graph,
+    depth_limit: int = 4,
+    max_categories: int = 5,
+    words: Optional[TopicWords] = None,
+) -> Dict[int, List[str]]:
     categories = freq_bfs_tree(g, node, depth_limit=depth_limit)
+
     if False:
         pprint(
             {
@@ -219,16 +768,653 @@ def find_topics(
             }
         )
 
+    return tree_topics(categories, g, max_categories=max_categories, words=words)
+
+
+def tree_topics(
+    categories: Dict[int, List[Tuple[int, int]]],
+    g: Graph,
+    max_categories: int = 5,
+    words: Optional[TopicWords] = None,
+) -> Dict[int, List[str]]:
+    """picks the topics per depth of a tree from freq_bfs_tree(s)"""
+    node_words = _node_words_func(g, words)
     return {
-        depth: unique(
-            flatten(
-                [
-                    [w.capitalize() for w in split(g.nodes[n]["title"], recursive=True)]
-                    for n, count in nodes
-                ]
-            ),
-            key=lambda x: x[0],
-        )[:max_categories]
+        depth: _pick_topics([n for n, _ in nodes], node_words, max_categories)
         for depth, nodes in categories.items()
         if depth > 0
     }
+
+
+def _node_words_func(
+    g: Graph, words: Optional[TopicWords] = None
+) -> Callable[[int], Sequence[str]]:
+    def node_words(n: int) -> Sequence[str]:
+        # precomputed words, falling back to the cached split of the title
+        found = words.get(n) if words is not None else None
+        if found is None:
+            return cached_topic_words(g.nodes[n]["title"])
+        return found
+
+    return node_words
+
+
+def _pick_topics(
+    nodes: List[int], node_words: Callable[[int], Sequence[str]], max_categories: int
+) -> List[str]:
+    """
+    the words of the ranked nodes with a unique first letter, up to
+    max_categories, only the words of the first nodes are looked up
+    """
+    picked: List[str] = []
+    letters: Set[str] = set()
+    for n in nodes:
+        for word in node_words(n):
+            if len(picked) >= max_categories:
+                return picked
+            if word[0] not in letters:
+                letters.add(word[0])
+                picked.append(word)
+    return picked
+
+
+TOPIC_LEVELS = 4
+
+TOPICS_SCHEMA = pa.schema(
+    [pa.field("page_id", pa.int32(), nullable=False)]
+    + [
+        pa.field(f"topics{level}", pa.list_(pa.string()), nullable=False)
+        for level in range(1, TOPIC_LEVELS + 1)
+    ]
+)
+
+
+def page_topics_table(
+    g: CategoryGraph,
+    page_ids: np.ndarray,
+    depth_limit: int = TOPIC_LEVELS,
+    max_categories: int = 5,
+    words: Optional[TopicWords] = None,
+    batch_size: int = 10_000,
+) -> pa.Table:
+    """
+    Finds the topics of pages that are in g as a table with TOPICS_SCHEMA,
+    pages that are not in g are skipped. The topics are the same as those
+    of find_topics, but picked with array operations straight from the
+    freq_bfs_arrays rankings of batches of pages.
+    """
+    page_ids = np.asarray(page_ids, dtype=np.int64)
+    pos = np.minimum(np.searchsorted(g.ids, page_ids), len(g.ids) - 1)
+    page_ids = page_ids[g.ids[pos] == page_ids]
+    tables = [
+        _page_topics_batch(
+            g, page_ids[start : start + batch_size], depth_limit, max_categories, words
+        )
+        for start in range(0, len(page_ids), batch_size)
+    ]
+    if not tables:
+        return TOPICS_SCHEMA.empty_table()
+    return pa.concat_tables(tables)
+
+
+def _page_topics_batch(
+    g: CategoryGraph,
+    page_ids: np.ndarray,
+    depth_limit: int,
+    max_categories: int,
+    words: Optional[TopicWords],
+) -> pa.Table:
+    sources, depths, ids, _ = freq_bfs_arrays(
+        g, page_ids.tolist(), depth_limit=depth_limit
+    )
+    keep = (depths > 0) & (depths <= TOPIC_LEVELS)
+    sources, depths, ids = sources[keep], depths[keep], ids[keep]
+    # every (source, depth) is a contiguous run of nodes in ranking order
+    new_group = np.r_[True, (sources[1:] != sources[:-1]) | (depths[1:] != depths[:-1])]
+    entry_group = np.cumsum(new_group) - 1
+    group_sources, group_depths = sources[new_group], depths[new_group]
+
+    entry, word_ids, letters, lookup = _ranked_topic_words(g, words, ids)
+    # like _pick_topics: the first word of every first letter per group,
+    # then the first max_categories of those in ranking order
+    word_group = entry_group[entry]
+    key = word_group.astype(np.int64) * 0x110000 + letters
+    _, first = np.unique(key, return_index=True)
+    first.sort()
+    first_group = word_group[first]
+    rank = np.arange(len(first)) - np.searchsorted(first_group, first_group)
+    first, first_group = (
+        first[rank < max_categories],
+        first_group[rank < max_categories],
+    )
+
+    picked = [lookup(w) for w in word_ids[first].tolist()]
+    picked_sources = group_sources[first_group]
+    picked_depths = group_depths[first_group]
+    columns: Dict[str, Any] = dict(page_id=page_ids.astype(np.int32))
+    for level in range(1, TOPIC_LEVELS + 1):
+        at_level = np.flatnonzero(picked_depths == level)
+        offsets = np.zeros(len(page_ids) + 1, dtype=np.int32)
+        np.cumsum(
+            np.bincount(picked_sources[at_level], minlength=len(page_ids)),
+            out=offsets[1:],
+        )
+        columns[f"topics{level}"] = pa.ListArray.from_arrays(
+            pa.array(offsets),
+            pa.array([picked[i] for i in at_level.tolist()], type=pa.string()),
+        )
+    return pa.table(columns, schema=TOPICS_SCHEMA)
+
+
+def _ranked_topic_words(
+    g: Graph, words: Optional[TopicWords], ids: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, Callable[[int], str]]:
+    """
+    The topic words of the ranked nodes ids flattened in order: the index
+    into ids, word id and first letter of every word, and a lookup from
+    word id to word. Nodes without precomputed words fall back to the
+    cached split of their title.
+    """
+    if words is None:
+        words = TopicWords.from_words([], [])
+    if len(words.ids) > 0:
+        pos = np.minimum(np.searchsorted(words.ids, ids), len(words.ids) - 1)
+        found = words.ids[pos] == ids
+    else:
+        pos = np.zeros(len(ids), dtype=np.int64)
+        found = np.zeros(len(ids), dtype=bool)
+    missing = np.unique(ids[~found]).tolist()
+    extra = TopicWords.from_words(
+        missing, [list(cached_topic_words(g.nodes[n]["title"])) for n in missing]
+    )
+    extra_pos = np.searchsorted(extra.ids, ids[~found])
+
+    starts = np.empty(len(ids), dtype=np.int64)
+    ends = np.empty(len(ids), dtype=np.int64)
+    starts[found] = words.offsets[pos[found]]
+    ends[found] = words.offsets[pos[found] + 1]
+    starts[~found] = extra.offsets[extra_pos]
+    ends[~found] = extra.offsets[extra_pos + 1]
+    lengths = ends - starts
+    entry = np.repeat(np.arange(len(ids)), lengths)
+    offsets = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+    word_pos = offsets + np.arange(len(entry))
+
+    in_extra = ~found[entry]
+    vocab_size = len(words.words)
+    word_ids = np.empty(len(entry), dtype=np.int64)
+    word_ids[~in_extra] = words.word_idx[word_pos[~in_extra]]
+    word_ids[in_extra] = extra.word_idx[word_pos[in_extra]] + vocab_size
+    letters = np.empty(len(entry), dtype=np.int64)
+    letters[~in_extra] = words.first_letters()[word_ids[~in_extra]]
+    letters[in_extra] = extra.first_letters()[word_ids[in_extra] - vocab_size]
+
+    def lookup(w: int) -> str:
+        return words.words[w] if w < vocab_size else extra.words[w - vocab_size]
+
+    return entry, word_ids, letters, lookup
+
+
+TOPIC_IDS_SCHEMA = pa.schema(
+    [pa.field("page_id", pa.int32(), nullable=False)]
+    + [
+        pa.field(f"topics{level}", pa.list_(pa.int32()), nullable=False)
+        for level in range(1, TOPIC_LEVELS + 1)
+    ]
+)
+
+TOPIC_DICTIONARY_SCHEMA = pa.schema(
+    [
+        pa.field("id", pa.int32(), nullable=False),
+        pa.field("level", pa.int8(), nullable=False),
+        pa.field("label", pa.string(), nullable=False),
+    ]
+)
+
+
+def _flat_lists(column: pa.ChunkedArray) -> Tuple[np.ndarray, pa.Array]:
+    """offsets (starting at 0) and flat values of a list column"""
+    lists = column.combine_chunks()
+    offsets = lists.offsets.to_numpy()
+    return (offsets - offsets[0]).astype(np.int32), lists.flatten()
+
+
+class TopicDictionary:
+    """
+    Int32 ids of the topic labels of each level, which the topic tables
+    store instead of the labels, so that labels are only looked up for
+    display. The ids of a new dictionary are ordered by level and label,
+    labels that are added later get new ids after the existing ones, so
+    tables that were encoded before stay valid.
+    """
+
+    def __init__(self, levels: List[List[str]]):
+        levels = [sorted(labels) for labels in levels]
+        self._assign(
+            np.repeat(np.arange(1, len(levels) + 1), [len(ls) for ls in levels]),
+            flatten(levels),
+        )
+
+    def _assign(self, id_levels: np.ndarray, id_labels: List[str]) -> None:
+        self.id_levels = np.asarray(id_levels, dtype=np.int32)
+        # labels and ids of each level, in id order
+        self.levels = [
+            [label for label, lv in zip(id_labels, self.id_levels) if lv == level]
+            for level in range(1, TOPIC_LEVELS + 1)
+        ]
+        self.level_ids = [
+            np.flatnonzero(self.id_levels == level).astype(np.int32)
+            for level in range(1, TOPIC_LEVELS + 1)
+        ]
+        self._id_labels = list(id_labels)
+        self._labels: Optional[pa.Array] = None
+
+    @classmethod
+    def from_tables(cls, tables: Iterator[pa.Table]) -> "TopicDictionary":
+        """collects the labels of tables with TOPICS_SCHEMA"""
+        levels: List[Set[str]] = [set() for _ in range(TOPIC_LEVELS)]
+        for table in tables:
+            for level, labels in enumerate(levels, 1):
+                flat = pc.list_flatten(table.column(f"topics{level}"))
+                labels.update(pc.unique(flat).drop_null().to_pylist())
+        return cls([list(labels) for labels in levels])
+
+    def extend(self, tables: Iterator[pa.Table]) -> int:
+        """
+        Appends the labels of tables with TOPICS_SCHEMA that are not in the
+        dictionary, returns the number of new ids.
+        """
+        found = TopicDictionary.from_tables(tables)
+        id_levels, id_labels = [self.id_levels], list(self._id_labels)
+        for level, labels in enumerate(found.levels, 1):
+            known = set(self.levels[level - 1])
+            added = [label for label in labels if label not in known]
+            id_levels.append(np.full(len(added), level, dtype=np.int32))
+            id_labels += added
+        count = len(id_labels) - len(self)
+        if count > 0:
+            self._assign(np.concatenate(id_levels), id_labels)
+        return count
+
+    def __len__(self) -> int:
+        return len(self.id_levels)
+
+    def level_index(self, level: int) -> np.ndarray:
+        """maps the ids of a level to their index in levels, -1 for other ids"""
+        index = np.full(len(self), -1, dtype=np.int64)
+        index[self.level_ids[level - 1]] = np.arange(len(self.level_ids[level - 1]))
+        return index
+
+    @property
+    def labels(self) -> pa.Array:
+        """labels of all ids, indexed by id"""
+        if self._labels is None:
+            self._labels = pa.array(self._id_labels, pa.string())
+        return self._labels
+
+    def label(self, ids: Union[int, List[int], np.ndarray]) -> Any:
+        """maps an id (or array of ids) back to its label(s)"""
+        if isinstance(ids, (int, np.integer)):
+            return self.labels[int(ids)].as_py()
+        return self.labels.take(pa.array(np.asarray(ids, np.int32))).to_pylist()
+
+    def encode(self, table: pa.Table) -> pa.Table:
+        """encodes a table with TOPICS_SCHEMA as a table with TOPIC_IDS_SCHEMA"""
+        columns: Dict[str, Any] = dict(page_id=table.column("page_id"))
+        for level in range(1, TOPIC_LEVELS + 1):
+            offsets, flat = _flat_lists(table.column(f"topics{level}"))
+            idx = pc.index_in(flat, value_set=pa.array(self.levels[level - 1]))
+            if idx.null_count > 0:
+                raise KeyError(f"topics of level {level} are not in the dictionary")
+            ids = pa.array(self.level_ids[level - 1]).take(idx)
+            columns[f"topics{level}"] = pa.ListArray.from_arrays(pa.array(offsets), ids)
+        return pa.table(columns, schema=TOPIC_IDS_SCHEMA)
+
+    def decode(self, table: pa.Table) -> pa.Table:
+        """maps the ids of a table with TOPIC_IDS_SCHEMA back to labels"""
+        columns: Dict[str, Any] = dict(page_id=table.column("page_id"))
+        for level in range(1, TOPIC_LEVELS + 1):
+            offsets, flat = _flat_lists(table.column(f"topics{level}"))
+            columns[f"topics{level}"] = pa.ListArray.from_arrays(
+                pa.array(offsets), self.labels.take(flat)
+            )
+        return pa.table(columns, schema=TOPICS_SCHEMA)
+
+    def to_table(self) -> pa.Table:
+        return pa.table(
+            dict(
+                id=np.arange(len(self), dtype=np.int32),
+                level=self.id_levels,
+                label=self.labels,
+            ),
+            schema=TOPIC_DICTIONARY_SCHEMA,
+        )
+
+    @classmethod
+    def from_table(cls, table: pa.Table) -> "TopicDictionary":
+        df = table.to_pandas().sort_values("id")
+        if not (df["id"].to_numpy() == np.arange(len(df))).all():
+            raise ValueError("topic ids are not contiguous")
+        if df.duplicated(["level", "label"]).any():
+            raise ValueError("topic labels are not unique per level")
+        dictionary = cls([])
+        dictionary._assign(df["level"].to_numpy(), df["label"].tolist())
+        return dictionary
+
+    def save(self, path: PathLike) -> None:
+        pq.write_table(self.to_table(), path)
+
+    @classmethod
+    def load(cls, path: PathLike) -> "TopicDictionary":
+        return cls.from_table(pq.read_table(path))
+
+
+def topic_dictionary_file(dest: PathLike) -> Path:
+    # starts with an underscore, so readers of the dataset skip it
+    return Path(dest) / "_topic_dictionary.parquet"
+
+
+def encode_topic_parts(dest: PathLike) -> TopicDictionary:
+    """
+    Builds the dictionary of the labels of all parts in dest and rewrites
+    the parts with TOPIC_IDS_SCHEMA. Parts that are already encoded are
+    skipped, so this resumes like map_topics. Parts that are recomputed
+    after the dictionary was written are encoded with it, labels that it
+    does not have yet are appended with new ids.
+    """
+    out = Path(dest)
+    path = topic_dictionary_file(out)
+    parts = sorted(out.glob("part-*.parquet"))
+    todo = [p for p in parts if pq.read_schema(p) != TOPIC_IDS_SCHEMA]
+    if path.exists():
+        dictionary = TopicDictionary.load(path)
+        added = dictionary.extend(pq.read_table(p) for p in todo)
+    else:
+        if len(todo) < len(parts):
+            raise ValueError(f"{out} has encoded parts, but no topic dictionary")
+        dictionary = TopicDictionary.from_tables(pq.read_table(p) for p in todo)
+        added = len(dictionary)
+    if added > 0 or not path.exists():
+        # written before the parts that use the new ids
+        tmp = path.with_name(f".{path.name}.tmp")
+        dictionary.save(tmp)
+        tmp.replace(path)
+    for part in todo:
+        tmp = part.with_name(f".{part.name}.tmp")
+        pq.write_table(dictionary.encode(pq.read_table(part)), tmp)
+        tmp.replace(part)
+    print(f"encoded {len(todo)} parts of {out} with {len(dictionary)} topic ids")
+    return dictionary
+
+
+def read_topics(path: PathLike, decode: bool = False) -> pa.Table:
+    """
+    Reads the encoded output of map_topics, with decode the ids are mapped
+    back to their labels, which should only be needed for display.
+    """
+    table = pq.read_table(path, schema=TOPIC_IDS_SCHEMA)
+    if decode:
+        return TopicDictionary.load(topic_dictionary_file(path)).decode(table)
+    return table
+
+
+def topic_part_file(dest: PathLike, unit: int) -> Path:
+    return Path(dest) / f"part-{unit:06d}.parquet"
+
+
+# state of the map_topics worker processes
+_topic_worker: Dict[str, Any] = dict()
+
+
+def _init_topic_worker(graph_path: str, depth_limit: int, max_categories: int) -> None:
+    words = None
+    if (Path(graph_path) / "topic_words_ids.npy").exists():
+        words = TopicWords.load(graph_path)
+    _topic_worker.update(
+        g=CategoryGraph.load(graph_path),
+        words=words,
+        depth_limit=depth_limit,
+        max_categories=max_categories,
+    )
+
+
+def _map_topic_unit(unit: int, page_ids: np.ndarray, dest: str) -> Tuple[int, int]:
+    table = page_topics_table(
+        _topic_worker["g"],
+        page_ids,
+        depth_limit=_topic_worker["depth_limit"],
+        max_categories=_topic_worker["max_categories"],
+        words=_topic_worker["words"],
+    )
+    part = topic_part_file(dest, unit)
+    # hidden while writing, so partial files are never read
+    tmp = part.with_name(f".{part.name}.tmp")
+    pq.write_table(table, tmp)
+    tmp.replace(part)
+    return unit, table.num_rows
+
+
+def map_topics(
+    page_ids: Union[List[int], np.ndarray],
+    graph_path: PathLike,
+    dest: PathLike,
+    unit_size: int = 10_000,
+    processes: Optional[int] = None,
+    depth_limit: int = TOPIC_LEVELS,
+    max_categories: int = 5,
+) -> Path:
+    """
+    Maps pages to their topics with the CategoryGraph (and TopicWords) saved
+    in graph_path. The pages are split into units of unit_size that are
+    handed out to a process pool, each unit is written to its own parquet
+    part with TOPICS_SCHEMA in dest. Units whose part exists are skipped,
+    so an interrupted job resumes when it is started again. When all units
+    are done, the parts are rewritten with int32 topic ids (TOPIC_IDS_SCHEMA)
+    and the labels are stored in a TopicDictionary next to them.
+    """
+    page_ids = np.asarray(page_ids, dtype=np.int32)
+    out = Path(dest)
+    out.mkdir(parents=True, exist_ok=True)
+    job = dict(
+        pages=len(page_ids),
+        sha1=hashlib.sha1(page_ids.tobytes()).hexdigest(),
+        unit_size=unit_size,
+        depth_limit=depth_limit,
+        max_categories=max_categories,
+    )
+    manifest = out / "_job.json"
+    if manifest.exists():
+        with open(manifest, "r") as f:
+            started = json.load(f)
+        if started != job:
+            raise ValueError(f"{out} belongs to a different job: {started}")
+    else:
+        tmp = out / "_job.json.tmp"
+        with open(tmp, "w") as f:
+            json.dump(job, f, indent=2, sort_keys=True)
+        tmp.replace(manifest)
+    for tmp in out.glob(".part-*.tmp"):
+        tmp.unlink()
+
+    n_units = -(-len(page_ids) // unit_size)
+    todo = [unit for unit in range(n_units) if not topic_part_file(out, unit).exists()]
+    print(f"{n_units - len(todo)} of {n_units} units of {out} are done")
+    start = time.time()
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=processes,
+        initializer=_init_topic_worker,
+        initargs=(str(graph_path), depth_limit, max_categories),
+    ) as executor:
+        futures = [
+            executor.submit(
+                _map_topic_unit,
+                unit,
+                page_ids[unit * unit_size : (unit + 1) * unit_size],
+                str(out),
+            )
+            for unit in todo
+        ]
+        for done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+            future.result()
+            if done % 100 == 0 or done == len(futures):
+                rate = done * unit_size / (time.time() - start)
+                print(f"mapped {done} of {len(futures)} units ({rate:.0f} pages/s)")
+    encode_topic_parts(out)
+    (out / "_SUCCESS").touch()
+    return out
+
+
+def topic_vocabulary(table: pa.Table) -> List[str]:
+    """sorted distinct topics of all levels of a table with TOPICS_SCHEMA"""
+    topics = [
+        pc.list_flatten(table.column(f"topics{level}"))
+        for level in range(1, TOPIC_LEVELS + 1)
+    ]
+    flat = pa.chunked_array([c for chunked in topics for c in chunked.chunks])
+    return sorted(pc.unique(flat).drop_null().to_pylist())
+
+
+class TopicIncidence:
+    """
+    Page x topic incidence of one topic level as a CSR matrix, whose rows
+    are the sorted page ids of the topic table and whose columns are the
+    topics of a vocabulary, so that the views per topic of a day are the
+    product of the transposed matrix with the views per page.
+    """
+
+    def __init__(
+        self, page_ids: np.ndarray, vocabulary: List[str], matrix: sparse.csr_matrix
+    ):
+        self.page_ids = page_ids
+        self.vocabulary = vocabulary
+        self.matrix = matrix
+
+    @classmethod
+    def from_table(
+        cls, table: pa.Table, level: int, vocabulary: Optional[List[str]] = None
+    ) -> "TopicIncidence":
+        """
+        Encodes the topics{level} column of a table with TOPICS_SCHEMA,
+        e.g. read from the output of map_topics. A page that lists a topic
+        twice counts twice, like exploding the column.
+        """
+        if vocabulary is None:
+            vocabulary = topic_vocabulary(table)
+        topics = table.column(f"topics{level}").combine_chunks()
+        column_idx = pc.index_in(
+            topics.flatten(), value_set=pa.array(vocabulary, pa.string())
+        )
+        if column_idx.null_count > 0:
+            raise KeyError("topics are missing from the vocabulary")
+        return cls._from_lists(
+            table.column("page_id").to_numpy(),
+            np.diff(topics.offsets.to_numpy()),
+            column_idx.to_numpy(zero_copy_only=False),
+            vocabulary,
+        )
+
+    @classmethod
+    def from_ids(
+        cls, table: pa.Table, level: int, dictionary: TopicDictionary
+    ) -> "TopicIncidence":
+        """
+        Like from_table for a table with TOPIC_IDS_SCHEMA, whose columns are
+        the topics of the level in the dictionary.
+        """
+        offsets, ids = _flat_lists(table.column(f"topics{level}"))
+        ids = ids.to_numpy(zero_copy_only=False)
+        if ((ids < 0) | (ids >= len(dictionary))).any():
+            raise KeyError("topic ids are not in the dictionary")
+        column_idx = dictionary.level_index(level)[ids]
+        vocabulary = dictionary.levels[level - 1]
+        if (column_idx < 0).any():
+            raise KeyError(f"topic ids are not of level {level}")
+        return cls._from_lists(
+            table.column("page_id").to_numpy(), np.diff(offsets), column_idx, vocabulary
+        )
+
+    @classmethod
+    def _from_lists(
+        cls,
+        page_ids: np.ndarray,
+        lengths: np.ndarray,
+        column_idx: np.ndarray,
+        vocabulary: List[str],
+    ) -> "TopicIncidence":
+        page_ids = page_ids.astype(np.int64)
+        order = np.argsort(page_ids, kind="stable")
+        if len(page_ids) > 1 and (np.diff(page_ids[order]) == 0).any():
+            raise ValueError("page ids of the topic table are not unique")
+        rows = np.repeat(np.argsort(order), lengths)
+        matrix = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.int64), (rows, column_idx)),
+            shape=(len(page_ids), len(vocabulary)),
+        )
+        matrix.sum_duplicates()
+        return cls(page_ids[order], vocabulary, matrix)
+
+    @classmethod
+    def from_parquet(
+        cls, path: PathLike, level: int, vocabulary: Optional[List[str]] = None
+    ) -> "TopicIncidence":
+        """
+        Reads a table with TOPICS_SCHEMA, or the encoded output of
+        map_topics, whose vocabulary is the dictionary of the level.
+        """
+        table = pq.read_table(path, columns=["page_id", f"topics{level}"])
+        if table.schema.field(f"topics{level}").type == pa.list_(pa.int32()):
+            dictionary = TopicDictionary.load(topic_dictionary_file(path))
+            return cls.from_ids(table, level, dictionary)
+        if vocabulary is None:
+            vocabulary = topic_vocabulary(pq.read_table(path))
+        return cls.from_table(table, level, vocabulary=vocabulary)
+
+    def save(self, path: PathLike) -> None:
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        sparse.save_npz(path / "matrix.npz", self.matrix)
+        np.save(path / "page_ids.npy", self.page_ids)
+        pq.write_table(
+            pa.table({"topic": self.vocabulary}), path / "vocabulary.parquet"
+        )
+
+    @classmethod
+    def load(cls, path: PathLike) -> "TopicIncidence":
+        path = Path(path)
+        vocabulary = pq.read_table(path / "vocabulary.parquet").column("topic")
+        return cls(
+            np.load(path / "page_ids.npy"),
+            vocabulary.to_pylist(),
+            sparse.load_npz(path / "matrix.npz").tocsr(),
+        )
+
+    def views(self, page_ids: np.ndarray, views: np.ndarray) -> np.ndarray:
+        """
+        Sums the views of the given pages into a vector over the rows of
+        the matrix (or a matrix with a column per day for 2d views), pages
+        that have no topics are ignored.
+        """
+        page_ids = np.asarray(page_ids, dtype=np.int64)
+        views = np.nan_to_num(np.asarray(views, dtype=np.float64))
+        n = len(self.page_ids)
+        if n == 0:
+            return np.zeros((0,) + views.shape[1:], dtype=np.float64)
+        rows = np.minimum(np.searchsorted(self.page_ids, page_ids), n - 1)
+        known = np.flatnonzero(self.page_ids[rows] == page_ids)
+        if views.ndim == 1:
+            return np.bincount(rows[known], weights=views[known], minlength=n)
+        select = sparse.csr_matrix(
+            (np.ones(len(known)), (rows[known], known)), shape=(n, len(page_ids))
+        )
+        return np.asarray(select @ views)
+
+    def topic_totals(self, page_ids: np.ndarray, views: np.ndarray) -> np.ndarray:
+        """
+        Returns the total views per topic (per day for 2d views) of pages
+        with views, like summing the views over the exploded topics.
+        """
+        return np.asarray(self.matrix.T @ self.views(page_ids, views))
+
+    def topic_page_counts(self, page_ids: np.ndarray) -> np.ndarray:
+        """returns the number of the given pages per topic"""
+        return self.topic_totals(page_ids, np.ones(len(page_ids))).astype(np.int64)
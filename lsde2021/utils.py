@@ -1,23 +1,37 @@
 import bz2
 import gzip
+import zstandard
 import chardet
 import numpy as np
 from pathlib import Path
 from contextlib import contextmanager
+from functools import partial
 import typing
-from typing import Dict, Union, Iterator, List
+from typing import Dict, Union, Iterator, List, Optional
 from lsde2021.types import PathLike
+import lsde2021.parallel_bz2 as parallel_bz2
+import lsde2021.seekable_zstd as seekable_zstd
 
 
 @typing.no_type_check
 @contextmanager
-def fopen(path: PathLike, **options: Dict[str, int]) -> Iterator[None]:
+def fopen(
+    path: PathLike, processes: Optional[int] = None, **options: Dict[str, int]
+) -> Iterator[None]:
     extension = Path(path).suffix
     open_func = open
     if extension == ".gz":
         open_func = gzip.open
     elif extension == ".bz2":
         open_func = bz2.open
+        if processes is not None:
+            # decompress the blocks of the file in parallel
+            open_func = partial(parallel_bz2.open_parallel, processes=processes)
+    elif extension == ".zst":
+        open_func = zstandard.open
+        if "r" in options.get("mode", "r") and seekable_zstd.is_seekable(path):
+            # decompresses frames ahead in parallel and can seek
+            open_func = partial(seekable_zstd.open_seekable, processes=processes)
     with open_func(path, **options) as f:
         yield f
 
@@ -0,0 +1,285 @@
+import io
+import os
+import json
+import time
+import datetime
+import concurrent.futures
+import pandas as pd
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+import lsde2021.csv as csvutil
+import lsde2021.download as dl
+import lsde2021.parallel_bz2 as parallel_bz2
+from lsde2021.types import PathLike
+
+
+class WikiRange(NamedTuple):
+    # block and byte offset in its decompressed data of the first line
+    start_block: int
+    start_offset: int
+    # block and byte offset in its decompressed data after the last line
+    end_block: int
+    end_offset: int
+    # line number of the first line in the file and number of lines
+    first_line: int
+    lines: int
+
+
+class BlockSummary(NamedTuple):
+    size: int
+    newlines: int
+    # bytes up to the first and after the last newline, which belong to
+    # lines that span the neighbouring blocks
+    head: bytes
+    tail: bytes
+    # (offset, wiki_code, lines) of the complete lines in between
+    runs: List[Tuple[int, str, int]]
+
+
+def _wiki_code(line: bytes) -> str:
+    return line.split(b" ", 1)[0].decode("utf-8", errors="replace")
+
+
+def _runs(data: bytes, offset: int) -> List[Tuple[int, str, int]]:
+    """runs of consecutive lines of data (ending with a newline) by wiki_code"""
+    if not data:
+        return []
+    lines = data.count(b"\n")
+    first = data[: data.find(b" ") + 1]
+    if first and (b"\n" + data).count(b"\n" + first) == lines:
+        # the common case of a block that holds the lines of a single wiki
+        return [(offset, _wiki_code(first), lines)]
+    runs: List[Tuple[int, str, int]] = []
+    pos = offset
+    for line in data.split(b"\n")[:-1]:
+        code = _wiki_code(line)
+        if runs and runs[-1][1] == code:
+            runs[-1] = (runs[-1][0], code, runs[-1][2] + 1)
+        else:
+            runs.append((pos, code, 1))
+        pos += len(line) + 1
+    return runs
+
+
+def summarize_block(data: bytes) -> BlockSummary:
+    first = data.find(b"\n")
+    if first < 0:
+        return BlockSummary(len(data), 0, data, b"", [])
+    last = data.rfind(b"\n")
+    return BlockSummary(
+        size=len(data),
+        newlines=data.count(b"\n"),
+        head=data[: first + 1],
+        tail=data[last + 1 :],
+        runs=_runs(data[first + 1 : last + 1], first + 1),
+    )
+
+
+class WikiIndex:
+    """
+    Sidecar index of a pageview_complete bz2 file that records, for every
+    wiki_code, the bz2 blocks and line ranges that hold its lines, so that
+    a few wikis can be read without decompressing the whole file.
+    """
+
+    def __init__(
+        self,
+        size: int,
+        mtime_ns: int,
+        blocks: List[parallel_bz2.Segment],
+        block_sizes: List[int],
+        wikis: Dict[str, List[WikiRange]],
+    ):
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.blocks = blocks
+        self.block_sizes = block_sizes
+        self.wikis = wikis
+
+    @classmethod
+    def build(
+        cls, path: PathLike, processes: Optional[int] = None, prefetch: int = 64
+    ) -> "WikiIndex":
+        """decompresses and scans all blocks of the file in a process pool"""
+        stat = os.stat(path)
+        blocks: List[parallel_bz2.Segment] = []
+        block_sizes: List[int] = []
+        wikis: Dict[str, List[WikiRange]] = dict()
+        # (wiki_code, block, offset, first line, lines) of the current run
+        run: Optional[Tuple[str, int, int, int, int]] = None
+        line = 0
+
+        def close(block: int, offset: int) -> None:
+            if run is None:
+                return
+            if offset == 0 and block > 0:
+                # ends with the previous block
+                block, offset = block - 1, block_sizes[block - 1]
+            code, start_block, start_offset, first_line, lines = run
+            wikis.setdefault(code, []).append(
+                WikiRange(start_block, start_offset, block, offset, first_line, lines)
+            )
+
+        def add(code: str, block: int, offset: int, lines: int) -> None:
+            nonlocal run, line
+            if run is not None and run[0] == code:
+                run = run[:4] + (run[4] + lines,)
+            else:
+                close(block, offset)
+                run = (code, block, offset, line, lines)
+            line += lines
+
+        # the start of a line that spans blocks: (block, offset, bytes)
+        carry: Optional[Tuple[int, int, bytes]] = None
+        start = time.time()
+        with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+            for segment, summary in parallel_bz2.iter_blocks(
+                path, executor, prefetch, func=summarize_block
+            ):
+                block = len(blocks)
+                blocks.append(segment)
+                block_sizes.append(summary.size)
+                if carry is None:
+                    carry = (block, 0, b"")
+                if summary.newlines == 0:
+                    carry = (carry[0], carry[1], carry[2] + summary.head)
+                    continue
+                add(_wiki_code(carry[2] + summary.head), carry[0], carry[1], 1)
+                for offset, code, lines in summary.runs:
+                    add(code, block, offset, lines)
+                carry = None
+                if summary.tail:
+                    carry = (block, summary.size - len(summary.tail), summary.tail)
+                if len(blocks) % 500 == 0:
+                    rate = len(blocks) / (time.time() - start)
+                    print(f"indexed {len(blocks)} blocks of {path} ({rate:.0f}/s)")
+        if carry is not None and carry[2]:
+            # the last line does not end with a newline
+            add(_wiki_code(carry[2]), carry[0], carry[1], 1)
+        if blocks:
+            close(len(blocks) - 1, block_sizes[-1])
+        return cls(stat.st_size, stat.st_mtime_ns, blocks, block_sizes, wikis)
+
+    def is_current(self, path: PathLike) -> bool:
+        """whether the index belongs to the file as it is now"""
+        stat = os.stat(path)
+        return self.size == stat.st_size and self.mtime_ns == stat.st_mtime_ns
+
+    def ranges(self, wikis: Sequence[str]) -> List[WikiRange]:
+        """the ranges of the given wikis, in the order of the file"""
+        found = [r for wiki in set(wikis) for r in self.wikis.get(wiki, [])]
+        return sorted(found, key=lambda r: r.first_line)
+
+    def save(self, path: PathLike) -> None:
+        state = dict(
+            size=self.size,
+            mtime_ns=self.mtime_ns,
+            blocks=[
+                [s.start, list(s.ends), s.level.decode("ascii"), size]
+                for s, size in zip(self.blocks, self.block_sizes)
+            ],
+            wikis={
+                code: [list(r) for r in ranges] for code, ranges in self.wikis.items()
+            },
+        )
+        tmp = Path(path).with_name(f".{Path(path).name}.tmp")
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+        tmp.replace(path)
+
+    @classmethod
+    def load(cls, path: PathLike) -> "WikiIndex":
+        with open(path, "r") as f:
+            state = json.load(f)
+        return cls(
+            size=state["size"],
+            mtime_ns=state["mtime_ns"],
+            blocks=[
+                parallel_bz2.Segment(start, tuple(ends), level.encode("ascii"))
+                for start, ends, level, _ in state["blocks"]
+            ],
+            block_sizes=[size for _, _, _, size in state["blocks"]],
+            wikis={
+                code: [WikiRange(*r) for r in ranges]
+                for code, ranges in state["wikis"].items()
+            },
+        )
+
+
+def wiki_index_file(path: PathLike) -> Path:
+    return Path(str(path) + ".wikis.json")
+
+
+def load_wiki_index(path: PathLike, processes: Optional[int] = None) -> WikiIndex:
+    """
+    Loads the sidecar index of a pageview_complete file, which is built
+    (and saved) first if it is missing or belongs to an older file.
+    """
+    index_file = wiki_index_file(path)
+    if index_file.exists():
+        index = WikiIndex.load(index_file)
+        if index.is_current(path):
+            return index
+        print(f"{index_file} is outdated")
+    print(f"indexing {path} ...")
+    index = WikiIndex.build(path, processes=processes)
+    index.save(index_file)
+    return index
+
+
+def _decompress_block(path: PathLike, segment: parallel_bz2.Segment) -> bytes:
+    return parallel_bz2.decompress_segment(path, segment)[0]
+
+
+def read_wiki_lines(
+    path: PathLike,
+    wikis: Sequence[str],
+    index: Optional[WikiIndex] = None,
+    processes: Optional[int] = None,
+) -> bytes:
+    """
+    Returns the lines of the given wikis in a pageview_complete file, in the
+    order of the file. Only the bz2 blocks that hold them are decompressed.
+    """
+    if index is None:
+        index = load_wiki_index(path, processes=processes)
+    ranges = index.ranges(wikis)
+    needed = sorted({b for r in ranges for b in range(r.start_block, r.end_block + 1)})
+    if len(needed) > 1 and processes != 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+            decompressed = executor.map(
+                _decompress_block,
+                [path] * len(needed),
+                [index.blocks[b] for b in needed],
+            )
+            blocks = dict(zip(needed, decompressed))
+    else:
+        blocks = {b: _decompress_block(path, index.blocks[b]) for b in needed}
+    lines = []
+    for r in ranges:
+        if r.start_block == r.end_block:
+            lines.append(blocks[r.start_block][r.start_offset : r.end_offset])
+            continue
+        lines.append(blocks[r.start_block][r.start_offset :])
+        lines += [blocks[b] for b in range(r.start_block + 1, r.end_block)]
+        lines.append(blocks[r.end_block][: r.end_offset])
+    data = b"".join(lines)
+    if data and not data.endswith(b"\n"):
+        data += b"\n"
+    return data
+
+
+def read_pageview_wikis(
+    date: datetime.date,
+    wikis: Sequence[str],
+    src: PathLike,
+    processes: Optional[int] = None,
+) -> pd.DataFrame:
+    """
+    Reads the rows of the given wikis from the daily pageview_complete file
+    of date in src (laid out like the downloads), like read_pageview_csv but
+    without decompressing and parsing the lines of the other wikis.
+    """
+    path = Path(src) / "/".join(dl.wikimedia_pageview_complete_local_file(date))
+    data = read_wiki_lines(path, wikis, processes=processes)
+    return csvutil.read_pageview_csv(io.BytesIO(data))
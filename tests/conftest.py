@@ -0,0 +1,83 @@
+"""Shared fixtures for the lsde2021 tests."""
+
+import hashlib
+import random
+import re
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, Tuple, Type
+
+import pytest
+
+
+class FileHandler(BaseHTTPRequestHandler):
+    files: Dict[str, bytes] = dict()
+    delay: float = 0.0
+    active = 0
+    max_active = 0
+    # cut the connection after a random number of bytes for this many requests
+    cuts = 0
+    sent = 0
+    rng = random.Random(0)
+    lock = threading.Lock()
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        cls = type(self)
+        with cls.lock:
+            cls.active += 1
+            cls.max_active = max(cls.max_active, cls.active)
+        try:
+            time.sleep(cls.delay)
+            data = cls.files.get(self.path)
+            if data is None:
+                self.send_error(404)
+                return
+            etag = '"%s"' % hashlib.md5(data).hexdigest()
+            start = 0
+            match = re.match(r"bytes=(\d+)-", self.headers.get("Range", ""))
+            if_range = self.headers.get("If-Range")
+            if match and (if_range is None or if_range == etag):
+                start = int(match.group(1))
+            if start >= len(data) > 0:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{len(data)}")
+                self.end_headers()
+                return
+            self.send_response(206 if start > 0 else 200)
+            if start > 0:
+                self.send_header(
+                    "Content-Range", f"bytes {start}-{len(data) - 1}/{len(data)}"
+                )
+            self.send_header("Content-Length", str(len(data) - start))
+            self.send_header("ETag", etag)
+            self.end_headers()
+            body = data[start:]
+            with cls.lock:
+                cut = cls.cuts > 0
+                if cut:
+                    cls.cuts -= 1
+                    body = body[: cls.rng.randint(0, len(body) - 1)]
+                cls.sent += len(body)
+            self.wfile.write(body)
+            if cut:
+                self.wfile.flush()
+                self.connection.shutdown(socket.SHUT_RDWR)
+        finally:
+            with cls.lock:
+                cls.active -= 1
+
+
+@pytest.fixture
+def server() -> Iterator[Tuple[str, Type[FileHandler]]]:
+    handler = type("Handler", (FileHandler,), dict(files=dict(), lock=threading.Lock()))
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}", handler
+    httpd.shutdown()
+    httpd.server_close()
@@ -0,0 +1,232 @@
+import bz2
+import datetime
+import os
+import shutil
+import tracemalloc
+from pathlib import Path
+from typing import Any, Dict, Iterator, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+from pyspark.sql import SparkSession
+
+import lsde2021.aggregate as agg
+
+
+def touch_parquet(path: Path, mtime_ns: int) -> None:
+    part = path / "group=Germanic" / "part-00000.parquet"
+    part.parent.mkdir(parents=True, exist_ok=True)
+    part.write_bytes(b"PAR1")
+    for p in [part, part.parent, path]:
+        os.utime(p, ns=(mtime_ns, mtime_ns))
+
+
+def test_monthly_rollup_inputs(tmp_path: Path) -> None:
+    src, dest = tmp_path / "daily", tmp_path / "rollups"
+    month = datetime.date(2020, 2, 1)
+    days = agg.month_days(month)
+    assert len(days) == 29
+    for day in days[:3]:
+        touch_parquet(agg.daily_parquet_file(day, src), 10**18)
+
+    inputs = agg.rollup_inputs(month, src, dest, "monthly")
+    assert sorted(inputs) == sorted(
+        str(agg.daily_parquet_file(day, src)) for day in days[:3]
+    )
+
+    out = agg.rollup_file(month, dest, "monthly")
+    assert out.name == "2020-02.parquet"
+    assert not agg.rollup_is_current(out, inputs)
+    touch_parquet(out, 10**18)
+    agg._write_rollup_manifest(out, inputs)
+    assert agg.rollup_is_current(out, agg.rollup_inputs(month, src, dest))
+
+    # a rewritten day makes the month stale
+    touch_parquet(agg.daily_parquet_file(days[1], src), 2 * 10**18)
+    assert not agg.rollup_is_current(out, agg.rollup_inputs(month, src, dest))
+
+    # and so does a newly added day
+    agg._write_rollup_manifest(out, agg.rollup_inputs(month, src, dest))
+    touch_parquet(agg.daily_parquet_file(days[10], src), 10**18)
+    assert not agg.rollup_is_current(out, agg.rollup_inputs(month, src, dest))
+
+
+def test_rollup_files_for_range(tmp_path: Path) -> None:
+    for year in [2019, 2020]:
+        agg.rollup_file(datetime.date(year, 1, 1), tmp_path, "yearly").mkdir(
+            parents=True, exist_ok=True
+        )
+    for year, month in [(2019, 12), (2020, 1), (2020, 2), (2021, 1), (2021, 2)]:
+        agg.rollup_file(datetime.date(year, month, 1), tmp_path, "monthly").mkdir(
+            parents=True, exist_ok=True
+        )
+
+    files = agg.rollup_files_for_range(
+        datetime.date(2019, 12, 15), datetime.date(2021, 1, 10), tmp_path
+    )
+    assert [f.relative_to(tmp_path) for f in files] == [
+        Path("monthly/2019-12.parquet"),
+        Path("yearly/2020.parquet"),
+        Path("monthly/2021-01.parquet"),
+    ]
+
+
+def test_aggregate_pageviews_local_spills(tmp_path: Path) -> None:
+    rng = np.random.default_rng(0)
+    wikis = np.array(["de.wikipedia", "en.wikipedia", "nl.wikibooks"])
+    rows = []
+    for i in range(2):
+        path = tmp_path / f"pageviews-2021010{i + 1}-user.bz2"
+        lines = []
+        for _ in range(5000):
+            wiki = rng.choice(wikis)
+            page_id, views = rng.integers(1, 300), rng.integers(1, 1000)
+            client = rng.choice(["desktop", "mobile-web"])
+            lines.append(f"{wiki} Title_{page_id} {page_id} {client} {views} A{views}")
+            rows.append((wiki, page_id, views))
+        lines.insert(100, "en.wikipedia Some_title null desktop 3 C3")
+        lines.insert(200, "truncated line")
+        with bz2.open(path, "wt") as f:
+            f.write("\n".join(lines) + "\n")
+
+    expected = (
+        pd.DataFrame(rows, columns=["wiki_code", "page_id", "view_count"])
+        .groupby(["wiki_code", "page_id"])["view_count"]
+        .sum()
+    )
+
+    aggregator = agg.PageviewAggregator(memory_budget=16 * 1000)
+    for path in sorted(tmp_path.glob("*.bz2")):
+        for chunk in agg.iter_pageview_chunks(path, chunk_size=700):
+            aggregator.add(*chunk)
+    assert len(aggregator.runs) > 1
+    aggregator.close()
+
+    out = agg.aggregate_pageviews_local(
+        sorted(tmp_path.glob("*.bz2")),
+        tmp_path / "daily.parquet",
+        memory_budget=16 * 200,
+        chunk_size=700,
+    )
+    assert sorted(p.name for p in Path(out).iterdir()) == [
+        "_SUCCESS",
+        "wiki_code=de.wikipedia",
+        "wiki_code=en.wikipedia",
+        "wiki_code=nl.wikibooks",
+    ]
+    # every merged chunk is written as a row group, ordered by page id
+    part = pq.ParquetFile(Path(out) / "wiki_code=en.wikipedia" / "part-00000.parquet")
+    sizes = [part.metadata.row_group(i).num_rows for i in range(part.num_row_groups)]
+    assert len(sizes) > 1 and max(sizes) <= 100
+    page_ids = part.read().column("page_id").to_pylist()
+    assert page_ids == sorted(page_ids)
+
+    daily = pd.read_parquet(out)
+    daily["wiki_code"] = daily["wiki_code"].astype(str)
+    got = daily.set_index(["wiki_code", "page_id"])["view_count"].sort_index()
+    assert got.index.tolist() == expected.index.tolist()
+    assert got.tolist() == expected.tolist()
+
+
+def test_partitions_merge_runs_in_chunks() -> None:
+    rng = np.random.default_rng(1)
+    aggregator = agg.PageviewAggregator(memory_budget=16 * 200)
+    page_ids = rng.integers(1, 2000, size=(30, 150))
+    views = rng.integers(1, 100, size=page_ids.shape)
+    for ids, counts in zip(page_ids, views):
+        wiki_codes = np.where(ids % 7 == 0, "de.wikipedia", "en.wikipedia")
+        aggregator.add(wiki_codes, ids, counts)
+    assert len(aggregator.runs) > 5
+
+    chunks = list(aggregator.partitions())
+    aggregator.close()
+    # every chunk holds at most half the budget of entries
+    assert len(chunks) > 10
+    assert all(len(ids) <= 100 for _, ids, _ in chunks)
+    assert [wiki for wiki, _, _ in chunks] == sorted(wiki for wiki, _, _ in chunks)
+
+    expected = (
+        pd.DataFrame({"page_id": page_ids.ravel(), "view_count": views.ravel()})
+        .assign(wiki_code=lambda df: np.where(df["page_id"] % 7 == 0, "de", "en"))
+        .groupby(["wiki_code", "page_id"])["view_count"]
+        .sum()
+    )
+    for wiki in ["de.wikipedia", "en.wikipedia"]:
+        ids = np.concatenate([ids for w, ids, _ in chunks if w == wiki])
+        counts = np.concatenate([counts for w, _, counts in chunks if w == wiki])
+        assert ids.tolist() == expected[wiki[:2]].index.tolist()
+        assert counts.tolist() == expected[wiki[:2]].tolist()
+
+
+def test_partitions_memory_is_bounded_by_the_budget() -> None:
+    # a single wiki with far more distinct pages than fit into the budget
+    n, budget = 200_000, 16 * 2000
+    aggregator = agg.PageviewAggregator(memory_budget=budget)
+    page_ids = np.random.default_rng(2).permutation(np.arange(1, n + 1))
+    for ids in np.split(page_ids, 200):
+        aggregator.add(np.full(len(ids), "en.wikipedia"), ids, ids % 10)
+    assert len(aggregator.runs) > 50
+
+    tracemalloc.start()
+    try:
+        last, total = 0, 0
+        for _, ids, counts in aggregator.partitions():
+            assert ids[0] > last
+            last, total = int(ids[-1]), total + int(counts.sum())
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        aggregator.close()
+    assert last == n and total == int((page_ids % 10).sum())
+    # the whole wiki would take n * 16 bytes
+    assert peak < n * agg.PageviewAggregator.ENTRY_SIZE // 4
+
+
+@pytest.fixture(scope="module")
+def spark() -> Iterator[SparkSession]:
+    if shutil.which("java") is None and "JAVA_HOME" not in os.environ:
+        pytest.skip("spark needs a java runtime")
+    session = SparkSession.builder.master("local[1]").getOrCreate()
+    yield session
+    session.stop()
+
+
+def test_union_matches_join(spark: SparkSession, tmp_path: Path) -> None:
+    # pages missing from some hours and empty (null) view counts
+    hours = [
+        ["en.wikipedia Foo 3 0", "en.wikipedia Bar 1 0", "de.wikipedia Foo 2 0"],
+        ["en.wikipedia Foo  0", "de.wikipedia Baz 5 0"],
+        ["en.wikipedia Bar 4 0", "en.wikipedia Qux  0", "de.wikipedia Foo 1 0"],
+    ]
+    hourly_files = []
+    for hour, lines in enumerate(hours):
+        path = tmp_path / f"pageviews-{hour:02d}.txt"
+        path.write_text("\n".join(lines) + "\n")
+        hourly_files.append((hour, path))
+    # a missing hour is skipped by both modes
+    hourly_files.append((3, tmp_path / "pageviews-03.txt"))
+
+    def collect(df: Any) -> Dict[Tuple[str, str], int]:
+        return {
+            (row["domain_code"], row["page_title"]): row["view_count"]
+            for row in df.collect()
+        }
+
+    union = agg._union_hourly_pageviews(spark, hourly_files, hourly_counts=True)
+    join = agg._join_hourly_pageviews(spark, hourly_files)
+    assert union is not None and join is not None
+    assert collect(union) == collect(join)
+    assert collect(union) == {
+        ("en.wikipedia", "Foo"): 3,
+        ("en.wikipedia", "Bar"): 5,
+        ("en.wikipedia", "Qux"): 0,
+        ("de.wikipedia", "Foo"): 3,
+        ("de.wikipedia", "Baz"): 5,
+    }
+    counts = {
+        (row["domain_code"], row["page_title"]): row["hourly_counts"]
+        for row in union.collect()
+    }
+    assert counts[("en.wikipedia", "Bar")] == [1, 0, 4, 0]
@@ -0,0 +1,66 @@
+import datetime
+import json
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import lsde2021.changepoints as cp
+
+
+@pytest.fixture
+def series() -> Dict[str, pd.Series]:
+    """noisy step functions of the stringency index with known change dates"""
+    rng = np.random.default_rng(0)
+    dates = pd.date_range("2020-01-01", periods=120, freq="D")
+    steps = {"Germany": [30, 80], "Italy": [50], "Japan": [20, 60, 100]}
+    series = dict()
+    for country, changes in steps.items():
+        levels = np.zeros(len(dates))
+        for i, change in enumerate(changes):
+            levels[change:] = 20 * (i + 1)
+        values = levels + rng.normal(0, 1, len(dates))
+        series[country] = pd.Series(values, index=dates, name="StringencyIndex")
+    series["Iceland"] = series["Italy"][:10]
+    return series
+
+
+def dates(*days: int) -> List[datetime.date]:
+    return [datetime.date(2020, 1, 1) + datetime.timedelta(days=d - 1) for d in days]
+
+
+@pytest.mark.parametrize("algorithm", ["dynp", "binseg", "pelt"])
+def test_detect_change_points(series: Dict[str, pd.Series], algorithm: str) -> None:
+    n = dict(Germany=2, Italy=1, Japan=3)
+    found = {
+        country: cp.detect_change_points(
+            series[country], n=n[country], algorithm=algorithm  # type: ignore
+        )
+        for country in n
+    }
+    assert found == dict(
+        Germany=dates(30, 80), Italy=dates(50), Japan=dates(20, 60, 100)
+    )
+
+
+def test_change_points_cached(series: Dict[str, pd.Series], tmp_path: Path) -> None:
+    found = cp.change_points(series, n=2, processes=2, cache_dir=tmp_path)
+    assert list(found) == ["Germany", "Italy", "Japan", "Iceland"]
+    assert found["Germany"] == dates(30, 80)
+    assert found["Iceland"] == []
+    assert len(list(tmp_path.glob("*.json"))) == 4
+    for country, values in series.items():
+        assert found[country] == cp.change_points({country: values}, n=2)[country]
+
+    # cached results are keyed by the parameters and data
+    cache_file = cp.change_points_cache_file(
+        tmp_path, "Germany", 7, 2, cp.fingerprint(series["Germany"])
+    )
+    with open(cache_file, "w") as f:
+        json.dump(["2020-02-02"], f)
+    assert cp.change_points(series, n=2, cache_dir=tmp_path)["Germany"] == dates(33)
+    assert cp.change_points(series, n=3, cache_dir=tmp_path)["Germany"] != dates(33)
+    series["Germany"].iloc[0] += 1
+    assert cp.change_points(series, n=2, cache_dir=tmp_path)["Germany"] == dates(30, 80)
@@ -0,0 +1,260 @@
+import bz2
+import datetime
+import gzip
+import os
+import random
+import re
+from pathlib import Path
+from typing import Any, List, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+import lsde2021.csv as csvutil
+
+
+def write_categorylinks(path: Path, n: int) -> None:
+    with open(path, "w") as f:
+        for i in range(n):
+            f.write(
+                f"{i},Category_{i % 97},SORTKEY{i},2021-01-01 00:00:00,"
+                f"prefix{i if i >= 500 else 0},uca-default,{['page', 'subcat'][i % 2]}\n"
+            )
+
+
+def test_iter_categorylinks_csv_rows(tmp_path: Path) -> None:
+    path = tmp_path / "categorylinks.csv"
+    write_categorylinks(path, 2500)
+    chunks = list(csvutil.iter_categorylinks_csv(path, chunk_rows=1000))
+    assert [len(c) for c in chunks] == [1000, 1000, 500]
+    assert all(c["type"].dtype == "category" for c in chunks)
+    full = csvutil.read_categorylinks_csv(path)
+    assert pd.concat(chunks, ignore_index=True).astype(str).equals(full.astype(str))
+
+
+def test_iter_categorylinks_csv_bytes(tmp_path: Path) -> None:
+    path = tmp_path / "categorylinks.csv"
+    write_categorylinks(path, 20_000)
+    budget = 256 * 1024
+    chunks = list(
+        csvutil.iter_categorylinks_csv(path, chunk_bytes=budget, probe_rows=500)
+    )
+    assert sum(len(c) for c in chunks) == 20_000
+    assert len(chunks) > 3
+    for chunk in chunks[1:]:
+        assert chunk.memory_usage(deep=True).sum() < 1.5 * budget
+
+
+def test_write_parquet_chunks(tmp_path: Path) -> None:
+    path = tmp_path / "categorylinks.csv"
+    write_categorylinks(path, 2500)
+    out = tmp_path / "categorylinks.parquet"
+    # the sortkey_prefix categories outgrow int8 indices after the first chunk
+    rows = csvutil.write_parquet_chunks(
+        csvutil.iter_categorylinks_csv(path, chunk_rows=500), out
+    )
+    assert rows == 2500
+    table = pq.read_table(out).to_pandas()
+    full = csvutil.read_categorylinks_csv(path)
+    assert table.astype(str).equals(full.astype(str))
+
+
+def test_iter_page_csv(tmp_path: Path) -> None:
+    path = tmp_path / "page.csv"
+    with open(path, "w") as f:
+        for i in range(250):
+            links_updated = "" if i % 7 == 0 else "20211001083000"
+            lang = "de" if i % 5 == 0 else ""
+            f.write(
+                f"{i},{[0, 14][i % 2]},Title_{i},,{i % 3 == 0:d},0,0.{i},"
+                f"2021100108{i % 60:02d}00,{links_updated},{i + 1000},{i * 10},"
+                f"wikitext,{lang}\n"
+            )
+    chunks = list(csvutil.iter_page_csv(path, chunk_rows=100))
+    assert [len(c) for c in chunks] == [100, 100, 50]
+    df = pd.concat(chunks, ignore_index=True)
+    assert df["page_id"].dtype == "Int64" and df["page_len"].dtype == "Int64"
+    assert df["page_id"].tolist() == list(range(250))
+    assert df["page_is_redirect"].tolist() == [i % 3 == 0 for i in range(250)]
+    assert df["page_touched"][61] == pd.Timestamp(2021, 10, 1, 8, 1)
+    assert df["page_links_updated"].isna().sum() == 36
+    assert df.astype(str).equals(csvutil.read_page_csv(path).astype(str))
+
+
+def test_iter_pageview_csv(tmp_path: Path) -> None:
+    path = tmp_path / "pageviews-20210101-user"
+    with open(path, "w") as f:
+        for i in range(1000):
+            # pages that do not exist (anymore) have a null page id
+            page_id = "null" if i % 9 == 0 else str(i)
+            f.write(f"en.wikipedia Title_{i} {page_id} desktop {i + 1} A{i + 1}\n")
+    chunks = list(csvutil.iter_pageview_csv(path, chunk_rows=300))
+    assert [len(c) for c in chunks] == [300, 300, 300, 100]
+    df = pd.concat(chunks, ignore_index=True)
+    assert df["page_id"].isna().tolist() == [i % 9 == 0 for i in range(1000)]
+    assert df["page_id"].dropna().tolist() == [i for i in range(1000) if i % 9]
+    assert df["daily_total"].tolist() == list(range(1, 1001))
+    full = csvutil.read_pageview_csv(path)
+    assert df.astype(str).equals(full.astype(str))
+
+
+def decode_hourly_count(hourly_count: str) -> List[int]:
+    hourly = [0] * 24
+    for hour, views in re.findall(r"([A-X])([0-9]+)", hourly_count):
+        hourly[ord(hour) - ord("A")] = int(views)
+    return hourly
+
+
+def test_read_pageview_arrow(tmp_path: Path) -> None:
+    rng = random.Random(0)
+    good, bad = [], []
+    for i in range(3000):
+        hours = sorted(rng.sample(range(24), rng.randint(1, 24)))
+        hourly_count = "".join(f"{chr(65 + h)}{rng.randint(1, 10 ** 6)}" for h in hours)
+        page_id = "null" if i % 500 == 0 else str(rng.randrange(10**8))
+        good.append(
+            f"{['de', 'en'][i % 2]}.wikipedia Title_{i} {page_id} "
+            f"{['desktop', 'mobile-web'][i % 3 == 0]} {rng.randint(1, 10 ** 7)} {hourly_count}"
+        )
+    bad.append("en.wikipedia Truncated_line")
+    bad.append("en.wikipedia Bad_total 123 desktop lots A1")
+    bad.append("en.wikipedia Bad_hourly 123 desktop 1 A1Y2")
+    lines = list(good)
+    for j, line in enumerate(bad):
+        lines.insert(700 * (j + 1), line)
+    path = tmp_path / "pageviews-20210101-user.bz2"
+    with bz2.open(path, "wt") as f:
+        f.write("\n".join(lines) + "\n")
+
+    table, hourly = csvutil.read_pageview_arrow(path, block_size=16 * 1024)
+    assert table.num_rows == len(good)
+    assert pa.types.is_dictionary(table.schema.field("wiki_code").type)
+    assert pa.types.is_dictionary(table.schema.field("user_client").type)
+    assert hourly.shape == (len(good), 24)
+    assert hourly.dtype == np.uint32
+
+    fields = [line.split(" ") for line in good]
+    assert table["page_title"].to_pylist() == [f[1] for f in fields]
+    assert table["page_id"].to_pylist() == [
+        None if f[2] == "null" else int(f[2]) for f in fields
+    ]
+    assert table["daily_total"].to_pylist() == [int(f[4]) for f in fields]
+    assert hourly.tolist() == [decode_hourly_count(f[5]) for f in fields]
+
+    quarantine = Path(str(path) + ".bad")
+    assert sorted(quarantine.read_text().splitlines()) == sorted(bad)
+
+
+def test_sql_dump_to_parquet(tmp_path: Path) -> None:
+    path = tmp_path / "dewiki-20211001-page.sql.gz"
+    rows = [
+        "(1,0,'Albert_Einstein','',0,0,0.1234,'20211001083000','20211001083000',"
+        "42,1024,'wikitext',NULL)",
+        "(2,14,'Don\\'t_(band),_live','',1,1,0.5,'20211001083000',NULL,"
+        "43,2048,'wikitext','de')",
+        "(3,0,'Back\\\\slash\\nnewline_Ä','',0,0,1,'20211001083000',"
+        "'20211001083000',44,0,'wikitext',NULL)",
+    ]
+    with gzip.open(path, "wt") as f:
+        f.write("-- MySQL dump\n")
+        f.write("CREATE TABLE `page` (\n  `page_id` int(8)\n);\n")
+        f.write(f"INSERT INTO `page` VALUES {rows[0]},{rows[1]};\n")
+        f.write(f"INSERT INTO `page` VALUES {rows[2]};\n")
+
+    out = tmp_path / "dewiki-20211001-page.parquet"
+    columns, dtype = csvutil.SQL_DUMP_TABLES["page"]
+    assert csvutil.write_sql_dump_parquet(path, out, columns, dtype) == 3
+    table = pq.read_table(out)
+    assert table.schema.field("page_content_model").type == pa.dictionary(
+        pa.int32(), pa.string()
+    )
+    pages = table.to_pylist()
+    assert [p["page_title"] for p in pages] == [
+        "Albert_Einstein",
+        "Don't_(band),_live",
+        "Back\\slash\nnewline_Ä",
+    ]
+    assert [p["page_namespace"] for p in pages] == [0, 14, 0]
+    assert [p["page_is_redirect"] for p in pages] == [False, True, False]
+    assert [p["page_random"] for p in pages] == [0.1234, 0.5, 1.0]
+    assert [p["page_lang"] for p in pages] == [None, "de", None]
+    assert pages[0]["page_touched"] == datetime.datetime(2021, 10, 1, 8, 30)
+    assert pages[1]["page_links_updated"] is None
+
+
+def test_sql_dump_column_mismatch(tmp_path: Path) -> None:
+    path = tmp_path / "dewiki-20211001-langlinks.sql"
+    path.write_text("INSERT INTO `langlinks` VALUES (1,'en','A'),(2,'en');\n")
+    columns, dtype = csvutil.SQL_DUMP_TABLES["langlinks"]
+    with pytest.raises(ValueError):
+        list(csvutil.iter_sql_dump_batches(path, columns, dtype))
+
+
+convert_sql_dump = csvutil._convert_sql_dump
+
+
+def write_langlinks_dump(path: Path, rows: int) -> None:
+    with gzip.open(path, "wt") as f:
+        values = ",".join(f"({i},'en','Title_{i}')" for i in range(rows))
+        f.write(f"INSERT INTO `langlinks` VALUES {values};\n")
+
+
+def test_convert_sql_dumps(tmp_path: Path) -> None:
+    sizes = [10, 5000, 300]
+    items = []
+    for i, rows in enumerate(sizes):
+        path = tmp_path / f"wiki{i}-20211001-langlinks.sql.gz"
+        write_langlinks_dump(path, rows)
+        items.append(("langlinks", path))
+    broken = tmp_path / "broken-20211001-langlinks.sql.gz"
+    with gzip.open(broken, "wt") as f:
+        f.write("INSERT INTO `langlinks` VALUES (1,'en');\n")
+    items.append(("langlinks", broken))
+
+    # the memory limit only admits a single job at a time
+    results = csvutil.convert_sql_dumps(
+        items, max_workers=2, max_memory=1, memory_func=lambda _: 1
+    )
+    assert [item for item, _ in results] == items
+    assert [dest for _, dest in results][-1] is None
+    for (_, path), (_, dest), rows in zip(items, results, sizes):
+        assert dest == tmp_path / path.name.replace(".sql.gz", ".parquet")
+        assert pq.read_table(dest).num_rows == rows
+
+    mtimes = [Path(str(dest)).stat().st_mtime_ns for _, dest in results[:-1]]
+    results = csvutil.convert_sql_dumps(items[:-1])
+    assert [Path(str(dest)).stat().st_mtime_ns for _, dest in results] == mtimes
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def dying_convert_sql_dump(table: str, path: Path, dest: Path) -> Tuple[int, float]:
+    """kills its worker for crash dumps, and for flaky dumps the first time"""
+    marker = Path(f"{path}.died")
+    if "crash" in path.name or ("flaky" in path.name and not marker.exists()):
+        marker.touch()
+        os._exit(1)
+    return convert_sql_dump(table, path, dest)
+
+
+def test_convert_sql_dumps_survives_dying_workers(
+    tmp_path: Path, monkeypatch: Any
+) -> None:
+    monkeypatch.setattr(csvutil, "_convert_sql_dump", dying_convert_sql_dump)
+    names = ["wiki0", "crash", "wiki1", "flaky", "wiki2"]
+    items = []
+    for name in names:
+        path = tmp_path / f"{name}-20211001-langlinks.sql.gz"
+        write_langlinks_dump(path, 100)
+        items.append(("langlinks", path))
+
+    results = csvutil.convert_sql_dumps(items, max_workers=2)
+    assert [item for item, _ in results] == items
+    for name, (_, dest) in zip(names, results):
+        if name == "crash":
+            assert dest is None
+        else:
+            assert dest is not None
+            assert pq.read_table(dest).num_rows == 100
@@ -0,0 +1,108 @@
+import datetime
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import lsde2021.did as did
+
+
+@pytest.fixture
+def views() -> pd.DataFrame:
+    """sparse daily views of topics with missing days and duplicate rows"""
+    rng = np.random.default_rng(0)
+    days = pd.date_range("2019-01-01", "2020-12-31", freq="D").date
+    rows: List[Tuple[str, datetime.date, Optional[float]]] = []
+    for topic in ["Music", "Sports", "Medicine", "Rare", "Bad_topic"]:
+        present = rng.random(len(days)) < (0.05 if topic == "Rare" else 0.9)
+        for day in days[present]:
+            rows.append((topic, day, float(rng.integers(0, 1000))))
+    rows += rows[:100]
+    rows.append(("Music", days[0], None))
+    rows.append(("Sports", datetime.date(2020, 3, 10), None))
+    rows.append(("Medicine", datetime.date(2020, 3, 20), None))
+    return pd.DataFrame(rows, columns=["topic", "date", "level4_daily_total"])
+
+
+def window_mean(
+    df: pd.DataFrame, start: datetime.date, end: datetime.date, name: str
+) -> pd.DataFrame:
+    """the filter, fillna(0), groupBy and mean of the spark implementation"""
+    window = df[(start <= df["date"]) & (df["date"] <= end)].fillna(0)
+    return window.groupby("topic")["level4_daily_total"].mean().rename(name)
+
+
+def spark_did(
+    df: pd.DataFrame, changepoint: datetime.date, control: datetime.date, size: int
+) -> pd.DataFrame:
+    window = datetime.timedelta(days=size)
+    means = [
+        window_mean(df, changepoint - window, changepoint, "pre_target_mean"),
+        window_mean(df, control - window, control, "pre_control_mean"),
+        window_mean(df, changepoint, changepoint + window, "post_target_mean"),
+        window_mean(df, control, control + window, "post_control_mean"),
+    ]
+    diff = pd.concat(means, axis=1, join="inner")
+    diff["control_diff"] = diff["pre_control_mean"] - diff["post_control_mean"]
+    baseline = diff["pre_target_mean"] + diff["control_diff"]
+    diff["target_diff"] = diff["post_target_mean"] - baseline
+    diff["rel_diff"] = diff["post_target_mean"] / baseline.replace(0, np.nan)
+    return diff
+
+
+def test_did_matches_spark(views: pd.DataFrame) -> None:
+    df = views[~views["topic"].str.lower().str.contains("bad")]
+    m = did.TopicDayMatrix.from_frame(views, "level4_daily_total", exclude=["bad"])
+    assert m.topics == ["Medicine", "Music", "Rare", "Sports"]
+
+    changepoints = [datetime.date(2020, 3, 15), datetime.date(2020, 12, 28)]
+    changepoints += [datetime.date(2019, 1, 3)]
+    controls = [c - datetime.timedelta(days=365) for c in changepoints]
+    result = did.did(m, changepoints, controls, window_size=15)
+    for changepoint, control in zip(changepoints, controls):
+        expected = spark_did(df, changepoint, control, 15)
+        found = result[result["changepoint"] == changepoint].set_index("topic")
+        assert (found["control_changepoint"] == control).all()
+        assert sorted(found.index) == sorted(expected.index)
+        for column in expected.columns:
+            np.testing.assert_allclose(
+                found.loc[expected.index, column], expected[column], rtol=1e-12
+            )
+
+    diffs = did.diff(m, changepoints, window_size=15)
+    for changepoint in changepoints:
+        window = datetime.timedelta(days=15)
+        pre = window_mean(df, changepoint - window, changepoint, "pre_mean")
+        post = window_mean(df, changepoint, changepoint + window, "post_mean")
+        expected = pd.concat([pre, post], axis=1, join="inner")
+        found = diffs[diffs["changepoint"] == changepoint].set_index("topic")
+        assert sorted(found.index) == sorted(expected.index)
+        np.testing.assert_allclose(
+            found.loc[expected.index, "abs_diff"],
+            expected["post_mean"] - expected["pre_mean"],
+        )
+
+
+def test_window_means() -> None:
+    start = datetime.date(2020, 1, 1)
+    sums = np.array([[1, 2, 3, 4], [0, 0, 10, 0]], dtype=np.float64)
+    counts = np.array([[1, 1, 1, 1], [0, 0, 2, 0]])
+    m = did.TopicDayMatrix(["a", "b"], start, sums, counts)
+    days: List[datetime.date] = [start + datetime.timedelta(days=d) for d in range(6)]
+    means = m.window_means([days[0], days[1], days[4]], [days[1], days[5], days[5]])
+    np.testing.assert_array_equal(means[0], [1.5, 3, np.nan])
+    np.testing.assert_array_equal(means[1], [np.nan, 5, np.nan])
+
+
+def test_missing_daily_totals_count_as_zero() -> None:
+    df = pd.DataFrame(
+        {
+            "topic": ["a", "a", "a", "b"],
+            "date": [datetime.date(2020, 1, d) for d in [1, 2, 3, 2]],
+            "views": [4.0, None, 8.0, None],
+        }
+    )
+    m = did.TopicDayMatrix.from_frame(df, "views")
+    start, end = [datetime.date(2020, 1, 1)], [datetime.date(2020, 1, 3)]
+    np.testing.assert_array_equal(m.window_means(start, end)[:, 0], [4.0, 0.0])
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for downloading from a local HTTP server."""
+
+import bz2
+import gzip
+import hashlib
+import random
+from functools import partial
+from pathlib import Path
+from typing import Callable, Tuple, Type
+
+import pytest
+
+import lsde2021.download as dl
+from tests.conftest import FileHandler
+
+
+def test_download_files_per_host_limit(
+    server: Tuple[str, Type[FileHandler]], tmp_path: Path
+) -> None:
+    url, handler = server
+    handler.delay = 0.1
+    handler.files = {f"/file-{i}": bytes([i]) * 1000 for i in range(8)}
+
+    items = [(i, f"{url}/file-{i}") for i in range(8)]
+    downloaded = dl.download_files(
+        items,
+        destination_func=lambda i: tmp_path / f"file-{i}",
+        max_workers=8,
+        max_per_host=3,
+    )
+    assert [i for i, _ in downloaded] == list(range(8))
+    for i, destination in downloaded:
+        assert destination is not None
+        assert Path(destination).read_bytes() == bytes([i]) * 1000
+    assert 1 < handler.max_active <= 3
+
+
+def test_download_files_releases_host_slot_while_waiting(
+    server: Tuple[str, Type[FileHandler]], tmp_path: Path
+) -> None:
+    url, handler = server
+    handler.files = {f"/file-{i}": bytes([i]) * 100_000 for i in range(2)}
+    # the first request is cut and its download waits a second to retry
+    handler.cuts = 1
+    downloaded = dl.download_files(
+        [(i, f"{url}/file-{i}") for i in range(2)],
+        destination_func=lambda i: tmp_path / f"file-{i}",
+        max_workers=2,
+        max_per_host=1,
+        retry_wait=1,
+    )
+    assert all(destination is not None for _, destination in downloaded)
+    assert handler.max_active == 1
+    # the other file was downloaded while the first one was waiting
+    mtimes = [(tmp_path / f"file-{i}").stat().st_mtime for i in range(2)]
+    assert abs(mtimes[0] - mtimes[1]) > 0.5
+
+
+def test_download_files_reports_failures(
+    server: Tuple[str, Type[FileHandler]], tmp_path: Path
+) -> None:
+    url, handler = server
+    handler.files = {"/exists": b"data"}
+    downloaded = dict(
+        dl.download_files(
+            [("exists", f"{url}/exists"), ("missing", f"{url}/missing")],
+            destination_func=lambda name: tmp_path / name,
+        )
+    )
+    assert downloaded["exists"] == tmp_path / "exists"
+    assert downloaded["missing"] is None
+
+
+def test_download_file_resumes_after_cut_connections(
+    server: Tuple[str, Type[FileHandler]], tmp_path: Path
+) -> None:
+    url, handler = server
+    data = random.Random(1).randbytes(1024 * 1024)
+    handler.files = {"/pageviews.bz2": data}
+    handler.cuts = 10
+    destination = tmp_path / "pageviews.bz2"
+    dl.download_file(f"{url}/pageviews.bz2", destination, retry_wait=0)
+    assert destination.read_bytes() == data
+    assert not Path(f"{destination}.part").exists()
+    assert handler.cuts == 0
+    # resumed instead of restarted, only bytes in flight are transferred twice
+    assert handler.sent < 1.5 * len(data)
+
+
+def test_download_file_restarts_when_remote_file_changed(
+    server: Tuple[str, Type[FileHandler]], tmp_path: Path
+) -> None:
+    url, handler = server
+    old, new = b"a" * 10_000, b"b" * 20_000
+    handler.files = {"/file": old}
+    handler.cuts = 1
+    destination = tmp_path / "file"
+    with pytest.raises(ValueError):
+        dl._download_file(f"{url}/file", destination, max_retries=1, retry_wait=0)
+    assert Path(f"{destination}.part").exists()
+
+    # resuming must not append the new file to the old partial content
+    handler.files = {"/file": new}
+    dl._download_file(f"{url}/file", destination, retry_wait=0)
+    assert destination.read_bytes() == new
+
+
+def test_download_file_validates_while_streaming(
+    server: Tuple[str, Type[FileHandler]], tmp_path: Path
+) -> None:
+    url, handler = server
+    data = bz2.compress(b"en.wikipedia Main_Page 1 desktop 10 A10\n" * 10_000)
+    handler.files = {"/ok.bz2": data, "/corrupt.bz2": data[:100] + b"x" + data[101:]}
+    handler.cuts = 3
+
+    destination = tmp_path / "ok.bz2"
+    dl._download_file(
+        f"{url}/ok.bz2",
+        destination,
+        retry_wait=0,
+        stream_validator_func=partial(dl.stream_validator_for, hash_name="sha1"),
+    )
+    assert destination.read_bytes() == data
+    checksum = Path(f"{destination}.sha1").read_text()
+    assert checksum == f"{hashlib.sha1(data).hexdigest()}  ok.bz2\n"
+
+    destination = tmp_path / "corrupt.bz2"
+    with pytest.raises(ValueError):
+        dl._download_file(
+            f"{url}/corrupt.bz2",
+            destination,
+            max_retries=2,
+            retry_wait=0,
+            stream_validator_func=dl.stream_validator_for,
+        )
+    assert not destination.exists()
+    assert not Path(f"{destination}.part").exists()
+
+
+@pytest.mark.parametrize(
+    "validator, compress",
+    [(dl.Bz2StreamValidator, bz2.compress), (dl.GzipStreamValidator, gzip.compress)],
+)
+def test_stream_validators(
+    validator: Callable[..., dl.StreamValidator], compress: Callable[[bytes], bytes]
+) -> None:
+    # multiple concatenated streams of highly compressible data
+    data = compress(b"\0" * 10_000_000) + compress(b"hello world\n" * 1000)
+
+    def validate(data: bytes, chunk_size: int = 8192) -> bool:
+        v = validator(max_length=1024)
+        for i in range(0, len(data), chunk_size):
+            v.update(data[i : i + chunk_size])
+        return v.finalize()
+
+    assert validate(data)
+    assert validate(data, chunk_size=1)
+    assert not validate(data[:-10])
+    with pytest.raises(Exception):
+        validate(data[:20] + b"garbage" + data[20:])
@@ -0,0 +1,39 @@
+from pathlib import Path
+from typing import List
+
+import pytest
+
+import lsde2021.lang as lang
+
+INFLECTIONS = Path(__file__).parent / "data" / "inflections.tsv"
+
+
+@pytest.fixture
+def inflections() -> List[List[str]]:
+    """words with their inflections from before the rules were indexed"""
+    with open(INFLECTIONS, encoding="utf-8") as f:
+        next(f)
+        return [line.rstrip("\n").split("\t") for line in f]
+
+
+def test_inflections(inflections: List[List[str]]) -> None:
+    for word, plural, plural_adjective, plural_modern, singular in inflections:
+        assert lang.pluralize(word) == plural, word
+        assert lang.pluralize(word, pos=lang.ADJECTIVE) == plural_adjective, word
+        assert lang.pluralize(word, classical=False) == plural_modern, word
+        assert lang.singularize(word) == singular, word
+
+
+def test_inflect_many(inflections: List[List[str]]) -> None:
+    words = [row[0] for row in inflections] * 2
+    assert lang.pluralize_many(words) == [lang.pluralize(w) for w in words]
+    assert lang.singularize_many(words) == [lang.singularize(w) for w in words]
+    assert lang.pluralize_many([]) == lang.singularize_many([]) == []
+
+
+def test_custom_inflections() -> None:
+    assert lang.pluralize("child") == "children"
+    assert lang.pluralize("child", custom={"child": "childs"}) == "childs"
+    assert lang.pluralize("mother-in-law", custom={"mother": "moms"}) == "moms-in-law"
+    assert lang.singularize("children", custom={"children": "kid"}) == "kid"
+    assert lang.singularize("children") == "child"
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for the checksum manifest."""
+
+import gzip
+import hashlib
+import json
+from pathlib import Path
+from typing import Tuple, Type
+
+import pytest
+
+import lsde2021.download as dl
+import lsde2021.manifest as mf
+from tests.conftest import FileHandler
+
+
+def test_load_checksums(tmp_path: Path) -> None:
+    checksum_file = tmp_path / "enwiki-20211001-md5sums.txt"
+    checksum_file.write_text(
+        "0CC175B9C0F1B6A831C399E269772661  enwiki-20211001-page.sql.gz\n"
+        "\n"
+        "92eb5ffee6ae2fec3ad71c777531578f *enwiki-20211001-category.sql.gz\n"
+    )
+    assert mf.load_checksums(checksum_file) == {
+        "enwiki-20211001-page.sql.gz": "0cc175b9c0f1b6a831c399e269772661",
+        "enwiki-20211001-category.sql.gz": "92eb5ffee6ae2fec3ad71c777531578f",
+    }
+    manifest = mf.ChecksumManifest([checksum_file], state_file=tmp_path / "state")
+    assert manifest.hash_name == "md5"
+
+
+def test_manifest_download_and_verify(
+    server: Tuple[str, Type[FileHandler]],
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    url, handler = server
+    good = gzip.compress(b"INSERT INTO `page` VALUES (1,0,'Main_Page');\n" * 100)
+    bad = gzip.compress(b"not what the manifest says")
+    handler.files = {"/good.sql.gz": good, "/bad.sql.gz": bad}
+
+    checksum_file = tmp_path / "sha1sums.txt"
+    checksum_file.write_text(
+        f"{hashlib.sha1(good).hexdigest()}  good.sql.gz\n"
+        f"{hashlib.sha1(good).hexdigest()}  bad.sql.gz\n"
+    )
+    manifest = mf.ChecksumManifest([checksum_file], state_file=tmp_path / "state")
+    assert manifest.hash_name == "sha1"
+
+    downloaded = dict(
+        dl.download_files(
+            [(name, f"{url}/{name}") for name in ["good.sql.gz", "bad.sql.gz"]],
+            destination_func=lambda name: tmp_path / "dumps" / name,
+            max_retries=2,
+            retry_wait=0,
+            validate_file_func=manifest.validate_file,
+            stream_validator_func=manifest.stream_validator,
+        )
+    )
+    good_file = tmp_path / "dumps" / "good.sql.gz"
+    assert downloaded["good.sql.gz"] == good_file
+    assert downloaded["bad.sql.gz"] is None
+    assert not (tmp_path / "dumps" / "bad.sql.gz").exists()
+
+    # a later run accepts the verified file without reading it again
+    state = mf.ChecksumManifest([checksum_file], state_file=tmp_path / "state")
+
+    def fail(*args: object, **kwargs: object) -> str:
+        raise AssertionError("verified file should not be read again")
+
+    monkeypatch.setattr(mf, "hash_file", fail)
+    assert state.validate_file(good_file)
+
+    # but notices when the file changed
+    monkeypatch.undo()
+    good_file.write_bytes(bad)
+    assert not state.validate_file(good_file)
+
+
+def test_manifest_rejects_corrupt_complete_part(
+    server: Tuple[str, Type[FileHandler]], tmp_path: Path
+) -> None:
+    url, handler = server
+    data = gzip.compress(b"INSERT INTO `page` VALUES (1,0,'Main_Page');\n" * 100)
+    handler.files = {"/page.sql.gz": data}
+    checksum_file = tmp_path / "md5sums.txt"
+    checksum_file.write_text(f"{hashlib.md5(data).hexdigest()}  page.sql.gz\n")
+    manifest = mf.ChecksumManifest([checksum_file], state_file=tmp_path / "state")
+
+    # an interrupted download left a part of full length with a corrupt
+    # byte, the server answers the resume request with 416
+    destination = tmp_path / "page.sql.gz"
+    part_file = Path(f"{destination}.part")
+    part_file.write_bytes(data[:50] + bytes([data[50] ^ 0xFF]) + data[51:])
+    Path(f"{part_file}.json").write_text(json.dumps(dict(length=len(data))))
+
+    dl._download_file(
+        f"{url}/page.sql.gz",
+        destination,
+        max_retries=3,
+        retry_wait=0,
+        validate_file_func=manifest.validate_file,
+        stream_validator_func=manifest.stream_validator,
+    )
+    assert destination.read_bytes() == data
+    assert not part_file.exists()
+    state = mf.ChecksumManifest([checksum_file], state_file=tmp_path / "state")
+    assert state.validate_file(destination)
+    destination.write_bytes(data[:50] + bytes([data[50] ^ 0xFF]) + data[51:])
+    assert not state.validate_file(destination)
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for the parallel bz2 reader."""
+
+import bz2
+import concurrent.futures
+import random
+from pathlib import Path
+from typing import Any, Iterator
+
+import pytest
+
+import lsde2021.csv as csvutil
+import lsde2021.parallel_bz2 as pbz2
+import lsde2021.utils as utils
+
+
+def pageview_lines(n: int, seed: int = 0) -> bytes:
+    rng = random.Random(seed)
+    return b"".join(
+        b"en.wikipedia Page_%d %d desktop %d A%dB%d\n"
+        % (
+            rng.randrange(10**7),
+            rng.randrange(10**6),
+            rng.randrange(100),
+            rng.randrange(50),
+            rng.randrange(50),
+        )
+        for _ in range(n)
+    )
+
+
+@pytest.fixture
+def multi_block_file(tmp_path: Path) -> Path:
+    # level 1 uses 100k blocks, followed by a second stream
+    path = tmp_path / "pageviews-20210101-user.bz2"
+    path.write_bytes(
+        bz2.compress(pageview_lines(50_000), 1)
+        + bz2.compress(pageview_lines(1000, seed=1), 9)
+    )
+    return path
+
+
+def test_iter_segments(multi_block_file: Path) -> None:
+    segments = list(pbz2.iter_segments(multi_block_file))
+    assert len(segments) > 10
+    assert {s.level for s in segments} == {b"1", b"9"}
+    decompressed = b"".join(
+        pbz2.decompress_segment(multi_block_file, s)[0] for s in segments
+    )
+    assert decompressed == bz2.decompress(multi_block_file.read_bytes())
+
+
+def test_false_positive_markers_are_merged(multi_block_file: Path) -> None:
+    segments = list(pbz2.iter_segments(multi_block_file))
+    # pretend there is a marker in the middle of the first block
+    start, ends, level = segments[0]
+    fake = (start + ends[0]) // 2
+    data, consumed = pbz2.decompress_segment(
+        multi_block_file, pbz2.Segment(start, (fake,) + ends[:-1], level)
+    )
+    assert consumed == 2
+    assert data == pbz2.decompress_segment(multi_block_file, segments[0])[0]
+    with pytest.raises(OSError):
+        pbz2.decompress_segment(multi_block_file, pbz2.Segment(fake, ends, level))
+
+
+def test_iter_blocks_merges_false_positive_markers(
+    multi_block_file: Path, monkeypatch: Any
+) -> None:
+    segments = list(pbz2.iter_segments(multi_block_file))
+    start, ends, level = segments[0]
+    fake = (start + ends[0]) // 2
+    split = [
+        pbz2.Segment(start, (fake,) + ends[:-1], level),
+        pbz2.Segment(fake, ends, level),
+    ] + segments[1:]
+
+    def iter_split_segments(path: Path) -> Iterator[pbz2.Segment]:
+        return iter(split)
+
+    monkeypatch.setattr(pbz2, "iter_segments", iter_split_segments)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        blocks = list(pbz2.iter_blocks(multi_block_file, executor, prefetch=4))
+        sizes = list(pbz2.iter_blocks(multi_block_file, executor, 4, func=len))
+    assert [s.start for s, _ in blocks] == [s.start for s in segments]
+    assert blocks[0][0].ends == ends[:-1]
+    assert b"".join(data for _, data in blocks) == bz2.decompress(
+        multi_block_file.read_bytes()
+    )
+    assert sizes == [(s, len(data)) for s, data in blocks]
+
+
+def test_fopen_parallel(multi_block_file: Path) -> None:
+    expected = bz2.decompress(multi_block_file.read_bytes())
+    with utils.fopen(multi_block_file, mode="rb", processes=2) as f:
+        assert f.read(10) == expected[:10]
+        assert f.read() == expected[10:]
+
+    with utils.fopen(multi_block_file, mode="rt", processes=2) as f:
+        assert sum(1 for _ in f) == 51_000
+
+    with utils.fopen(multi_block_file, mode="rb", processes=2) as f:
+        df = csvutil.read_pageview_csv(f)
+    assert df.equals(csvutil.read_pageview_csv(multi_block_file))
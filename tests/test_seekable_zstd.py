@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for the seekable zstd files."""
+
+import io
+import bz2
+import random
+from pathlib import Path
+
+import pytest
+import zstandard
+
+import lsde2021.csv as csvutil
+import lsde2021.download as dl
+import lsde2021.seekable_zstd as szstd
+import lsde2021.utils as utils
+
+
+def pageview_lines(n: int, seed: int = 0) -> bytes:
+    rng = random.Random(seed)
+    return b"".join(
+        b"en.wikipedia Page_%d %d desktop %d A%dB%d\n"
+        % (
+            rng.randrange(10**7),
+            rng.randrange(10**6),
+            rng.randrange(100),
+            rng.randrange(50),
+            rng.randrange(50),
+        )
+        for _ in range(n)
+    )
+
+
+@pytest.fixture
+def content() -> bytes:
+    return pageview_lines(20_000)
+
+
+@pytest.fixture
+def seekable_file(tmp_path: Path, content: bytes) -> Path:
+    path = tmp_path / "pageviews-20210101-user.zst"
+    chunks = [content[i : i + 7000] for i in range(0, len(content), 7000)]
+    with open(path, "wb") as f:
+        szstd.write_seekable(chunks, f, frame_size=64 * 1024, threads=2)
+    return path
+
+
+def test_write_seekable(seekable_file: Path, content: bytes) -> None:
+    frames = szstd.read_frames(seekable_file)
+    assert len(frames) == -(-len(content) // (64 * 1024))
+    assert all(f.decompressed_size == 64 * 1024 for f in frames[:-1])
+    assert sum(f.decompressed_size for f in frames) == len(content)
+    assert b"".join(szstd.decompress_frame(seekable_file, f) for f in frames) == content
+    # regular zstd readers skip the seek table
+    with zstandard.open(seekable_file, "rb") as f:
+        assert f.read() == content
+    assert szstd.is_seekable(seekable_file)
+
+    plain = seekable_file.with_name("plain.zst")
+    plain.write_bytes(zstandard.ZstdCompressor().compress(content))
+    assert not szstd.is_seekable(plain)
+    with pytest.raises(OSError):
+        szstd.read_frames(plain)
+
+
+def test_seekable_reader(seekable_file: Path, content: bytes) -> None:
+    rng = random.Random(0)
+    with szstd.SeekableZstdReader(seekable_file, threads=2, prefetch=3) as raw:
+        with io.BufferedReader(raw, buffer_size=1000) as f:
+            assert f.read(10) == content[:10]
+            for _ in range(50):
+                offset = rng.randrange(len(content) + 10)
+                n = rng.randrange(200_000)
+                assert f.seek(offset) == offset
+                assert f.read(n) == content[offset : offset + n]
+                assert f.tell() == min(offset + n, max(offset, len(content)))
+            f.seek(-5, io.SEEK_END)
+            assert f.read() == content[-5:]
+            f.seek(100)
+            f.seek(50, io.SEEK_CUR)
+            assert f.read(5) == content[150:155]
+        assert raw.read_frame(1) == content[64 * 1024 : 128 * 1024]
+
+
+def test_fopen_zstd(seekable_file: Path, content: bytes) -> None:
+    with utils.fopen(seekable_file, mode="rb", processes=2) as f:
+        assert f.seekable()
+        assert f.read() == content
+    with utils.fopen(seekable_file, mode="rt", processes=2) as f:
+        assert sum(1 for _ in f) == 20_000
+    with utils.fopen(seekable_file, mode="rb", processes=2) as f:
+        df = csvutil.read_pageview_csv(f)
+    assert df.equals(csvutil.read_pageview_csv(io.BytesIO(content)))
+
+    plain = seekable_file.with_name("plain.zst")
+    plain.write_bytes(zstandard.ZstdCompressor().compress(content))
+    with utils.fopen(plain, mode="rb") as f:
+        assert f.read() == content
+
+
+@pytest.mark.parametrize("processes", [None, 2])
+def test_transcode_to_zstd(tmp_path: Path, processes: int) -> None:
+    content = pageview_lines(30_000)
+    path = tmp_path / "pageviews-20210101-user.bz2"
+    path.write_bytes(bz2.compress(content[:1000], 1) + bz2.compress(content[1000:], 1))
+    dest = dl.transcode_to_zstd(path, frame_size=100_000, processes=processes)
+    assert dest == tmp_path / "pageviews-20210101-user.zst"
+    assert path.exists()
+    assert not Path(f"{dest}.part").exists()
+    assert len(szstd.read_frames(dest)) == -(-len(content) // 100_000)
+    with utils.fopen(dest, mode="rb", processes=processes) as f:
+        assert f.read() == content
@@ -0,0 +1,381 @@
+import json
+import os
+import pickle
+import random
+import re
+import subprocess
+import sys
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import networkx as nx
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+import lsde2021.topics as topics
+
+CATEGORY_TITLES = [
+    "History_of_Germany",
+    "Sports_in_the_Netherlands",
+    "20th-century_conflicts_in_Europe",
+    "Buildings_and_structures_by_country",
+    "Football_clubs_in_Amsterdam",
+    "Science_fiction_novels",
+    "1990s_in_music",
+    "Economy_of_France",
+]
+
+WORDS_CHUNK_SCRIPT = """
+import json, sys
+import lsde2021.topics as topics
+print(json.dumps(topics._topic_words_chunk(json.load(sys.stdin))))
+"""
+
+
+@pytest.fixture
+def graph() -> nx.DiGraph:
+    """random category dag with a few cycles, pages link to categories"""
+    rng = random.Random(0)
+    g = nx.DiGraph()
+    categories = list(range(1000, 1200))
+    for i, c in enumerate(categories):
+        title = f"{CATEGORY_TITLES[i % len(CATEGORY_TITLES)]}_{i // 8}"
+        g.add_node(c, title=title, is_category=True)
+    for i, c in enumerate(categories):
+        for parent in rng.sample(categories[i + 1 :], min(3, len(categories) - i - 1)):
+            g.add_edge(c, parent)
+    for _ in range(10):
+        g.add_edge(rng.choice(categories[100:]), rng.choice(categories[:100]))
+    for page in range(1, 300):
+        g.add_node(page, title=f"Page_{page}", is_category=False)
+        for c in rng.sample(categories[:150], rng.randint(0, 4)):
+            g.add_edge(page, c)
+    return g
+
+
+def test_category_graph_from_networkx(graph: nx.DiGraph, tmp_path: Path) -> None:
+    csr = topics.CategoryGraph.from_networkx(graph)
+    csr.save(tmp_path / "graph")
+    loaded = topics.CategoryGraph.load(tmp_path / "graph")
+    for g in [csr, loaded, pickle.loads(pickle.dumps(loaded))]:
+        assert len(g) == graph.number_of_nodes()
+        assert g.number_of_edges() == graph.number_of_edges()
+        for node in graph.nodes:
+            assert g.neighbors(node) == list(graph.neighbors(node))
+            assert g.nodes[node]["title"] == graph.nodes[node]["title"]
+            assert g.nodes[node]["is_category"] == graph.nodes[node]["is_category"]
+        assert 999 not in g.nodes
+        with pytest.raises(KeyError):
+            g.neighbors(999)
+
+
+def test_find_topics_on_category_graph(graph: nx.DiGraph) -> None:
+    csr = topics.CategoryGraph.from_networkx(graph)
+    for page in range(1, 300):
+        assert topics.freq_bfs_tree(csr, page, depth_limit=4) == topics.freq_bfs_tree(
+            graph, page, depth_limit=4
+        )
+        assert topics.find_topics(page, csr) == topics.find_topics(page, graph)
+
+
+@pytest.mark.parametrize("max_categories", [1, 3, 5])
+def test_page_topics_table_matches_find_topics(
+    graph: nx.DiGraph, max_categories: int
+) -> None:
+    csr = topics.CategoryGraph.from_networkx(graph)
+    page_ids = np.array(list(range(1, 300)) + [5000, 1100])
+    for words in [None, topics.TopicWords.build(csr, processes=1)]:
+        table = topics.page_topics_table(
+            csr, page_ids, max_categories=max_categories, words=words
+        )
+        assert table.column("page_id").to_pylist() == list(range(1, 300)) + [1100]
+        for row in table.to_pylist():
+            found = topics.find_topics(
+                row["page_id"], graph, max_categories=max_categories
+            )
+            for level in range(1, topics.TOPIC_LEVELS + 1):
+                assert row[f"topics{level}"] == found.get(level, [])
+
+
+def test_category_graph_from_parquet(tmp_path: Path) -> None:
+    pages = pd.DataFrame(
+        dict(
+            page_id=[1, 2, 3, 10, 11, 12],
+            page_namespace=[0, 0, 0, 14, 14, 14],
+            page_title=["Amsterdam", "Redirect", "Orphan", "Cities", "Places", "Empty"],
+            page_is_redirect=[0, 1, 0, 0, 0, 0],
+        )
+    )
+    categorylinks = pd.DataFrame(
+        dict(
+            page_id=[1, 1, 2, 10, 1],
+            category_name=["Cities", "Missing", "Cities", "Places", "Cities"],
+        )
+    )
+    pages.to_parquet(tmp_path / "page.parquet")
+    categorylinks.to_parquet(tmp_path / "categorylinks.parquet")
+    g = topics.CategoryGraph.from_parquet(
+        tmp_path / "page.parquet", tmp_path / "categorylinks.parquet"
+    )
+    assert list(g.nodes) == [1, 10, 11]
+    assert g.neighbors(1) == [10]
+    assert g.neighbors(10) == [11]
+    assert g.neighbors(11) == []
+    assert g.nodes[10] == dict(title="Cities", is_category=True)
+
+
+@pytest.mark.parametrize("depth_limit", [None, 0, 2, 4])
+def test_freq_bfs_trees(graph: nx.DiGraph, depth_limit: Optional[int]) -> None:
+    # self loops and duplicate start nodes are valid
+    graph.add_edge(1000, 1000)
+    nodes = list(range(1, 300)) + [1000, 1000, 1150]
+    # nodes with equal counts are ordered by id by both
+    expected = [
+        topics.freq_bfs_tree(graph, node, depth_limit=depth_limit) for node in nodes
+    ]
+    csr = topics.CategoryGraph.from_networkx(graph)
+    for batch_size in [1, 7, 1000]:
+        got = topics.freq_bfs_trees(
+            csr, nodes, depth_limit=depth_limit, batch_size=batch_size
+        )
+        assert got == expected
+
+
+def test_topic_words(graph: nx.DiGraph, tmp_path: Path) -> None:
+    csr = topics.CategoryGraph.from_networkx(graph)
+    words = topics.TopicWords.build(csr, processes=1)
+    assert len(words) == 200
+    words.save(tmp_path / "graph")
+    loaded = topics.TopicWords.load(tmp_path / "graph")
+    for c in range(1000, 1200):
+        expected = topics.topic_words(graph.nodes[c]["title"])
+        assert loaded.get(c) == words.get(c) == expected
+    assert words.get(1) is None and words.get(999) is None
+    for page in range(1, 300):
+        found = topics.find_topics(page, csr, words=loaded)
+        assert found == topics.find_topics(page, graph)
+
+    # words from worker processes are ordered like the serial split
+    parallel = topics.TopicWords.build(graph, processes=2, chunk_size=16)
+    for c in range(1000, 1200):
+        assert parallel.get(c) == words.get(c)
+
+    # worker processes may have another hash seed than the parent
+    titles = [graph.nodes[c]["title"] for c in range(1000, 1200)]
+    for seed in ["1", "2"]:
+        out = subprocess.run(
+            [sys.executable, "-c", WORDS_CHUNK_SCRIPT],
+            input=json.dumps(titles),
+            capture_output=True,
+            text=True,
+            check=True,
+            env={**os.environ, "PYTHONHASHSEED": seed},
+        )
+        assert json.loads(out.stdout) == topics._topic_words_chunk(titles)
+
+    # categories missing from the table fall back to splitting the title
+    partial = topics.TopicWords.from_words([1000], [["Custom"]])
+    graph.add_edge(300, 1000)
+    graph.nodes[300].update(title="Page_300", is_category=False)
+    csr = topics.CategoryGraph.from_networkx(graph)
+    found = topics.find_topics(300, csr, words=partial)
+    assert found[1] == ["Custom"]
+    assert found[2] == topics.find_topics(300, graph)[2]
+
+
+def test_split_by_pattern_matches_first_rule() -> None:
+    def reference(s: str) -> Tuple[List[str], bool]:
+        for pattern, _ in topics.patterns:
+            match = re.fullmatch(pattern, s)
+            if match:
+                return list(match.groups()), True
+        return [s], False
+
+    assert all("_" in pattern.pattern for pattern, _ in topics.patterns)
+    rng = random.Random(0)
+    parts = ["20th-century", "1990s", "1990", "Sports", "the", "Netherlands"]
+    parts += ["in", "of", "and", "by", "country", "year", "based", "subject"]
+    parts += ["established", "legal", "status", "date", "decade", "Ä", "x y"]
+    titles = CATEGORY_TITLES + ["", "_", "Music", "1990_\n"]
+    titles += ["_".join(rng.choices(parts, k=rng.randint(1, 7))) for _ in range(5000)]
+    for title in titles:
+        assert topics.split_by_pattern(title) == reference(title), title
+
+
+def test_map_topics_resumes(graph: nx.DiGraph, tmp_path: Path) -> None:
+    csr = topics.CategoryGraph.from_networkx(graph)
+    csr.save(tmp_path / "graph")
+    words = topics.TopicWords.build(csr, processes=1)
+    words.save(tmp_path / "graph")
+    page_ids = list(range(1, 300)) + [5000]
+    dest = tmp_path / "topics"
+
+    topics.map_topics(page_ids, tmp_path / "graph", dest, unit_size=64, processes=2)
+    assert (dest / "_SUCCESS").exists()
+    parts = sorted(dest.glob("part-*.parquet"))
+    assert [p.name for p in parts] == [f"part-{i:06d}.parquet" for i in range(5)]
+    table = topics.read_topics(dest)
+    assert table.schema == topics.TOPIC_IDS_SCHEMA
+    expected = topics.page_topics_table(csr, np.array(page_ids), words=words)
+    decoded = topics.read_topics(dest, decode=True)
+    assert decoded.sort_by("page_id").equals(expected)
+    assert table.num_rows == 299
+    incidence = topics.TopicIncidence.from_parquet(dest, 2)
+    reference = topics.TopicIncidence.from_table(
+        expected, 2, vocabulary=incidence.vocabulary
+    )
+    assert (incidence.matrix != reference.matrix).nnz == 0
+
+    # an interrupted job only recomputes the missing units
+    mtimes = {p: p.stat().st_mtime_ns for p in parts}
+    parts[2].unlink()
+    (dest / "_SUCCESS").unlink()
+    (dest / ".part-000003.parquet.tmp").write_bytes(b"partial")
+    topics.map_topics(page_ids, tmp_path / "graph", dest, unit_size=64, processes=1)
+    assert not (dest / ".part-000003.parquet.tmp").exists()
+    for part in parts[:2] + parts[3:]:
+        assert part.stat().st_mtime_ns == mtimes[part]
+    assert topics.read_topics(dest, decode=True).sort_by("page_id").equals(expected)
+    assert pq.read_schema(parts[2]) == topics.TOPIC_IDS_SCHEMA
+
+    with pytest.raises(ValueError):
+        topics.map_topics(page_ids[1:], tmp_path / "graph", dest, unit_size=64)
+
+
+def test_map_topics_resumes_with_new_labels(graph: nx.DiGraph, tmp_path: Path) -> None:
+    page_ids = list(range(1, 300))
+    dest = tmp_path / "topics"
+    topics.CategoryGraph.from_networkx(graph).save(tmp_path / "graph")
+    topics.map_topics(page_ids, tmp_path / "graph", dest, unit_size=64, processes=1)
+    before = topics.TopicDictionary.load(topics.topic_dictionary_file(dest))
+    decoded = topics.read_topics(dest, decode=True)
+
+    # a part recomputed with a changed graph has labels the dictionary lacks
+    for node, data in graph.nodes(data=True):
+        if data["is_category"]:
+            data["title"] = "Zoology_of_" + data["title"]
+    csr = topics.CategoryGraph.from_networkx(graph)
+    csr.save(tmp_path / "changed")
+    part = topics.topic_part_file(dest, 2)
+    part.unlink()
+    (dest / "_SUCCESS").unlink()
+    topics.map_topics(page_ids, tmp_path / "changed", dest, unit_size=64, processes=1)
+
+    after = topics.TopicDictionary.load(topics.topic_dictionary_file(dest))
+    assert len(after) > len(before)
+    assert after.to_table().slice(0, len(before)).equals(before.to_table())
+    assert "Zoology" in after.levels[0]
+    changed = topics.page_topics_table(csr, np.array(page_ids[128:192]))
+    assert after.decode(pq.read_table(part)).equals(changed)
+    resumed = topics.read_topics(dest, decode=True).sort_by("page_id")
+    kept = pa.concat_tables([decoded.slice(0, 128), decoded.slice(192)])
+    assert pa.concat_tables([resumed.slice(0, 128), resumed.slice(192)]).equals(kept)
+
+
+def test_topic_incidence(tmp_path: Path) -> None:
+    rng = np.random.default_rng(0)
+    words = ["Music", "Sports", "History", "Science", "Films", "Books"]
+    page_ids = rng.permutation(np.arange(1, 2000))[:500]
+    table = pa.table(
+        {
+            "page_id": page_ids.astype(np.int32),
+            **{
+                f"topics{level}": [
+                    list(rng.choice(words, rng.integers(0, 4), replace=False))
+                    for _ in page_ids
+                ]
+                for level in range(1, 5)
+            },
+        },
+        schema=topics.TOPICS_SCHEMA,
+    )
+    vocabulary = topics.topic_vocabulary(table)
+    assert vocabulary == sorted(words)
+
+    # views of a few days, with pages without topics, duplicates and nulls
+    days = 3
+    view_ids = np.concatenate([page_ids[:300], page_ids[:20], np.arange(3000, 3050)])
+    views = rng.integers(0, 100, (len(view_ids), days)).astype(np.float64)
+    views[5, 1] = np.nan
+
+    pq.write_table(table, tmp_path / "topics.parquet")
+    for level in range(1, 5):
+        incidence = topics.TopicIncidence.from_parquet(
+            tmp_path / "topics.parquet", level
+        )
+        incidence.save(tmp_path / f"level{level}")
+        loaded = topics.TopicIncidence.load(tmp_path / f"level{level}")
+        assert loaded.vocabulary == vocabulary
+        assert (loaded.matrix != incidence.matrix).nnz == 0
+
+        # join, explode and group by like the spark job
+        df = pd.DataFrame({"page_id": view_ids})
+        for day in range(days):
+            df[f"day{day}"] = views[:, day]
+        df = df.merge(table.to_pandas(), on="page_id")
+        df = df.explode(f"topics{level}").dropna(subset=[f"topics{level}"])
+        expected = df.groupby(f"topics{level}").agg(
+            **{f"day{d}": (f"day{d}", "sum") for d in range(days)},
+            pages=("page_id", "count"),
+        )
+        expected = expected.reindex(vocabulary, fill_value=0)
+
+        totals = loaded.topic_totals(view_ids, views)
+        assert totals.shape == (len(vocabulary), days)
+        for day in range(days):
+            np.testing.assert_array_equal(totals[:, day], expected[f"day{day}"])
+            np.testing.assert_array_equal(
+                loaded.topic_totals(view_ids, views[:, day]), expected[f"day{day}"]
+            )
+        counts = loaded.topic_page_counts(view_ids)
+        np.testing.assert_array_equal(counts, expected["pages"])
+
+
+def test_topic_dictionary(tmp_path: Path) -> None:
+    rng = np.random.default_rng(1)
+    words = ["Music", "Sports", "History", "Science", "Films", "Books"]
+    table = pa.table(
+        {
+            "page_id": np.arange(200, dtype=np.int32),
+            **{
+                f"topics{level}": [
+                    list(rng.choice(words[level:], rng.integers(0, 3), replace=False))
+                    for _ in range(200)
+                ]
+                for level in range(1, 5)
+            },
+        },
+        schema=topics.TOPICS_SCHEMA,
+    )
+    dictionary = topics.TopicDictionary.from_tables(
+        iter([table.slice(0, 50), table.slice(50)])
+    )
+    assert dictionary.levels == [sorted(words[level:]) for level in range(1, 5)]
+    assert len(dictionary) == 5 + 4 + 3 + 2
+    dictionary.save(tmp_path / "dictionary.parquet")
+    loaded = topics.TopicDictionary.load(tmp_path / "dictionary.parquet")
+    assert loaded.levels == dictionary.levels
+
+    encoded = loaded.encode(table.slice(10))
+    assert encoded.schema == topics.TOPIC_IDS_SCHEMA
+    assert loaded.decode(encoded).equals(table.slice(10))
+    level2 = encoded.column("topics2").to_pylist()[0]
+    assert loaded.label(level2) == table.column("topics2").to_pylist()[10]
+    assert loaded.label(int(loaded.level_ids[2][0])) == sorted(words[3:])[0]
+
+    for level in range(1, 5):
+        incidence = topics.TopicIncidence.from_ids(encoded, level, loaded)
+        expected = topics.TopicIncidence.from_table(
+            table.slice(10), level, vocabulary=loaded.levels[level - 1]
+        )
+        assert incidence.vocabulary == expected.vocabulary
+        assert (incidence.matrix != expected.matrix).nnz == 0
+
+    other = table.set_column(
+        1, "topics1", pa.array([["Unknown"]] * 200, pa.list_(pa.string()))
+    )
+    with pytest.raises(KeyError):
+        loaded.encode(other)
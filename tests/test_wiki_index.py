@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for the wiki_code index of pageview_complete files."""
+
+import os
+import bz2
+import datetime
+import random
+from pathlib import Path
+from typing import List
+
+import pytest
+
+import lsde2021.csv as csvutil
+import lsde2021.download as dl
+import lsde2021.parallel_bz2 as pbz2
+import lsde2021.wiki_index as wiki_index
+
+# a small wiki inside a block, wikis that span many blocks and a wiki that
+# appears twice, because the files are not guaranteed to be sorted
+WIKIS = [("ab.wikipedia", 3), ("de.wikipedia", 20_000), ("en.wikipedia", 40_000)]
+WIKIS += [("fy.wikipedia", 50), ("nl.wikipedia", 9000), ("ab.wikipedia", 10)]
+
+
+def pageview_lines(seed: int = 0) -> List[bytes]:
+    rng = random.Random(seed)
+    return [
+        b"%s Page_%d %d desktop %d A%d"
+        % (
+            wiki.encode(),
+            rng.randrange(10**7),
+            rng.randrange(10**6),
+            rng.randrange(100),
+            rng.randrange(50),
+        )
+        for wiki, n in WIKIS
+        for _ in range(n)
+    ]
+
+
+@pytest.fixture
+def pageview_file(tmp_path: Path) -> Path:
+    path = tmp_path / "pageviews-20210101-user.bz2"
+    # level 1 uses 100k blocks, the last line does not end with a newline
+    path.write_bytes(bz2.compress(b"\n".join(pageview_lines()), 1))
+    return path
+
+
+def expected_lines(wikis: List[str]) -> bytes:
+    lines = [line for line in pageview_lines() if line.split(b" ")[0].decode() in wikis]
+    return b"".join(line + b"\n" for line in lines)
+
+
+def test_wiki_index(pageview_file: Path) -> None:
+    index = wiki_index.WikiIndex.build(pageview_file, processes=2)
+    assert len(index.blocks) == len(list(pbz2.iter_segments(pageview_file)))
+    assert len(index.blocks) > 20
+    assert sorted(index.wikis) == sorted({wiki for wiki, _ in WIKIS})
+    assert [r.lines for r in index.wikis["ab.wikipedia"]] == [3, 10]
+    assert sum(r.lines for r in index.ranges([w for w, _ in WIKIS])) == sum(
+        n for _, n in WIKIS
+    )
+    fy = index.wikis["fy.wikipedia"][0]
+    assert fy.first_line == 60_003
+    assert fy.end_block - fy.start_block <= 1
+
+    singles = [[wiki] for wiki in index.wikis]
+    for wikis in singles + [["nl.wikipedia", "de.wikipedia"]]:
+        for processes in [1, 2]:
+            lines = wiki_index.read_wiki_lines(
+                pageview_file, wikis, index=index, processes=processes
+            )
+            assert lines == expected_lines(wikis)
+    assert wiki_index.read_wiki_lines(pageview_file, ["xx.wikipedia"], index) == b""
+
+
+def test_wiki_index_sidecar(pageview_file: Path) -> None:
+    index = wiki_index.load_wiki_index(pageview_file, processes=1)
+    sidecar = wiki_index.wiki_index_file(pageview_file)
+    assert sidecar.exists()
+    loaded = wiki_index.WikiIndex.load(sidecar)
+    assert loaded.blocks == index.blocks
+    assert loaded.block_sizes == index.block_sizes
+    assert loaded.wikis == index.wikis
+    assert loaded.is_current(pageview_file)
+
+    # a file that was downloaded again is indexed again
+    pageview_file.write_bytes(bz2.compress(b"\n".join(pageview_lines()[:100]), 9))
+    os.utime(pageview_file, ns=(0, 0))
+    assert not loaded.is_current(pageview_file)
+    rebuilt = wiki_index.load_wiki_index(pageview_file, processes=1)
+    assert [r.lines for r in rebuilt.wikis["ab.wikipedia"]] == [3]
+    assert wiki_index.WikiIndex.load(sidecar).wikis == rebuilt.wikis
+
+
+def test_read_pageview_wikis(pageview_file: Path, tmp_path: Path) -> None:
+    date = datetime.date(2021, 1, 1)
+    path = (
+        tmp_path
+        / "pageviews"
+        / Path("/".join(dl.wikimedia_pageview_complete_local_file(date)))
+    )
+    path.parent.mkdir(parents=True)
+    pageview_file.rename(path)
+
+    df = wiki_index.read_pageview_wikis(
+        date, ["fy.wikipedia", "ab.wikipedia"], tmp_path / "pageviews", processes=1
+    )
+    full = csvutil.read_pageview_csv(path)
+    expected = full[full["wiki_code"].isin(["fy.wikipedia", "ab.wikipedia"])]
+    assert len(df) == 63
+    assert df["page_id"].equals(expected["page_id"].reset_index(drop=True))
+    assert df["page_title"].equals(expected["page_title"].reset_index(drop=True))
+    assert list(df["wiki_code"]) == list(expected["wiki_code"])